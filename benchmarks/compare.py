@@ -0,0 +1,40 @@
+"""Compare two benchmark result files, e.g. from before and after a change."""
+import argparse
+import json
+
+from mozilla_addon_signer.utils import format_table
+
+
+def result_key(result):
+    return (result['name'], json.dumps(result['params'], sort_keys=True))
+
+
+def compare(before, after, stat='median'):
+    old = dict((result_key(r), r) for r in before['results'])
+    rows = []
+    for result in after['results']:
+        previous = old.get(result_key(result))
+        if not previous:
+            continue
+        ratio = result[stat] / previous[stat] if previous[stat] else float('inf')
+        rows.append([
+            result['name'],
+            result['params'].get('xpi', ''),
+            '{:.3f}'.format(previous[stat] * 1000),
+            '{:.3f}'.format(result[stat] * 1000),
+            '{:.2f}x'.format(ratio),
+        ])
+    return format_table(['benchmark', 'xpi', 'before (ms)', 'after (ms)', 'ratio'], rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('before', type=argparse.FileType('r'))
+    parser.add_argument('after', type=argparse.FileType('r'))
+    parser.add_argument('--stat', choices=['min', 'median', 'mean'], default='median')
+    args = parser.parse_args(argv)
+    print(compare(json.load(args.before), json.load(args.after), stat=args.stat))
+
+
+if __name__ == '__main__':
+    main()
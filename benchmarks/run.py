@@ -0,0 +1,250 @@
+"""Run the benchmark suite and print the results as JSON.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import timeit
+import zipfile
+
+from benchmarks import stubs
+from benchmarks.xpigen import BOOTSTRAPPED, WEB_EXTENSION, make_xpi
+
+
+MB = 1024 * 1024
+
+# (name, layout, size, members, locales)
+XPI_PROFILES = [
+    ('webext-small', WEB_EXTENSION, 64 * 1024, 5, 0),
+    ('webext-many-members', WEB_EXTENSION, 8 * MB, 2000, 0),
+    ('webext-large', WEB_EXTENSION, 64 * MB, 20, 0),
+    ('bootstrapped-localized', BOOTSTRAPPED, 1 * MB, 20, 500),
+]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(name, fn, repeat, number=1, **params):
+    times = [t / number for t in timeit.Timer(fn).repeat(repeat=repeat, number=number)]
+    times.sort()
+    return {
+        'name': name,
+        'params': params,
+        'repeat': repeat,
+        'number': number,
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+    }
+
+
+def make_changed_copy(src, dest):
+    """Copy an XPI with one small member changed, as in the next build of an add-on."""
+    with zipfile.ZipFile(src) as zin, zipfile.ZipFile(dest, 'w') as zout:
+        for info in zin.infolist():
+            data = zin.read(info)
+            if info.filename == 'manifest.json':
+                data += b'\n'
+            zout.writestr(info, data)
+    return dest
+
+
+def run_micro(workdir, repeat, quick):
+    from mozilla_addon_signer.diff import diff_xpis
+    from mozilla_addon_signer.signature import verify_path
+    from mozilla_addon_signer.xpi import XPI
+
+    results = []
+    for name, layout, size, members, locales in XPI_PROFILES:
+        if quick:
+            size, members = size // 16, max(members // 16, 1)
+        path = make_xpi(os.path.join(workdir, name + '.xpi'), layout=layout, size=size,
+                        members=members, locales=locales, signed=True)
+        params = {'xpi': name, 'size': size, 'members': members,
+                  'file_size': os.path.getsize(path)}
+        xpi = XPI(path)
+
+        def sha256sum():
+            xpi._hashed = None
+            return xpi.sha256sum
+
+        results.append(measure('xpi.load', lambda: XPI(path), repeat, number=10, **params))
+        results.append(measure('xpi.sha256sum', sha256sum, repeat, **params))
+        results.append(measure('xpi.suggested_filename',
+                               lambda: xpi.suggested_filename(mark_signed=True),
+                               repeat, number=1000, **params))
+        results.append(measure('signature.verify', lambda: verify_path(path), repeat, **params))
+
+        changed = make_changed_copy(path, os.path.join(workdir, name + '-changed.xpi'))
+        results.append(measure('xpi.diff', lambda: diff_xpis(XPI(path), XPI(changed)),
+                               repeat, **params))
+
+    results.extend(run_registry(workdir, repeat, 20000 if quick else 200000))
+    return results
+
+
+def run_registry(workdir, repeat, rows):
+    from mozilla_addon_signer.registry import Registry
+
+    registry = Registry(os.path.join(workdir, 'registry.sqlite'))
+    conn = registry._connect(create=True)
+    with conn:
+        conn.executemany(
+            'INSERT INTO signings (addon_id, version, checksum, signed_checksum, addon_type, '
+            'env, bug, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (('addon-{}@mozilla.com'.format(i % 5000), '1.0.{}'.format(i // 5000),
+              '{:064x}'.format(i), '{:064x}'.format(i + rows), 'system', 'prod',
+              100000 + i, i, i) for i in range(rows)))
+
+    middle = rows // 2
+    params = {'rows': rows}
+    return [
+        measure('registry.find_version', lambda: registry.find(
+            addon_id='addon-{}@mozilla.com'.format(middle % 5000),
+            version='1.0.{}'.format(middle // 5000)), repeat, number=100, **params),
+        measure('registry.find_checksum', lambda: registry.find(
+            checksum='{:064x}'.format(middle)), repeat, number=100, **params),
+        measure('registry.find_bug', lambda: registry.find(bug=100000 + middle),
+                repeat, number=100, **params),
+    ]
+
+
+def invoke(args, input=None):
+    from click.testing import CliRunner
+    from mozilla_addon_signer.cli import cli
+
+    # Always in-process: a running daemon would sign with the user's real AWS account.
+    args = ['--no-daemon'] + list(args)
+    result = CliRunner().invoke(cli, args, input=input, catch_exceptions=False)
+    if result.exit_code != 0:
+        raise RuntimeError('`{}` failed:\n{}'.format(' '.join(args), result.output))
+
+
+def run_e2e(workdir, repeat, quick):
+    from mozilla_addon_signer import cli
+    from mozilla_addon_signer.bugzilla import BugzillaAPI
+    from mozilla_addon_signer.config import config
+    from mozilla_addon_signer.signing import Signer
+
+    size = 4 * MB if quick else 32 * MB
+    src = make_xpi(os.path.join(workdir, 'addon.xpi'), size=size, members=50,
+                   compressible=False)
+    params = {'size': size, 'file_size': os.path.getsize(src)}
+    # Transfer timings are only meaningful if the file really is ``size`` bytes.
+    assert params['file_size'] >= size, params
+    s3_root = os.path.join(workdir, 's3')
+    out = os.path.join(workdir, 'out')
+    os.mkdir(out)
+
+    # Never touch the user's real configuration, caches, AWS account or Bugzilla.
+    config.path = os.path.join(workdir, 'config')
+    config.set('cache.path', os.path.join(workdir, 'cache'))
+    config.set('registry.path', os.path.join(workdir, 'registry.sqlite'))
+    session = stubs.StubSession(s3_root)
+    make_signer, api_base, state_path = (cli.make_signer, BugzillaAPI.api_base,
+                                         cli.DAEMON_STATE_PATH)
+    cli.DAEMON_STATE_PATH = os.path.join(workdir, 'daemon.json')
+    cli.make_signer = lambda profile=None, bucket_name=None: Signer(
+        bucket_name='bench-input', session=session,
+        content_addressed=config.get_bool('s3.content_addressed'))
+
+    def dest():
+        path = os.path.join(out, 'signed.xpi')
+        for name in ('signed.xpi', 'signed-stage.xpi', 'signed-prod.xpi'):
+            if os.path.exists(os.path.join(out, name)):
+                os.remove(os.path.join(out, name))
+        return path
+
+    sign = ['-t', 'system', '-e', 'stage']
+
+    def content_addressed(args):
+        config.set('s3.content_addressed', 'true')
+        try:
+            invoke(args)
+        finally:
+            config.delete('s3.content_addressed')
+    results = []
+    try:
+        with stubs.StubServer() as server:
+            BugzillaAPI.api_base = server.url + '/rest'
+            url = server.add_file('addon.xpi', src)
+            server.add_attachment(1234, 5678, src)
+
+            def clear_cache():
+                shutil.rmtree(os.path.join(workdir, 'cache'), ignore_errors=True)
+
+            cases = [
+                ('e2e.sign', lambda: invoke(['sign', '--no-cache'] + sign + [src, dest()])),
+                ('e2e.sign.no_verify', lambda: invoke(
+                    ['sign', '--no-cache', '--no-verify'] + sign + [src, dest()])),
+                ('e2e.sign.cached', lambda: invoke(['sign'] + sign + [src, dest()])),
+                ('e2e.sign.content_addressed', lambda: content_addressed(
+                    ['sign', '--no-cache'] + sign + [src, dest()])),
+                ('e2e.sign.two_envs', lambda: invoke(
+                    ['sign', '--no-cache'] + sign + ['-e', 'prod', src, dest()])),
+                ('e2e.sign_from_url', lambda: invoke(
+                    ['sign-from-url', '--no-cache'] + sign + [url, dest()])),
+                # Downloads, verifies and then attaches; the two transfers do not overlap.
+                ('e2e.sign_from_bug', lambda: invoke(
+                    ['sign-from-bug', '--no-cache', '-k', 'key'] + sign + ['1234'],
+                    input='0\n')),
+            ]
+            clear_cache()
+            invoke(['sign'] + sign + [src, dest()])
+            for name, fn in cases:
+                results.append(measure(name, fn, repeat, **params))
+    finally:
+        cli.make_signer, BugzillaAPI.api_base, cli.DAEMON_STATE_PATH = (
+            make_signer, api_base, state_path)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', '-o', help='Write the results to this file.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help='Use much smaller XPIs.')
+    parser.add_argument('--only', choices=['micro', 'e2e'], default=None)
+    args = parser.parse_args(argv)
+
+    workdir = stubs.make_workdir()
+    try:
+        results = []
+        if args.only in (None, 'micro'):
+            results.extend(run_micro(workdir, args.repeat, args.quick))
+        if args.only in (None, 'e2e'):
+            results.extend(run_e2e(workdir, args.repeat, args.quick))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': int(time.time()),
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
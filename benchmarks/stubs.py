@@ -0,0 +1,196 @@
+"""Local stand-ins for S3, Lambda and Bugzilla used by the end-to-end benchmarks."""
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse
+
+from benchmarks.xpigen import sign_xpi_data
+
+
+class StubS3(object):
+    """Keeps objects as files in a temporary directory, mimicking the boto3 client calls."""
+
+    def __init__(self, root):
+        self.root = root
+        self.metadata = {}
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key.replace('/', '_'))
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None, ExtraArgs=None):
+        self.metadata[(bucket, key)] = (ExtraArgs or {}).get('Metadata', {})
+        path = self._path(bucket, key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            for chunk in iter(lambda: fileobj.read(Config.multipart_chunksize), b''):
+                f.write(chunk)
+
+    def _etag(self, path):
+        return '"{}"'.format(os.stat(path).st_mtime_ns)
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        from botocore.exceptions import ClientError
+
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        if IfMatch and IfMatch != self._etag(path):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        if Range is None:
+            return {'Body': open(path, 'rb'), 'ContentLength': os.path.getsize(path)}
+        start, end = [int(n) for n in Range[len('bytes='):].split('-')]
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        self.get_object(Bucket, Key)['Body'].close()
+        return {'Metadata': self.metadata.get((Bucket, Key), {}),
+                'ContentLength': os.path.getsize(path), 'ETag': self._etag(path)}
+
+    def delete_object(self, Bucket, Key):
+        if os.path.exists(self._path(Bucket, Key)):
+            os.remove(self._path(Bucket, Key))
+
+    def copy_object(self, Bucket, Key, CopySource):
+        path = self._path(Bucket, Key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        shutil.copyfile(self._path(CopySource['Bucket'], CopySource['Key']), path)
+        self.metadata[(Bucket, Key)] = self.metadata.get(
+            (CopySource['Bucket'], CopySource['Key']), {})
+
+
+class StubLambda(object):
+    """Signs synchronously by adding META-INF files that pass `verify`."""
+
+    OUTPUT_BUCKET = 'signed'
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse'):
+        payload = json.loads(Payload)
+        source = payload['source']
+        # Each function writes its own output, as one upload may be signed in several envs.
+        key = '{}/{}'.format(FunctionName, source['key'].replace('.xpi', '-signed.xpi'))
+        dest = self.s3._path(self.OUTPUT_BUCKET, key)
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        sign_xpi_data(self.s3._path(source['bucket'], source['key']), dest)
+        body = json.dumps({'uploaded': {'bucket': self.OUTPUT_BUCKET, 'key': key}})
+        return {'StatusCode': 200, 'Payload': io.BytesIO(body.encode('utf-8'))}
+
+
+class StubSession(object):
+    def __init__(self, root):
+        s3 = StubS3(root)
+        self.clients = {'s3': s3, 'lambda': StubLambda(s3)}
+
+    def client(self, name):
+        return self.clients[name]
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves just enough of the Bugzilla REST API for `sign_from_bug`, plus static files."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, status=200, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data).encode('utf-8'),
+                       headers={'Content-Type': 'application/json'})
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path.split('/')[1:]
+
+        if path[0] == 'files' and path[1] in server.files:
+            with open(server.files[path[1]], 'rb') as f:
+                self.send_body(f.read(), headers={'ETag': '"{}"'.format(path[1])})
+        elif path == ['rest', 'whoami']:
+            self.send_json({'name': 'benchmarks@example.com'})
+        elif path == ['rest', 'bug']:
+            self.send_json({'bugs': [{'id': bug, 'flags': []} for bug in server.attachments]})
+        elif path[:2] == ['rest', 'bug'] and path[-1] == 'attachment':
+            bug = path[2]
+            self.send_json({'bugs': {bug: [dict(a, data=None) for a in server.attachments[bug]]}})
+        elif path[:3] == ['rest', 'bug', 'attachment']:
+            attachment = server.attachment_files[path[3]]
+            with open(attachment, 'rb') as f:
+                data = base64.b64encode(f.read()).decode()
+            self.send_json({'attachments': {path[3]: {'data': data}}})
+        else:
+            self.send_body(b'', status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        while length:
+            length -= len(self.rfile.read(min(length, 64 * 1024)))
+        self.send_json({'ids': [1]})
+
+    do_PUT = do_POST
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class StubServer(object):
+    """A threaded local HTTP server serving Bugzilla attachments and plain files."""
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.files = {}
+        self.server.attachments = {}
+        self.server.attachment_files = {}
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def add_file(self, name, path):
+        self.server.files[name] = path
+        return '{}/files/{}'.format(self.url, name)
+
+    def add_attachment(self, bug_number, attachment_id, path):
+        self.server.attachments.setdefault(str(bug_number), []).append({
+            'id': attachment_id,
+            'file_name': os.path.basename(path),
+            'summary': os.path.basename(path),
+            'creator': 'benchmarks@example.com',
+            'content_type': 'application/x-xpinstall',
+            'is_obsolete': 0,
+        })
+        self.server.attachment_files[str(attachment_id)] = path
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_workdir():
+    return tempfile.mkdtemp(prefix='mozilla-addon-signer-bench-')
@@ -0,0 +1,157 @@
+"""Generate synthetic XPIs of a given size and member count for benchmarking."""
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import os
+import random
+import zipfile
+
+
+WEB_EXTENSION = 'webextension'
+BOOTSTRAPPED = 'bootstrapped'
+LAYOUTS = [WEB_EXTENSION, BOOTSTRAPPED]
+
+INSTALL_RDF = '''<?xml version="1.0" encoding="utf-8"?>
+<RDF xmlns="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+     xmlns:em="http://www.mozilla.org/2004/em-rdf#">
+  <Description about="urn:mozilla:install-manifest">
+    <em:id>{id}</em:id>
+    <em:type>2</em:type>
+    <em:bootstrap>true</em:bootstrap>
+    <em:targetApplication>
+      <Description>
+        <em:id>{{ec8030f7-c20a-464f-9b0e-13a3a9e97384}}</em:id>
+        <em:minVersion>55.0</em:minVersion>
+        <em:maxVersion>*</em:maxVersion>
+      </Description>
+    </em:targetApplication>
+{localized}
+    <em:version>{version}</em:version>
+    <em:name>Benchmark Addon</em:name>
+  </Description>
+</RDF>
+'''
+
+LOCALIZED = '''    <em:localized>
+      <Description>
+        <em:locale>{locale}</em:locale>
+        <em:name>Benchmark Addon ({locale})</em:name>
+        <em:description>{description}</em:description>
+      </Description>
+    </em:localized>'''
+
+
+def member_data(rng, size, compressible):
+    if compressible:
+        # Source-like text compresses much like real add-on scripts do.
+        words = ['var', 'function', 'return', 'this', 'const', 'let', '{', '}', ';', '\n']
+        text = ' '.join(rng.choice(words) for _ in range(size // 4 + 1))
+        return text.encode('ascii')[:size]
+    # Every byte is random, so deflate can not shrink the member and the archive is
+    # about as large as ``size``.
+    return binascii.unhexlify('{:0{}x}'.format(rng.getrandbits(8 * size), 2 * size))
+
+
+def make_xpi(path, layout=WEB_EXTENSION, size=1024 * 1024, members=10, addon_id=None,
+             version='1.0', locales=0, compressible=True, signed=False, seed=0):
+    """Write a synthetic XPI to ``path`` and return ``path``.
+
+    ``size`` is split evenly over ``members`` files. ``locales`` adds that many
+    ``em:localized`` blocks to a bootstrapped addon's install.rdf, ahead of its
+    version. With ``signed``, META-INF files are added that pass ``verify`` (the
+    certificate is a placeholder).
+    """
+    rng = random.Random(seed)
+    addon_id = addon_id or '{}@benchmarks.invalid'.format(layout)
+    files = {}
+
+    if layout == BOOTSTRAPPED:
+        localized = '\n'.join(
+            LOCALIZED.format(locale='xx-{}'.format(i), description='Lorem ipsum ' * 20)
+            for i in range(locales))
+        files['install.rdf'] = INSTALL_RDF.format(
+            id=addon_id, version=version, localized=localized).encode('utf-8')
+        files['bootstrap.js'] = b'function startup() {}\nfunction shutdown() {}\n'
+    else:
+        files['manifest.json'] = json.dumps({
+            'manifest_version': 2,
+            'name': 'Benchmark Addon',
+            'version': version,
+            'applications': {'gecko': {'id': addon_id}},
+        }).encode('utf-8')
+
+    per_member = max(size // max(members, 1), 1)
+    for i in range(members):
+        files['content/file-{}.js'.format(i)] = member_data(rng, per_member, compressible)
+
+    if signed:
+        files.update(signature_files(files))
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name in sorted(files):
+            zf.writestr(name, files[name])
+    return path
+
+
+def _b64digest(algorithm, data):
+    return base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+
+
+def signature_files(files):
+    """Return META-INF members whose digests match ``files``."""
+    manifest = ['Manifest-Version: 1.0', '']
+    for name in sorted(files):
+        manifest.extend([
+            'Name: {}'.format(name),
+            'Digest-Algorithms: SHA1 SHA256',
+            'SHA1-Digest: {}'.format(_b64digest('sha1', files[name])),
+            'SHA256-Digest: {}'.format(_b64digest('sha256', files[name])),
+            '',
+        ])
+    manifest = '\n'.join(manifest).encode('utf-8') + b'\n'
+    signature = '\n'.join([
+        'Signature-Version: 1.0',
+        'SHA1-Digest-Manifest: {}'.format(_b64digest('sha1', manifest)),
+        'SHA256-Digest-Manifest: {}'.format(_b64digest('sha256', manifest)),
+        '', '',
+    ]).encode('utf-8')
+    return {
+        'META-INF/manifest.mf': manifest,
+        'META-INF/mozilla.sf': signature,
+        'META-INF/mozilla.rsa': b'\x30\x80placeholder',
+    }
+
+
+def sign_xpi_data(src, dest):
+    """Copy the XPI at ``src`` to ``dest`` with matching META-INF files, like the signer."""
+    with zipfile.ZipFile(src) as zf:
+        files = dict((info.filename, zf.read(info)) for info in zf.infolist()
+                     if not info.filename.startswith('META-INF/'))
+    files.update(signature_files(files))
+    with zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name in sorted(files):
+            zf.writestr(name, files[name])
+    return dest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path')
+    parser.add_argument('--layout', choices=LAYOUTS, default=WEB_EXTENSION)
+    parser.add_argument('--size', type=int, default=1024 * 1024,
+                        help='Total uncompressed size of the generated members in bytes.')
+    parser.add_argument('--members', type=int, default=10)
+    parser.add_argument('--locales', type=int, default=0)
+    parser.add_argument('--incompressible', action='store_true')
+    parser.add_argument('--signed', action='store_true')
+    args = parser.parse_args(argv)
+
+    make_xpi(args.path, layout=args.layout, size=args.size, members=args.members,
+             locales=args.locales, compressible=not args.incompressible, signed=args.signed)
+    print('{} ({} bytes)'.format(args.path, os.path.getsize(args.path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,3 +2,9 @@ import os
 
 HOME_DIR = os.path.expanduser('~')
 CONFIG_PATH = os.path.join(HOME_DIR, '.mozilla_addon_signer')
+CACHE_DIR = os.path.join(HOME_DIR, '.mozilla_addon_signer_cache')
+DAEMON_SOCKET = os.path.join(HOME_DIR, '.mozilla_addon_signer.sock')
+DAEMON_STATE_PATH = os.path.join(HOME_DIR, '.mozilla_addon_signer_daemon.json')
+REGISTRY_PATH = os.path.join(HOME_DIR, '.mozilla_addon_signer_registry.sqlite')
+
+CHUNK_SIZE = 64 * 1024
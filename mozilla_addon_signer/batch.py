@@ -0,0 +1,262 @@
+import abc
+import functools
+import glob
+import os
+import threading
+
+import six
+
+from mozilla_addon_signer.service import SigningService
+from mozilla_addon_signer.signing import Signer
+from mozilla_addon_signer.xpi import XPI, XPI_ERROR_MESSAGES
+
+
+CONFLICT_OVERWRITE = 'overwrite'
+CONFLICT_SKIP = 'skip'
+CONFLICT_RENAME = 'rename'
+CONFLICT_FAIL = 'fail'
+CONFLICT_POLICIES = [
+    CONFLICT_FAIL,
+    CONFLICT_SKIP,
+    CONFLICT_OVERWRITE,
+    CONFLICT_RENAME,
+]
+
+STATUS_PENDING = 'pending'
+STATUS_SIGNED = 'signed'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+
+def expand_sources(patterns, manifest=None):
+    """Expand globs and manifest lines into a de-duplicated, ordered list of paths."""
+    patterns = list(patterns)
+    if manifest is not None:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                patterns.append(line)
+
+    sources = []
+    for pattern in patterns:
+        # Unmatched patterns are kept so they are reported as missing files.
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if path not in sources:
+                sources.append(path)
+    return sources
+
+
+class BatchItem(object):
+    def __init__(self, src):
+        self.src = src
+        self.xpi = None
+        self.dest = None
+        # The destination held for this item while it is being signed.
+        self.reserved = None
+        self.checksum = None
+        self.signed_checksum = None
+        self.uploaded = None
+        self.status = STATUS_PENDING
+        self.message = ''
+
+    @property
+    def ok(self):
+        return self.status != STATUS_FAILED
+
+    def fail(self, message):
+        self.status = STATUS_FAILED
+        self.message = message
+
+
+@six.add_metaclass(abc.ABCMeta)
+class BatchRunner(object):
+    """Signs many items concurrently, each on its own thread.
+
+    Subclasses implement :meth:`process`. Any error it raises is recorded on the
+    item rather than stopping the run, and :meth:`load` does the checks every item
+    goes through before anything is uploaded, including reserving its destination
+    so two items never write to the same file.
+    """
+
+    def __init__(self, output_dir=None, suffixes=None, on_conflict=CONFLICT_FAIL,
+                 sign_signed=False, preflight=None, workers=8):
+        self.output_dir = output_dir
+        self.suffixes = suffixes
+        self.on_conflict = on_conflict
+        self.sign_signed = sign_signed
+        self.preflight = preflight
+        self.workers = workers
+        self._dest_lock = threading.Lock()
+        self._reserved = set()
+
+    def select(self, sources):
+        """Return the items to process for ``sources``."""
+        return [BatchItem(src) for src in sources]
+
+    def run(self, sources, callback=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        items = self.select(sources)
+
+        def process(item):
+            self.sign(item)
+            if callback:
+                callback(item)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for item in items:
+                if item.status == STATUS_PENDING:
+                    executor.submit(process, item)
+
+        return items
+
+    def sign(self, item):
+        """Process a single item, recording any error on it rather than raising."""
+        try:
+            self.process(item)
+        except Exception as e:
+            item.fail(str(e) or e.__class__.__name__)
+        return item
+
+    @abc.abstractmethod
+    def process(self, item):
+        """Sign ``item``, setting its status and message."""
+
+    def load(self, item, src=None):
+        """Load and check ``item``, and reserve its destination.
+
+        ``src`` is the file to load, if not the item's own path. Returns whether the
+        item should be signed. Nothing has been uploaded yet, so an item that is
+        skipped or fails here costs no S3 or Lambda calls.
+        """
+        try:
+            item.xpi = XPI(src if src is not None else item.src)
+        except tuple(XPI_ERROR_MESSAGES) as e:
+            item.fail('`{}` {}.'.format(item.src, XPI_ERROR_MESSAGES[type(e)]))
+            return False
+
+        if item.xpi.is_signed and not self.sign_signed:
+            item.status = STATUS_SKIPPED
+            item.message = 'already signed'
+            return False
+
+        if self.preflight:
+            problems = self.preflight.check(item.xpi)
+            if problems:
+                item.fail(' '.join(problem.message for problem in problems))
+                return False
+
+        if self.output_dir is None:
+            return True
+
+        filename = item.xpi.suggested_filename(mark_signed=True, extra_suffixes=self.suffixes)
+        item.reserved = self.reserve_dest(os.path.join(self.output_dir, filename))
+        if item.reserved is None:
+            if self.on_conflict == CONFLICT_SKIP:
+                item.status = STATUS_SKIPPED
+                item.message = '`{}` already exists'.format(filename)
+            else:
+                item.fail('`{}` already exists'.format(filename))
+            return False
+
+        return True
+
+    def reserve_dest(self, dest):
+        # Destinations are reserved under a lock so two items in the same batch never
+        # write to the same file.
+        with self._dest_lock:
+            if self._is_free(dest) or (
+                    self.on_conflict == CONFLICT_OVERWRITE and dest not in self._reserved):
+                self._reserved.add(dest)
+                return dest
+
+            if self.on_conflict != CONFLICT_RENAME:
+                return None
+
+            root, ext = os.path.splitext(dest)
+            n = 1
+            while not self._is_free('{}-{}{}'.format(root, n, ext)):
+                n += 1
+            dest = '{}-{}{}'.format(root, n, ext)
+            self._reserved.add(dest)
+            return dest
+
+    def release_dest(self, item):
+        if item.reserved is not None:
+            with self._dest_lock:
+                self._reserved.discard(item.reserved)
+            item.reserved = None
+
+    def _is_free(self, dest):
+        return dest not in self._reserved and not os.path.exists(dest)
+
+
+class SigningPipeline(BatchRunner):
+    """Signs many XPIs concurrently.
+
+    Every item goes through load/upload, invoke and download stages in order, and
+    each stage has its own concurrency limit, so one slow Lambda call only occupies a
+    single invoke slot while other items keep moving through the pipeline.
+    """
+
+    def __init__(self, signer, addon_type, env, output_dir='.', suffixes=None,
+                 on_conflict=CONFLICT_FAIL, sign_signed=False, upload_workers=4,
+                 invoke_workers=8, download_workers=4, use_async=False, async_timeout=None,
+                 max_waiting=32, preflight=None, registry=None, verify=True):
+        workers = upload_workers + invoke_workers + download_workers
+        if use_async:
+            # Queued signings only need a thread to poll for their result.
+            workers += max_waiting
+        super(SigningPipeline, self).__init__(
+            output_dir=output_dir, suffixes=suffixes, on_conflict=on_conflict,
+            sign_signed=sign_signed, preflight=preflight, workers=workers)
+        self.signer = signer
+        self.addon_type = addon_type
+        self.env = env
+        self.use_async = use_async
+        self.async_timeout = async_timeout
+        self.registry = registry
+        self.verify = verify
+        self._upload_slots = threading.BoundedSemaphore(upload_workers)
+        self._invoke_slots = threading.BoundedSemaphore(invoke_workers)
+        self._download_slots = threading.BoundedSemaphore(download_workers)
+
+    def process(self, item):
+        try:
+            with self._upload_slots:
+                if not self.load(item):
+                    return
+                source, item.checksum = self.signer.upload(item.xpi, self.env)
+
+            with self._invoke_slots:
+                if self.use_async:
+                    result = self.signer.invoke_async(self.addon_type, self.env, source,
+                                                      item.checksum)
+                else:
+                    data = self.signer.invoke(self.addon_type, self.env, source,
+                                              item.checksum)
+            if self.use_async:
+                data = self.signer.wait_for_result(result, timeout=self.async_timeout)
+            item.uploaded = data['uploaded']
+
+            with self._download_slots:
+                self.download(item)
+        except Signer.LambdaError as e:
+            item.fail(e.data.get('errorMessage') or str(e))
+            return
+        finally:
+            self.release_dest(item)
+
+        if self.registry and item.status == STATUS_SIGNED:
+            record = self.registry.record(item.xpi, self.addon_type, self.env, source=source,
+                                          uploaded=item.uploaded)
+            self.registry.update(record, dest=item.dest, signed_checksum=item.signed_checksum)
+
+    def download(self, item):
+        dest = item.reserved
+        check = functools.partial(SigningService.verify, name=dest) if self.verify else None
+        # A download that fails the check is discarded before it is renamed over ``dest``,
+        # so a file that was already there, with --on-conflict overwrite, is kept.
+        item.signed_checksum = self.signer.download(item.uploaded, dest, check=check)
+        item.dest = dest
+        item.status = STATUS_SIGNED
@@ -0,0 +1,161 @@
+import fnmatch
+
+from mozilla_addon_signer.batch import STATUS_SIGNED, STATUS_SKIPPED, BatchItem, BatchRunner
+from mozilla_addon_signer.transfer import SpooledBuffer
+
+
+XPI_CONTENT_TYPES = ['application/x-xpinstall', 'application/zip']
+
+SELECT_ALL = 'all'
+SELECT_NEWEST = 'newest'
+SELECT_POLICIES = [
+    SELECT_ALL,
+    SELECT_NEWEST,
+]
+
+DEFAULT_WORKERS = 8
+
+
+def select_attachments(attachments, policy=SELECT_ALL, pattern=None, include_obsolete=False):
+    """Pick the XPI attachments of a bug to sign.
+
+    ``pattern`` is a glob the file name has to match. With the ``newest`` policy only
+    the most recently created of the remaining attachments is kept.
+    """
+    selected = []
+    for a in attachments:
+        if a.get('content_type') not in XPI_CONTENT_TYPES:
+            continue
+        if a.get('is_obsolete', 0) and not include_obsolete:
+            continue
+        if pattern and not fnmatch.fnmatch(a.get('file_name') or '', pattern):
+            continue
+        selected.append(a)
+
+    if policy == SELECT_NEWEST and selected:
+        # Bugzilla timestamps are ISO 8601 in UTC, so they sort as strings.
+        return [max(selected, key=lambda a: (a.get('creation_time') or '', a['id']))]
+    return selected
+
+
+class BugItem(BatchItem):
+    def __init__(self, bug, attachment=None):
+        super(BugItem, self).__init__(attachment['file_name'] if attachment else '')
+        self.bug = str(bug)
+        self.attachment = attachment
+
+
+class BugSigner(BatchRunner):
+    """Signs the XPI attachments of many bugs concurrently, without any prompting.
+
+    Each selected attachment is fetched, checked, signed and attached back to its
+    bug by one of ``workers`` threads, all going through a
+    :class:`~mozilla_addon_signer.service.SigningService` or a daemon client.
+    """
+
+    def __init__(self, service, bugzilla, addon_type, env, api_key=None, policy=SELECT_ALL,
+                 pattern=None, include_obsolete=False, attach=True, output_dir=None,
+                 suffixes=None, attachment_cache=None, max_memory=None, preflight=None,
+                 verify=True, workers=DEFAULT_WORKERS, service_options=None):
+        super(BugSigner, self).__init__(output_dir=output_dir, suffixes=suffixes,
+                                        preflight=preflight, workers=workers)
+        self.service = service
+        self.bugzilla = bugzilla
+        self.addon_type = addon_type
+        self.env = env
+        self.api_key = api_key
+        self.policy = policy
+        self.pattern = pattern
+        self.include_obsolete = include_obsolete
+        self.attach = attach
+        self.attachment_cache = attachment_cache
+        self.max_memory = max_memory
+        self.verify = verify
+        self.options = service_options or {}
+
+    def select(self, bug_numbers):
+        """Return an item for every attachment to sign, fetching all metadata at once."""
+        # A bug given twice would otherwise have each attachment signed twice at once.
+        unique = []
+        for bug in bug_numbers:
+            if str(bug) not in unique:
+                unique.append(str(bug))
+        bug_numbers = unique
+        attachments = self.bugzilla.get_attachments_for_bugs(bug_numbers)
+        items = []
+        for bug in bug_numbers:
+            selected = select_attachments(attachments.get(str(bug), []), self.policy,
+                                          self.pattern, self.include_obsolete)
+            if not selected:
+                item = BugItem(bug)
+                item.status = STATUS_SKIPPED
+                item.message = 'no matching XPI attachments'
+                items.append(item)
+            items.extend(BugItem(bug, a) for a in selected)
+        return items
+
+    def process(self, item):
+        with SpooledBuffer(item.attachment['file_name'], max_memory=self.max_memory) as src:
+            self.fetch(item, src)
+            try:
+                if self.load(item, src):
+                    self.sign_attachment(item, src)
+            finally:
+                self.release_dest(item)
+
+    def fetch(self, item, src):
+        if self.attachment_cache:
+            src.link(self.attachment_cache.fetch(self.bugzilla, item.attachment))
+        else:
+            self.bugzilla.download_attachment(item.attachment['id'], src)
+
+    def sign_attachment(self, item, src):
+        file_name = item.xpi.suggested_filename(mark_signed=True, extra_suffixes=self.suffixes)
+        dest = item.reserved
+        result = self.service.sign(src, self.addon_type, self.env, **self.options)
+        item.uploaded = result['data']['uploaded']
+        if self.attach:
+            self.service.attach(item.bug, src, self.addon_type, self.env, item.uploaded,
+                                file_name, dest=dest, api_key=self.api_key,
+                                verify=self.verify, record=result.get('record'),
+                                **self.options)
+        elif dest:
+            self.service.download(src, self.addon_type, self.env, item.uploaded, dest,
+                                  verify=self.verify, record=result.get('record'),
+                                  **self.options)
+
+        item.dest = dest
+        item.status = STATUS_SIGNED
+        if self.attach:
+            item.message = 'attached to bug {}'.format(item.bug)
+
+    def clear_needinfos(self, items):
+        """Clear needinfos on the bugs where every selected attachment was signed.
+
+        Returns the needinfos that were found, each with the ``error`` raised while
+        clearing it, if any.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        done = []
+        for item in items:
+            selected = [i for i in items if i.bug == item.bug and i.attachment]
+            if item.bug not in done and selected and all(
+                    i.status == STATUS_SIGNED for i in selected):
+                done.append(item.bug)
+        if not done:
+            return []
+
+        needinfos = self.service.needinfos(done, api_key=self.api_key)
+
+        def clear(needinfo):
+            try:
+                self.service.clear_needinfo(needinfo['bug'], needinfo['id'],
+                                            api_key=self.api_key)
+                needinfo['error'] = None
+            except Exception as e:
+                needinfo['error'] = str(e) or e.__class__.__name__
+            return needinfo
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(clear, needinfos))
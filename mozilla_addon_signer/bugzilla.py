@@ -1,24 +1,118 @@
+import base64
+import json
+import random
+import re
+import threading
+import time
+
 import requests
+import requests.adapters
+
+from six.moves.urllib.parse import parse_qsl
+
+from mozilla_addon_signer.tracing import span
 
 
 BUG_NUMBER_TYPE_EXC_MESSAGE = 'Bug number must be int or str, not {}'
 
+BASE64_READ_SIZE = 3 * 16 * 1024
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_POOL_SIZE = 10
+# Never let a server's Retry-After stall a command for longer than this.
+MAX_RETRY_AFTER = 60
+# Keep batched bug queries well below common URL length limits.
+MAX_BUGS_PER_REQUEST = 100
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Sending one of these twice has the same effect as sending it once.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+def _not_sent(error):
+    """Whether a connection error happened before the request reached the server."""
+    from requests.packages.urllib3.exceptions import ConnectTimeoutError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # Failing to connect at all is wrapped in a plain ConnectionError.
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
 
 class BugzillaAPI(object):
     api_base = 'https://bugzilla.mozilla.org/rest'
 
+    _who_am_i = {}
+    _who_am_i_lock = threading.Lock()
+
     class APIException(Exception):
         pass
 
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, timeout=None, retries=None, backoff=None, pool_size=None):
+        self.api_key = api_key
+        self.timeout = float(timeout or DEFAULT_TIMEOUT)
+        self.retries = int(DEFAULT_RETRIES if retries is None else retries)
+        self.backoff = float(DEFAULT_BACKOFF if backoff is None else backoff)
+
+        pool_size = int(pool_size or DEFAULT_POOL_SIZE)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
         self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         if api_key:
             self.session.headers.update({'X-BUGZILLA-API-KEY': api_key})
 
-    def request(self, method, endpoint, params=None, data=None, json=None):
+    def _backoff_delay(self, attempt, res=None):
+        retry_after = res is not None and res.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0), MAX_RETRY_AFTER)
+            except ValueError:
+                pass
+        # Full jitter keeps many concurrent clients from retrying in lockstep.
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def _send(self, method, endpoint, params=None, data=None, json=None, headers=None,
+              stream=False):
         url = self.api_base + endpoint
-        res = self.session.request(method, url, params=params, json=json, data=data)
-        res.raise_for_status()
+        # Streamed bodies can only be sent once.
+        retries = 0 if hasattr(data, 'read') else self.retries
+        # Anything else, like creating an attachment, is only sent again if the server
+        # can not have seen it.
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        with span('bugzilla.request', method=method, endpoint=endpoint, retries=0) as s:
+            for attempt in range(retries + 1):
+                s.set(retries=attempt)
+                try:
+                    res = self.session.request(method, url, params=params, json=json,
+                                               data=data, headers=headers,
+                                               timeout=self.timeout, stream=stream)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    if attempt >= retries or not (idempotent or _not_sent(e)):
+                        raise
+                    time.sleep(self._backoff_delay(attempt))
+                    continue
+
+                if idempotent and res.status_code in RETRY_STATUS_CODES and attempt < retries:
+                    # Streamed responses hold on to their pooled connection until closed.
+                    res.close()
+                    time.sleep(self._backoff_delay(attempt, res))
+                    continue
+                break
+
+            s.set(status=res.status_code)
+            # Measured on the prepared request, so form data and JSON count as encoded.
+            sent = int(res.request.headers.get('Content-Length') or 0)
+            s.set(bytes=sent + int(res.headers.get('Content-Length') or 0))
+            res.raise_for_status()
+        return res
+
+    def request(self, method, endpoint, params=None, data=None, json=None, headers=None):
+        res = self._send(method, endpoint, params=params, data=data, json=json, headers=headers)
         data = res.json()
         if data.get('error', False):
             raise self.APIException(data)
@@ -27,8 +121,8 @@ class BugzillaAPI(object):
     def get(self, endpoint, params=None):
         return self.request('GET', endpoint, params=params)
 
-    def post(self, endpoint, json=None, data=None):
-        return self.request('POST', endpoint, json=json, data=data)
+    def post(self, endpoint, json=None, data=None, headers=None):
+        return self.request('POST', endpoint, json=json, data=data, headers=headers)
 
     def put(self, endpoint, json=None, data=None):
         return self.request('PUT', endpoint, json=json, data=data)
@@ -42,13 +136,86 @@ class BugzillaAPI(object):
     def get_attachment_data(self, bug_number):
         return self.get_bug(bug_number).get_attachment_data()
 
+    def download_attachment(self, attachment_id, fileobj):
+        """Stream an attachment's decoded contents into ``fileobj``, returning its size.
+
+        The JSON response is never held in memory: the base64 ``data`` string is
+        located and decoded on the fly as the body arrives.
+        """
+        with span('bugzilla.download_attachment', attachment=attachment_id) as s:
+            res = self._send('GET', '/bug/attachment/{}'.format(attachment_id),
+                             params={'include_fields': 'data'}, stream=True)
+            try:
+                decoder = AttachmentDecoder(fileobj)
+                for chunk in res.iter_content(BASE64_READ_SIZE):
+                    decoder.feed(chunk)
+                size = decoder.close()
+            except AttachmentDecoder.NoData as e:
+                raise self.APIException(e.args[0])
+            finally:
+                res.close()
+            s.set(bytes=size)
+        return size
+
     def create_attachment_for_bug(self, bug_number, attachment_data, file_name, summary,
                                   content_type):
         return (self.get_bug(bug_number)
                 .create_attachment(attachment_data, file_name, summary, content_type))
 
+    def stream_attachment_for_bug(self, bug_number, fileobj, size, file_name, summary,
+                                  content_type):
+        return (self.get_bug(bug_number)
+                .stream_attachment(fileobj, size, file_name, summary, content_type))
+
+    def get_bugs(self, bug_numbers, include_fields=None):
+        """Fetch many bugs with as few ``/bug?id=...`` requests as possible."""
+        bug_numbers = [str(b) for b in bug_numbers]
+        if include_fields and 'id' not in include_fields:
+            include_fields = ['id'] + list(include_fields)
+
+        bugs = {}
+        for i in range(0, len(bug_numbers), MAX_BUGS_PER_REQUEST):
+            params = {'id': ','.join(bug_numbers[i:i + MAX_BUGS_PER_REQUEST])}
+            if include_fields:
+                params['include_fields'] = ','.join(include_fields)
+            for bug in self.get('/bug', params).get('bugs', []):
+                bugs[str(bug['id'])] = bug
+        return bugs
+
+    def search_bugs(self, query):
+        """Return the numbers of the bugs matching a search.
+
+        ``query`` holds REST search parameters, either as a query string or as the
+        URL of a bug list, e.g. ``product=Firefox&component=Normandy Client``.
+        """
+        params = parse_qsl(query.split('?', 1)[-1])
+        params.append(('include_fields', 'id'))
+        return [str(bug['id']) for bug in self.get('/bug', params).get('bugs', [])]
+
+    def get_flags_for_bugs(self, bug_numbers):
+        bugs = self.get_bugs(bug_numbers, include_fields=['flags'])
+        return {str(b): bugs.get(str(b), {}).get('flags', []) for b in bug_numbers}
+
+    def get_attachments_for_bugs(self, bug_numbers):
+        """Fetch attachment metadata (without data) for many bugs in as few requests as we can."""
+        bug_numbers = [str(b) for b in bug_numbers]
+
+        bugs = {}
+        for i in range(0, len(bug_numbers), MAX_BUGS_PER_REQUEST):
+            batch = bug_numbers[i:i + MAX_BUGS_PER_REQUEST]
+            response = self.get('/bug/{}/attachment'.format(batch[0]), {
+                'ids': batch[1:],
+                'exclude_fields': 'data',
+            })
+            bugs.update(response.get('bugs', {}))
+        return {b: bugs.get(b, []) for b in bug_numbers}
+
     def who_am_i(self):
-        return self.get('/whoami')
+        # The answer only depends on the API key, so it is shared between instances.
+        with self._who_am_i_lock:
+            if self.api_key not in self._who_am_i:
+                self._who_am_i[self.api_key] = self.get('/whoami')
+            return self._who_am_i[self.api_key]
 
 
 class Bug(object):
@@ -79,6 +246,18 @@ class Bug(object):
         })
         return response
 
+    def stream_attachment(self, fileobj, size, file_name, summary, content_type):
+        """Create an attachment, base64 encoding ``fileobj`` while the request is sent."""
+        body = Base64JSONBody(fileobj, size, {
+            'ids': [self.bug_number],
+            'file_name': file_name,
+            'summary': summary,
+            'content_type': content_type,
+        })
+        response = self.api.post('/bug/{}/attachment'.format(self.bug_number), data=body,
+                                 headers={'Content-Type': 'application/json'})
+        return response
+
     def get_flags(self):
         response = self.api.get('/bug/{}'.format(self.bug_number), {'include_fields': 'flags'})
         return response['bugs'][0]['flags']
@@ -86,3 +265,112 @@ class Bug(object):
     def set_flags(self, flags):
         response = self.api.put('/bug/{}'.format(self.bug_number), {"flags": flags})
         return response
+
+
+class Base64JSONBody(object):
+    """A file-like JSON request body with ``fileobj`` base64 encoded into its ``data`` field.
+
+    The encoded length is known up front from ``size``, so requests can send a
+    Content-Length header while only a small window of the file is held in memory.
+    """
+
+    def __init__(self, fileobj, size, fields):
+        self._fileobj = fileobj
+        self._remaining = size
+        self._buffer = bytearray((json.dumps(fields)[:-1] + ', "data": "').encode('utf-8'))
+        self._carry = b''
+        self._suffix = b'"}'
+        self._length = len(self._buffer) + 4 * ((size + 2) // 3) + len(self._suffix)
+
+    def __len__(self):
+        return self._length
+
+    def _fill(self):
+        if self._remaining > 0:
+            chunk = self._fileobj.read(min(BASE64_READ_SIZE, self._remaining))
+            if not chunk:
+                raise IOError('Attachment source ended {} bytes early'.format(self._remaining))
+            self._remaining -= len(chunk)
+            chunk = self._carry + chunk
+            # Carry leftover bytes over so padding only ever appears at the very end.
+            cut = len(chunk) - len(chunk) % 3 if self._remaining else len(chunk)
+            chunk, self._carry = chunk[:cut], chunk[cut:]
+            self._buffer += base64.b64encode(chunk)
+        elif self._suffix:
+            self._buffer += self._suffix
+            self._suffix = b''
+
+    def read(self, size=-1):
+        while (size < 0 or len(self._buffer) < size) and (self._remaining > 0 or self._suffix):
+            self._fill()
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class AttachmentDecoder(object):
+    """Incrementally extracts and base64 decodes the ``"data"`` string of a JSON response."""
+
+    DATA_KEY = re.compile(br'"data"\s*:\s*"')
+    # Bytes kept back while searching, long enough to hold a split key.
+    SEARCH_OVERLAP = 64
+    MAX_PREAMBLE = 64 * 1024
+
+    class NoData(Exception):
+        pass
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._preamble = b''
+        self._pending = b''
+        self._in_data = False
+        self._done = False
+        self.size = 0
+
+    def feed(self, chunk):
+        if self._done:
+            return
+        if not self._in_data:
+            self._preamble += chunk
+            match = self.DATA_KEY.search(self._preamble)
+            if not match:
+                if len(self._preamble) > self.MAX_PREAMBLE:
+                    self._preamble = self._preamble[-self.SEARCH_OVERLAP:]
+                return
+            self._in_data = True
+            chunk = self._preamble[match.end():]
+            self._preamble = b''
+        self._feed_data(chunk)
+
+    def _feed_data(self, chunk):
+        # base64 never contains a quote, so the first one closes the string.
+        end = chunk.find(b'"')
+        if end >= 0:
+            chunk = chunk[:end]
+            self._done = True
+
+        encoded = self._pending + chunk
+        if encoded.endswith(b'\\') and not self._done:
+            # Keep a split escape sequence for the next chunk.
+            encoded, self._pending = encoded[:-1], b'\\'
+        else:
+            self._pending = b''
+        for escape, value in ((b'\\/', b'/'), (b'\\n', b''), (b'\\r', b'')):
+            encoded = encoded.replace(escape, value)
+        self._write(encoded)
+
+    def _write(self, encoded):
+        usable = len(encoded) if self._done else len(encoded) - len(encoded) % 4
+        self._pending = encoded[usable:] + self._pending
+        if usable:
+            data = base64.b64decode(encoded[:usable])
+            self._fileobj.write(data)
+            self.size += len(data)
+
+    def close(self):
+        if not self._done:
+            message = self._preamble[:1024].decode('utf-8', 'replace')
+            raise self.NoData(message or 'Attachment data was truncated')
+        return self.size
@@ -0,0 +1,367 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from mozilla_addon_signer import CACHE_DIR
+
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+METADATA_EXT = '.json'
+BLOB_EXT = '.bin'
+PARTIAL_EXT = '.bin.part'
+
+# How often a cache that stays under its size limit re-scans its directory.
+RESCAN_INTERVAL = 60
+
+
+class FileCache(object):
+    """A directory of JSON entries, each with an optional blob file next to it.
+
+    Entries expire after ``max_age`` seconds, and the least recently used entries
+    are evicted once the directory grows beyond ``max_size`` bytes.
+    """
+
+    def __init__(self, path, max_size=None, max_age=None):
+        self.path = path
+        self.max_size = int(max_size or DEFAULT_MAX_SIZE)
+        self.max_age = int(max_age or DEFAULT_MAX_AGE)
+        # The size of the directory as of the last scan, plus everything put since.
+        self._size = None
+        self._scanned = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key, ext):
+        return os.path.join(self.path, key + ext)
+
+    def _ensure_dir(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def get(self, key):
+        path = self._path(key, METADATA_EXT)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if time.time() - entry.get('created', 0) > self.max_age:
+            self.delete(key)
+            return None
+
+        # Touch the entry so eviction is least-recently-used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            # Evicted since it was read.
+            return None
+        return entry
+
+    def put(self, key, entry, blob_path=None, move=False):
+        self._ensure_dir()
+        entry = dict(entry, created=time.time())
+        added = 0
+
+        if blob_path and move:
+            added += os.path.getsize(blob_path)
+            os.replace(blob_path, self._path(key, BLOB_EXT))
+        elif blob_path:
+            tmp_blob = self._temp_file(key)
+            shutil.copyfile(blob_path, tmp_blob)
+            added += os.path.getsize(tmp_blob)
+            os.replace(tmp_blob, self._path(key, BLOB_EXT))
+
+        tmp_path = self._temp_file(key)
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        added += os.path.getsize(tmp_path)
+        os.replace(tmp_path, self._path(key, METADATA_EXT))
+
+        self._added(added)
+        return entry
+
+    def _temp_file(self, key):
+        # Unique, so concurrent writers of one key never truncate or rename each other's file.
+        fd, path = tempfile.mkstemp(prefix='.{}.'.format(key), suffix='.tmp', dir=self.path)
+        os.close(fd)
+        return path
+
+    def _added(self, size):
+        # The directory is only scanned again once it may be over the limit, or now
+        # and then to pick up what other processes wrote, rather than on every put.
+        with self._lock:
+            if self._size is not None and time.time() - self._scanned < RESCAN_INTERVAL:
+                self._size += size
+                if self._size <= self.max_size:
+                    return
+            self.evict()
+
+    def blob_path(self, key):
+        path = self._path(key, BLOB_EXT)
+        return path if os.path.exists(path) else None
+
+    def delete(self, key):
+        for ext in (METADATA_EXT, BLOB_EXT, PARTIAL_EXT):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def temp_path(self, key):
+        # Lives inside the cache directory so it can be moved into place with a rename.
+        # The name is fixed so an interrupted download can be resumed from it.
+        self._ensure_dir()
+        return self._path(key, PARTIAL_EXT)
+
+    def keys(self):
+        if not os.path.isdir(self.path):
+            return []
+        return [name[:-len(METADATA_EXT)] for name in os.listdir(self.path)
+                if name.endswith(METADATA_EXT)]
+
+    def _stat(self, key):
+        size = 0
+        mtime = 0
+        for ext in (METADATA_EXT, BLOB_EXT):
+            try:
+                st = os.stat(self._path(key, ext))
+            except OSError:
+                continue
+            size += st.st_size
+            mtime = max(mtime, st.st_mtime)
+        return size, mtime
+
+    def evict(self):
+        """Remove expired entries, then the least recently used until under ``max_size``."""
+        now = time.time()
+        self._remove_stale_temp_files(now)
+        stats = []
+        for key in self.keys():
+            size, mtime = self._stat(key)
+            if now - mtime > self.max_age:
+                self.delete(key)
+            else:
+                stats.append((mtime, size, key))
+
+        total = sum(size for _, size, _ in stats)
+        evicted = 0
+        for _, size, key in sorted(stats):
+            if total <= self.max_size:
+                break
+            self.delete(key)
+            total -= size
+            evicted += 1
+        self._size, self._scanned = total, now
+        return evicted
+
+    def _remove_stale_temp_files(self, now):
+        # Left behind by writers that were killed part way through a put.
+        if not os.path.isdir(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.startswith('.') and name.endswith('.tmp'):
+                path = os.path.join(self.path, name)
+                try:
+                    if now - os.path.getmtime(path) > self.max_age:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        for key in self.keys():
+            self.delete(key)
+
+
+class SigningCache(FileCache):
+    """Signing results keyed by the checksum of the unsigned XPI, addon type and env."""
+
+    @staticmethod
+    def key(checksum, addon_type, env):
+        return '{}-{}-{}'.format(checksum, addon_type, env)
+
+    @staticmethod
+    def signed_key(checksum):
+        return 'signed-{}'.format(checksum)
+
+    @staticmethod
+    def version_key(addon_id, version, addon_type, env):
+        name = u'\0'.join([addon_id, version or '', addon_type, env])
+        return 'version-{}'.format(hashlib.sha256(name.encode('utf-8')).hexdigest())
+
+    def get_result(self, xpi, addon_type, env):
+        return self.get(self.key(xpi.sha256sum, addon_type, env))
+
+    def put_result(self, xpi, addon_type, env, data):
+        self.put(self.version_key(xpi.id, xpi.version, addon_type, env), {
+            'id': xpi.id,
+            'version': xpi.version,
+            'checksum': xpi.sha256sum,
+        })
+        return self.put(self.key(xpi.sha256sum, addon_type, env), {
+            'id': xpi.id,
+            'version': xpi.version,
+            'addon_type': addon_type,
+            'env': env,
+            'data': data,
+        })
+
+    def signed_path(self, xpi, addon_type, env):
+        return self.blob_path(self.key(xpi.sha256sum, addon_type, env))
+
+    def put_signed(self, xpi, addon_type, env, path, checksum):
+        """Keep a local copy of the signed output and remember its checksum."""
+        key = self.key(xpi.sha256sum, addon_type, env)
+        entry = self.get(key)
+        if entry is None:
+            return
+        self.put(key, entry, blob_path=path)
+        self.put(self.signed_key(checksum), {
+            'source': xpi.sha256sum,
+            'addon_type': addon_type,
+            'env': env,
+        })
+
+    def find_version(self, addon_id, version, addon_type, env):
+        """Return the last signing of this id and version in ``env``, if any."""
+        return self.get(self.version_key(addon_id, version, addon_type, env))
+
+    def find_signed(self, xpi):
+        """Return details of the signing that produced ``xpi``, if it came from this cache."""
+        return self.get(self.signed_key(xpi.sha256sum))
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            os.path.join(config.get('cache.path', default=CACHE_DIR), 'signing'),
+            max_size=config.get('cache.max_size'),
+            max_age=config.get('cache.max_age'),
+        )
+
+
+class AttachmentCache(FileCache):
+    """Decoded Bugzilla attachments keyed by attachment id and last change time."""
+
+    @staticmethod
+    def key(attachment):
+        last_change = re.sub(r'[^0-9A-Za-z]', '', attachment.get('last_change_time', ''))
+        return 'attachment-{}-{}'.format(attachment['id'], last_change)
+
+    def fetch(self, api, attachment):
+        """Return the path of a local copy of ``attachment``, downloading it on a miss."""
+        key = self.key(attachment)
+        if self.get(key) and self.blob_path(key):
+            return self.blob_path(key)
+
+        self._ensure_dir()
+        tmp_path = self._temp_file(key)
+        try:
+            with open(tmp_path, 'wb') as f:
+                size = api.download_attachment(attachment['id'], f)
+            self.put(key, {
+                'id': attachment['id'],
+                'file_name': attachment.get('file_name'),
+                'size': size,
+            }, blob_path=tmp_path, move=True)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return self.blob_path(key)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            os.path.join(config.get('cache.path', default=CACHE_DIR), 'attachments'),
+            max_size=config.get('cache.max_size'),
+            max_age=config.get('cache.max_age'),
+        )
+
+
+class URLCache(FileCache):
+    """Files downloaded from URLs, revalidated with their ETag or Last-Modified headers.
+
+    Interrupted downloads leave their partial file behind along with the validator
+    needed to resume them safely.
+    """
+
+    @staticmethod
+    def key(url):
+        return 'url-{}'.format(hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def fetch(self, downloader, url):
+        """Return the path of an up to date local copy of ``url``."""
+        key = self.key(url)
+        entry = self.get(key) or {}
+        blob_path = self.blob_path(key) if entry.get('complete') else None
+        part_path = self.temp_path(key)
+
+        def on_response(res, validator):
+            # Remember how to resume this transfer in case it is interrupted.
+            self.put(key, dict(entry, url=url, complete=False, validator=validator))
+
+        try:
+            result = downloader.download(
+                url, part_path,
+                etag=entry.get('etag') if blob_path else None,
+                last_modified=entry.get('last_modified') if blob_path else None,
+                resume_validator=None if entry.get('complete') else entry.get('validator'),
+                on_response=on_response)
+        except downloader.InvalidDownload:
+            # Nothing worth resuming was downloaded, so the next fetch starts afresh.
+            self.delete(key)
+            raise
+
+        if result is None:
+            self.put(key, entry)
+            return blob_path
+
+        self.put(key, dict(result, url=url, complete=True), blob_path=part_path, move=True)
+        return self.blob_path(key)
+
+    def checksum(self, url):
+        """Return the sha256 of the local copy of ``url``, computed as it was downloaded."""
+        entry = self.get(self.key(url))
+        return entry.get('sha256') if entry and entry.get('complete') else None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            os.path.join(config.get('cache.path', default=CACHE_DIR), 'urls'),
+            max_size=config.get('cache.max_size'),
+            max_age=config.get('cache.max_age'),
+        )
+
+
+class CertificateCache(FileCache):
+    """Parsed signature summaries keyed by the checksum of the signed XPI."""
+
+    def get_summary(self, xpi):
+        entry = self.get(xpi.sha256sum)
+        return entry['summary'] if entry else None
+
+    def put_summary(self, xpi, summary):
+        self.put(xpi.sha256sum, {'summary': summary})
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            os.path.join(config.get('cache.path', default=CACHE_DIR), 'certificates'),
+            max_size=config.get('cache.max_size'),
+            max_age=config.get('cache.max_age'),
+        )
+
+
+def all_caches(config):
+    return [
+        SigningCache.from_config(config),
+        AttachmentCache.from_config(config),
+        URLCache.from_config(config),
+        CertificateCache.from_config(config),
+    ]
@@ -1,21 +1,26 @@
-import base64
 import json
 import os
-import requests
-import subprocess
-import tempfile
+import time
 import traceback
 
-import boto3
+from contextlib import contextmanager
+
 import click
 
-from botocore.exceptions import NoRegionError
 from colorama import Fore
 
-from mozilla_addon_signer.bugzilla import BugzillaAPI
+from mozilla_addon_signer import DAEMON_SOCKET, DAEMON_STATE_PATH, batch, bugs, signature
+from mozilla_addon_signer.cache import (
+    AttachmentCache, CertificateCache, SigningCache, URLCache, all_caches)
 from mozilla_addon_signer.config import config
-from mozilla_addon_signer.utils import output, prompt_choices
-from mozilla_addon_signer.xpi import XPI
+from mozilla_addon_signer.preflight import RULES, Preflight
+from mozilla_addon_signer.registry import DEFAULT_LIMIT, Registry
+from mozilla_addon_signer.service import SigningService
+from mozilla_addon_signer.signing import DEFAULT_ASYNC_TIMEOUT, Signer
+from mozilla_addon_signer.tracing import FORMAT_JSONL, TRACE_FORMATS, span, tracer
+from mozilla_addon_signer.transfer import SpooledBuffer
+from mozilla_addon_signer.utils import format_table, output, prompt_choices
+from mozilla_addon_signer.xpi import XPI, XPI_ERROR_MESSAGES
 
 
 ADDON_TYPES = [
@@ -39,29 +44,148 @@ CONFIG_WIZARD_STEPS = [
 def load_xpi(fp, verbose=False):
     try:
         xpi = XPI(fp)
-    except XPI.DoesNotExist as e:
-        output('ERROR: `{}` does not exist.'.format(fp), Fore.RED)
-        if verbose:
-            print(e)
-        exit(1)
-    except XPI.BadZipfile as e:
-        output('ERROR: `{}` could not be unzipped.'.format(fp), Fore.RED)
-        if verbose:
-            print(e)
-        exit(1)
-    except XPI.InvalidXPI as e:
-        output('ERROR: `{}` is not a valid web extension.'.format(fp), Fore.RED)
+    except tuple(XPI_ERROR_MESSAGES) as e:
+        output('ERROR: `{}` {}.'.format(fp, XPI_ERROR_MESSAGES[type(e)]), Fore.RED)
         if verbose:
-            print(e)
+            print(repr(e))
         exit(1)
     if verbose:
         print('Loaded xpi', xpi)
     return xpi
 
 
+# Commands import boto3, botocore and requests only when they need them, which keeps
+# startup fast for commands such as `configure` that never touch the network.
+
+
+def make_signer(profile=None, bucket_name=None):
+    from botocore.exceptions import NoRegionError
+
+    profile = profile or config.get('aws.profile_name', default=None)
+
+    try:
+        return Signer(profile=profile, bucket_name=bucket_name,
+                      part_size=config.get('s3.part_size'),
+                      max_concurrency=config.get('s3.max_concurrency'),
+                      content_addressed=config.get_bool('s3.content_addressed'),
+                      output_bucket_name=config.get('s3.output_bucket', default=None))
+    except NoRegionError:
+        raise Signer.SigningError('You must specify a region.')
+
+
+def get_signer(profile=None, bucket_name=None):
+    try:
+        return make_signer(profile, bucket_name)
+    except Signer.SigningError as e:
+        output('ERROR: {}'.format(e), Fore.RED)
+        exit(1)
+
+
+def get_bugzilla(api_key=None):
+    from mozilla_addon_signer.bugzilla import BugzillaAPI
+
+    return BugzillaAPI(
+        api_key or config.get('bugzilla.api_key', default=None),
+        timeout=config.get('bugzilla.timeout'),
+        retries=config.get('bugzilla.retries'),
+        pool_size=config.get('bugzilla.pool_size'),
+    )
+
+
+def format_lambda_error(data):
+    lines = []
+    if 'stackTrace' in data:
+        tb_out = ''.join(traceback.format_list(data['stackTrace']))
+        lines.append(tb_out.rstrip('\n'))
+    error_type = data.get('errorType', 'No error type')
+    error_msg = data.get('errorMessage')
+    error_out = error_type
+    if error_msg:
+        error_out = '{}: {}'.format(error_type, error_msg)
+    lines.append(error_out)
+    return '\n'.join(lines)
+
+
+def get_service():
+    """Return a client for the running signing daemon, or an in-process service."""
+    ctx = click.get_current_context(silent=True)
+    no_daemon = ctx and ctx.find_root().params.get('no_daemon')
+    if not no_daemon and os.path.exists(DAEMON_STATE_PATH):
+        from mozilla_addon_signer.daemon import DaemonClient
+
+        client = DaemonClient.from_state(DAEMON_STATE_PATH)
+        if client:
+            return client
+
+    # Looked up on every call so tests and benchmarks can swap the factories out.
+    return SigningService(lambda profile, bucket_name: make_signer(profile, bucket_name),
+                          lambda api_key: get_bugzilla(api_key),
+                          cache=SigningCache.from_config(config),
+                          registry=Registry.from_config(config))
+
+
+@contextmanager
+def handle_service_errors(verbose=False):
+    from mozilla_addon_signer.daemon import DaemonClient
+
+    try:
+        yield
+    except Signer.LambdaError as e:
+        output('ERROR: Invoking lambda failed.', Fore.RED)
+        if verbose:
+            output(format_lambda_error(e.data))
+        exit(1)
+    except SigningService.VerificationError as e:
+        output('ERROR: {}'.format(format_verification(e.data)), Fore.RED)
+        exit(1)
+    except (Signer.SigningError, DaemonClient.DaemonError) as e:
+        output('ERROR: {}'.format(e), Fore.RED)
+        exit(1)
+
+
+def format_timings(summary):
+    rows = [[
+        total['name'],
+        total['count'],
+        '{:.3f}'.format(total['total']),
+        '{:.3f}'.format(total['max']),
+        total['bytes'],
+        total['retries'],
+    ] for total in summary]
+    return format_table(['phase', 'count', 'total (s)', 'max (s)', 'bytes', 'retries'], rows)
+
+
+def start_tracing(ctx, timings, trace_file, trace_format):
+    tracer.enabled = True
+    root = span('command.{}'.format(ctx.invoked_subcommand))
+    root.__enter__()
+
+    def finish():
+        root.__exit__(None, None, None)
+        tracer.enabled = False
+        if trace_file:
+            tracer.write(trace_file, trace_format)
+        if timings:
+            click.echo('\n' + format_timings(tracer.summary()), err=True)
+
+    ctx.call_on_close(finish)
+
+
 @click.group()
-def cli():
-    pass
+@click.option('--timings', is_flag=True,
+              help='Print how long each phase of the command took. Work handed to a signing '
+                   'daemon is only timed as a whole; use --no-daemon to time its phases.')
+@click.option('--trace-file', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Write a timed span for every phase of the command to this file. Like '
+                   '--timings, only covers the phases run in this process.')
+@click.option('--trace-format', type=click.Choice(TRACE_FORMATS), default=FORMAT_JSONL,
+              help='Write the trace as JSON lines or in the Chrome trace event format.')
+@click.option('--no-daemon', is_flag=True,
+              help='Do the work in this process even if a signing daemon is running.')
+@click.pass_context
+def cli(ctx, timings, trace_file, trace_format, no_daemon):
+    if timings or trace_file:
+        start_tracing(ctx, timings, trace_file, trace_format)
 
 
 @cli.command()
@@ -87,14 +211,70 @@ def configure(key, value):
         config.save()
 
 
+def parse_envs(values):
+    """Split repeated or comma separated `--env` values into a list of environments."""
+    if isinstance(values, str):
+        values = [values]
+    envs = []
+    for value in values or [DEFAULT_ENV]:
+        for name in value.split(','):
+            name = name.strip()
+            if name and name not in envs:
+                envs.append(name)
+    return envs or [DEFAULT_ENV]
+
+
+def spooled_buffer(name):
+    """A buffer for a fetched XPI, kept in memory unless it is larger than configured."""
+    return SpooledBuffer(name, max_memory=config.get('download.max_memory'))
+
+
+def env_destinations(xpi, dest, envs, suffixes=None):
+    """Pick a destination for each environment, naming them apart when there are several."""
+    if len(envs) == 1:
+        return {envs[0]: dest or xpi.suggested_filename(mark_signed=True, extra_suffixes=suffixes)}
+    dests = {}
+    for env in envs:
+        if dest:
+            root, ext = os.path.splitext(dest)
+            dests[env] = '{}-{}{}'.format(root, env, ext)
+        else:
+            dests[env] = xpi.suggested_filename(
+                mark_signed=True, extra_suffixes=list(suffixes or []) + [env])
+    return dests
+
+
+def format_verification(result):
+    if 'error' in result:
+        return '`{}` {}.'.format(result['path'], result['error'])
+    if result['ok']:
+        return '`{}` matches its signature.'.format(result['path'])
+    lines = ['`{}` does not match its signature:'.format(result['path'])]
+    for problem in ('missing', 'extra', 'mismatched'):
+        for name in result[problem]:
+            lines.append('  {}: {}'.format(problem, name))
+    return '\n'.join(lines)
+
+
 @cli.command()
 @click.option('--addon-type', '-t', help='The type of addon that you want to sign.')
 @click.option('--api-key', '-k', default=None, help='The Bugzilla API key to use.')
 @click.option('--attach', '-b', default=None, help='Attach the signed addon to a bug.')
+@click.option('--download', '-d', is_flag=True,
+              help='Also save the signed addon locally when attaching it to a bug.')
 @click.option('--bucket-name', default=None, help='The S3 bucket to upload the file to.')
-@click.option('--env', '-e', default=DEFAULT_ENV, help='The environment to sign in.')
+@click.option('--env', '-e', multiple=True, default=[DEFAULT_ENV],
+              help='The environment to sign in. May be repeated or comma separated.')
 @click.option('--profile', '-p', default=None, help='The name of the AWS profile to use.')
 @click.option('--verbose', '-v', is_flag=True)
+@click.option('--no-cache', is_flag=True, help='Do not use or update the signing cache.')
+@click.option('--no-verify', is_flag=True,
+              help='Do not check the downloaded addon against its signed digests.')
+@click.option('--async', 'use_async', is_flag=True,
+              help='Queue the signing and poll S3 for its result instead of waiting on Lambda. '
+                   'Failures are only reported by a Lambda that writes a result object.')
+@click.option('--async-timeout', default=DEFAULT_ASYNC_TIMEOUT, type=click.IntRange(1),
+              help='How many seconds to wait for an --async signing result.')
 @click.option(
     '--suffix',
     '-s',
@@ -102,20 +282,31 @@ def configure(key, value):
     default=None,
     help='A suffix to append to the filename. May be repeated Ex: "test"',
 )
+@click.option('--dry-run', is_flag=True,
+              help='Only run the pre-flight checks, without uploading or signing.')
+@click.option('--skip-check', multiple=True, type=click.Choice(list(RULES)),
+              help='A pre-flight check to skip. May be repeated.')
 @click.argument('src', nargs=1)
 @click.argument('dest', nargs=1, required=False)
 @click.pass_context
-def sign(ctx, src, dest, addon_type, api_key, attach, bucket_name, env, profile, verbose, suffix,
-         **kwargs):
-    """Uploads and signs an addon XPI file."""
-    xpi = load_xpi(src, verbose=verbose)
+def sign(ctx, src, dest, addon_type, api_key, attach, download, bucket_name, env, profile, verbose,
+         suffix, no_cache, no_verify, use_async, async_timeout, dry_run, skip_check, **kwargs):
+    """Uploads and signs an addon XPI file.
 
-    if not dest:
-        dest = xpi.suggested_filename(mark_signed=True, extra_suffixes=suffix)
+    Several environments may be given to sign a single upload in each of them.
+    """
+    with span('xpi.load'):
+        xpi = load_xpi(src, verbose=verbose)
+    cache = None if no_cache else SigningCache.from_config(config)
 
     # Check if the XPI is already signed
-    if xpi.is_signed:
-        output('WARNING: XPI file is already signed.', Fore.YELLOW)
+    if xpi.is_signed and not dry_run:
+        previous = cache.find_signed(xpi) if cache else None
+        if previous:
+            output('WARNING: XPI file is the output of a previous `{}` signing in `{}`.'.format(
+                previous['addon_type'], previous['env']), Fore.YELLOW)
+        else:
+            output('WARNING: XPI file is already signed.', Fore.YELLOW)
         if not click.confirm('Are you sure you want to sign this file?'):
             output('Aborted!')
             exit(1)
@@ -126,129 +317,204 @@ def sign(ctx, src, dest, addon_type, api_key, attach, bucket_name, env, profile,
             output('WARNING: You did not provide a valid addon type.\n', Fore.YELLOW)
         addon_type = prompt_choices('Addon Type', ADDON_TYPES)
 
-    # Validate the environment
-    if env not in ENV_OPTIONS:
-        output('WARNING: You did not provide a valid environment.\n', Fore.YELLOW)
-        env = prompt_choices('Environment', ENV_OPTIONS, default=0)
+    # Validate the environments
+    envs = []
+    for name in parse_envs(env):
+        if name not in ENV_OPTIONS:
+            output('WARNING: You did not provide a valid environment.\n', Fore.YELLOW)
+            name = prompt_choices('Environment', ENV_OPTIONS, default=0)
+        if name not in envs:
+            envs.append(name)
+
+    registry = Registry.from_config(config)
+    problems = []
+    with span('preflight'):
+        for name in envs:
+            problems.extend(Preflight.from_config(config, addon_type, name, cache=cache,
+                                                  registry=registry, skip=skip_check).check(xpi))
+    for problem in problems:
+        output('ERROR: [{}] {}'.format(problem.rule, problem.message), Fore.RED)
+    if problems:
+        exit(1)
+    if dry_run:
+        output('Pre-flight checks passed.', Fore.GREEN)
+        return
+
+    service = get_service()
+    options = {'profile': profile, 'bucket_name': bucket_name, 'use_cache': not no_cache}
+
+    with handle_service_errors(verbose=verbose):
+        if use_async:
+            output('Waiting for the signing result...')
+        if len(envs) == 1:
+            results = {envs[0]: service.sign(src, addon_type, envs[0], use_async=use_async,
+                                             async_timeout=async_timeout, **options)}
+        else:
+            results = service.sign_envs(src, addon_type, envs, use_async=use_async,
+                                        async_timeout=async_timeout, **options)
+
+    dests = env_destinations(xpi, dest, envs, suffix)
+    for name in envs:
+        result = results[name]
+        data = result['data']
+        # Only label messages by environment when there is more than one.
+        label = '[{}] '.format(name) if len(envs) > 1 else ''
+        if result['cached']:
+            output('{}Using cached signing result.'.format(label), Fore.GREEN)
+        else:
+            output('{}Successfully signed!'.format(label), Fore.GREEN)
+        uploaded = data['uploaded']
+        dest = dests[name]
+
+        should_download = not attach or download
+
+        while should_download and os.path.exists(dest):
+            output('\nWARNING: `{}` already exists.'.format(dest), Fore.YELLOW)
+            should_download = click.confirm('Do you want to overwrite this file?')
+            if not should_download and click.confirm(
+                    'Would you like to pick another destination?'):
+                dest = click.prompt('Choose another destination path')
+                should_download = True
+
+        if attach:
+            with handle_service_errors(verbose=verbose):
+                service.attach(attach, src, addon_type, name, uploaded, os.path.basename(dest),
+                               dest=dest if should_download else None, api_key=api_key,
+                               verify=not no_verify, record=result.get('record'), **options)
+            output('{}Attachment successfully created!'.format(label), Fore.GREEN)
+        elif should_download:
+            with handle_service_errors(verbose=verbose):
+                service.download(src, addon_type, name, uploaded, dest, verify=not no_verify,
+                                 record=result.get('record'), **options)
+        else:
+            output('\n{}'.format(json.dumps(data, indent=2, sort_keys=True)))
 
-    profile = profile or config.get('aws.profile_name', default=None)
+    if attach:
+        ctx.invoke(check_needinfo, bug_numbers=[attach], api_key=api_key)
 
-    # Boto setup
-    session = boto3.Session(profile_name=profile)
-    s3 = session.resource('s3')
 
-    try:
-        aws_lambda = session.client('lambda')
-    except NoRegionError:
-        output('ERROR: You must specify a region.', Fore.RED)
+@cli.command(name='sign-batch')
+@click.option('--addon-type', '-t', type=click.Choice(ADDON_TYPES), required=True,
+              help='The type of addon that you want to sign.')
+@click.option('--bucket-name', default=None, help='The S3 bucket to upload the files to.')
+@click.option('--env', '-e', type=click.Choice(ENV_OPTIONS), default=DEFAULT_ENV,
+              help='The environment to sign in.')
+@click.option('--profile', '-p', default=None, help='The name of the AWS profile to use.')
+@click.option('--manifest', '-m', type=click.File('r'), default=None,
+              help='A file listing XPI paths or globs, one per line. Use "-" for stdin.')
+@click.option('--output-dir', '-o', default='.', type=click.Path(file_okay=False),
+              help='The directory to download signed files to.')
+@click.option('--on-conflict', type=click.Choice(batch.CONFLICT_POLICIES),
+              default=batch.CONFLICT_FAIL,
+              help='What to do when a destination file already exists.')
+@click.option('--sign-signed', is_flag=True, help='Sign files that are already signed.')
+@click.option('--upload-workers', default=4, type=click.IntRange(1),
+              help='The maximum number of concurrent uploads.')
+@click.option('--invoke-workers', default=8, type=click.IntRange(1),
+              help='The maximum number of concurrent Lambda invocations.')
+@click.option('--download-workers', default=4, type=click.IntRange(1),
+              help='The maximum number of concurrent downloads.')
+@click.option('--async', 'use_async', is_flag=True,
+              help='Queue signings and poll S3 for their results instead of waiting on Lambda. '
+                   'Failures are only reported by a Lambda that writes a result object.')
+@click.option('--async-timeout', default=DEFAULT_ASYNC_TIMEOUT, type=click.IntRange(1),
+              help='How many seconds to wait for each --async signing result.')
+@click.option('--max-in-flight', default=32, type=click.IntRange(1),
+              help='The maximum number of --async signings waiting for a result.')
+@click.option('--verbose', '-v', is_flag=True)
+@click.option(
+    '--suffix',
+    '-s',
+    multiple=True,
+    default=None,
+    help='A suffix to append to the filenames. May be repeated Ex: "test"',
+)
+@click.option('--dry-run', is_flag=True,
+              help='Only run the pre-flight checks, without uploading or signing.')
+@click.option('--skip-check', multiple=True, type=click.Choice(list(RULES)),
+              help='A pre-flight check to skip. May be repeated.')
+@click.option('--no-verify', is_flag=True,
+              help='Do not verify the signature of downloaded files.')
+@click.argument('sources', nargs=-1)
+def sign_batch(sources, addon_type, bucket_name, env, profile, manifest, output_dir, on_conflict,
+               sign_signed, upload_workers, invoke_workers, download_workers, use_async,
+               async_timeout, max_in_flight, verbose, suffix, dry_run, skip_check, no_verify):
+    """Uploads and signs many addon XPI files concurrently."""
+    sources = batch.expand_sources(sources, manifest)
+    if not sources:
+        output('ERROR: No XPI files were given.', Fore.RED)
         exit(1)
 
-    # Upload the XPI file to the S3 bucket
-    input_bucket_name = bucket_name or 'net-mozaws-{}-addons-signxpi-input'.format(env)
-    input_bucket = s3.Bucket(input_bucket_name)
-    key = os.path.basename(src)
-    input_bucket.put_object(Body=xpi.open(), Key=key)
-
-    # Invoke AWS Lambda function
-    function_name = 'addons-sign-xpi-{}-{}'.format(addon_type, env)
-    lambda_args = {
-        'source': {
-            'bucket': input_bucket_name,
-            'key': key,
-        },
-        'checksum': xpi.sha256sum,
-    }
-    response = aws_lambda.invoke(
-        FunctionName=function_name,
-        Payload=json.dumps(lambda_args)
-    )
+    registry = Registry.from_config(config)
+    checks = Preflight.from_config(config, addon_type, env,
+                                   cache=SigningCache.from_config(config), registry=registry,
+                                   skip=skip_check)
+    if dry_run:
+        results = checks.check_paths(sources, workers=upload_workers + invoke_workers)
+        output(format_table(
+            ['SOURCE', 'STATUS', 'PROBLEMS'],
+            [[src, 'failed' if problems else 'ok', ' '.join(p.message for p in problems)]
+             for src, problems in zip(sources, results)]))
+        if any(results):
+            exit(1)
+        return
 
-    payload = response['Payload'].read()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
 
-    try:
-        data = json.loads(payload)
-    except Exception as e:
-        output("ERROR Couldn't parse response: {} {}".format(e, payload), Fore.RED)
-        exit(1)
+    pipeline = batch.SigningPipeline(
+        get_signer(profile, bucket_name), addon_type, env, output_dir=output_dir,
+        suffixes=suffix, on_conflict=on_conflict, sign_signed=sign_signed,
+        upload_workers=upload_workers, invoke_workers=invoke_workers,
+        download_workers=download_workers, use_async=use_async, async_timeout=async_timeout,
+        max_waiting=max_in_flight, preflight=checks, registry=registry,
+        verify=not no_verify)
 
-    if response['StatusCode'] >= 300 or 'FunctionError' in response:
-        output('ERROR: Invoking lambda failed.', Fore.RED)
+    def report(item):
         if verbose:
-            if 'stackTrace' in data:
-                tb_out = ''.join(traceback.format_list(data['stackTrace']))
-                output(tb_out.rstrip('\n'))
-            error_type = data.get('errorType', 'No error type')
-            error_msg = data.get('errorMessage')
-            error_out = error_type
-            if error_msg:
-                error_out = '{}: {}'.format(error_type, error_msg)
-            output(error_out)
-        exit(1)
+            output('{}: {}'.format(item.src, item.status))
 
-    # Download the file or dump the data
-    if 'uploaded' in data:
-        uploaded = data['uploaded']
-        output('Successfully signed!', Fore.GREEN)
-    else:
-        output('ERROR: Something went wrong!', Fore.RED)
-        exit(1)
+    items = pipeline.run(sources, callback=report)
 
-    should_download = not attach
-
-    while should_download and os.path.exists(dest):
-        output('\nWARNING: `{}` already exists.'.format(dest), Fore.YELLOW)
-        should_download = click.confirm('Do you want to overwrite this file?')
-        if not should_download and click.confirm('Would you like to pick another destination?'):
-            dest = click.prompt('Choose another destination path')
-            should_download = True
-
-    if should_download:
-        output_bucket = s3.Bucket(uploaded.get('bucket'))
-        output_bucket.download_file(uploaded.get('key'), dest)
-    elif attach and 'uploaded' in data:
-        api_key = api_key or config.get('bugzilla.api_key', default=None)
-        bz = BugzillaAPI(api_key)
-        signed_xpi = s3.Object(uploaded.get('bucket'), uploaded.get('key'))
-        attachment_data = base64.b64encode(signed_xpi.get()['Body'].read())
-        bz.create_attachment_for_bug(attach, attachment_data=attachment_data, file_name=dest,
-                                     summary=dest, content_type='application/x-xpinstall')
-        output('Attachment successfully created!', Fore.GREEN)
-    else:
-        output('\n{}'.format(json.dumps(data, indent=2, sort_keys=True)))
+    output(format_table(
+        ['SOURCE', 'STATUS', 'RESULT'],
+        [[i.src, i.status, i.dest or i.message] for i in items]))
 
-    if attach:
-        ctx.invoke(check_needinfo, bug_number=attach, **kwargs)
+    if not all(i.ok for i in items):
+        exit(1)
 
 
 @cli.command()
 @click.option('--api-key', '-k', default=None, help='The Bugzilla API key to use.')
-@click.argument('bug_number', nargs=1)
-def check_needinfo(bug_number, api_key):
-    """Checks for an open needinfo on the given bug, and offers to clear it."""
-    api_key = api_key or config.get('bugzilla.api_key', default=None)
-    bz = BugzillaAPI(api_key)
-    bug = bz.get_bug(bug_number)
-    flags = bug.get_flags()
-
-    user_email = bz.who_am_i()['name']
-    for flag in flags:
-        needs_info = flag['name'] == 'needinfo' and flag['status'] == '?'
-        if needs_info and flag['requestee'] == user_email:
-            if click.confirm('Clear your needinfo from {}?'.format(flag['setter'])):
-                bug.set_flags([{'id': flag['id'], 'status': 'X'}])
-                output('Needinfo cleared', Fore.GREEN)
-            break
+@click.argument('bug_numbers', nargs=-1, required=True)
+def check_needinfo(bug_numbers, api_key):
+    """Checks for open needinfos on the given bugs, and offers to clear them."""
+    service = get_service()
+    with handle_service_errors():
+        needinfos = service.needinfos(bug_numbers, api_key=api_key)
+
+    for needinfo in needinfos:
+        prompt = 'Clear your needinfo from {}?'.format(needinfo['setter'])
+        if len(bug_numbers) > 1:
+            prompt = 'Bug {}: {}'.format(needinfo['bug'], prompt)
+        if click.confirm(prompt):
+            with handle_service_errors():
+                service.clear_needinfo(needinfo['bug'], needinfo['id'], api_key=api_key)
+            output('Needinfo cleared', Fore.GREEN)
 
 
 @cli.command()
 @click.option('--addon-type', '-t', help='The type of addon that you want to sign.')
 @click.option('--bucket-name', default=None, help='The S3 bucket to upload the file to.')
-@click.option('--env', '-e', default=DEFAULT_ENV, help='The environment to sign in.')
+@click.option('--env', '-e', multiple=True, default=[DEFAULT_ENV],
+              help='The environment to sign in. May be repeated or comma separated.')
 @click.option('--profile', '-p', default=None, help='The name of the AWS profile to use.')
 @click.option('--verbose', '-v', is_flag=True)
 @click.option('--api-key', '-k', default=None, help='The Bugzilla API key to use.')
 @click.option('--include-obsolete', '-o', is_flag=True)
 @click.option('--no-attach', is_flag=True, help='Do not reattach the signed XPI to the bug.')
+@click.option('--no-cache', is_flag=True,
+              help='Do not use or update the attachment and signing caches.')
 @click.argument('bug_number', nargs=1)
 @click.argument('dest', nargs=1, required=False)
 @click.option(
@@ -260,8 +526,7 @@ def check_needinfo(bug_number, api_key):
 )
 @click.pass_context
 def sign_from_bug(ctx, bug_number, api_key, include_obsolete, no_attach, **kwargs):
-    api_key = api_key or config.get('bugzilla.api_key', default=None)
-    bz = BugzillaAPI(api_key)
+    bz = get_bugzilla(api_key)
     attachments = bz.get_attachments_for_bug(bug_number)
 
     if not no_attach:
@@ -278,58 +543,449 @@ def sign_from_bug(ctx, bug_number, api_key, include_obsolete, no_attach, **kwarg
         'Select attachment', choices,
         name_parser=lambda i: '{} by {}'.format(i['summary'], i['creator']))
 
-    attachment_data = bz.get_attachment_data(attachment['id'])
+    # The file name is kept so the upload key matches the attachment name.
+    with spooled_buffer(attachment['file_name']) as src:
+        with span('bugzilla.fetch_attachment', attachment=attachment['id']) as s:
+            if kwargs.get('no_cache'):
+                bz.download_attachment(attachment['id'], src)
+            else:
+                src.link(AttachmentCache.from_config(config).fetch(bz, attachment))
+            s.set(bytes=src.size, in_memory=src.in_memory)
+
+        ctx.invoke(sign, src=src, api_key=api_key, **kwargs)
 
-    tmpdir = tempfile.mkdtemp()
-    tmppath = os.path.join(tmpdir, attachment['file_name'])
-    with open(tmppath, 'wb') as f:
-        f.write(base64.b64decode(attachment_data))
 
-    ctx.invoke(sign, src=tmppath, **kwargs)
+@cli.command(name='sign-bugs')
+@click.option('--addon-type', '-t', type=click.Choice(ADDON_TYPES), required=True,
+              help='The type of addon that you want to sign.')
+@click.option('--bucket-name', default=None, help='The S3 bucket to upload the files to.')
+@click.option('--env', '-e', type=click.Choice(ENV_OPTIONS), default=DEFAULT_ENV,
+              help='The environment to sign in.')
+@click.option('--profile', '-p', default=None, help='The name of the AWS profile to use.')
+@click.option('--api-key', '-k', default=None, help='The Bugzilla API key to use.')
+@click.option('--query', '-q', default=None,
+              help='A Bugzilla search, as a query string or bug list URL, adding more bugs.')
+@click.option('--select', 'policy', type=click.Choice(bugs.SELECT_POLICIES),
+              default=bugs.SELECT_ALL, help='Which XPI attachments of each bug to sign.')
+@click.option('--pattern', default=None,
+              help='Only sign attachments whose file name matches this glob.')
+@click.option('--include-obsolete', '-o', is_flag=True)
+@click.option('--no-attach', is_flag=True, help='Do not reattach the signed XPIs to the bugs.')
+@click.option('--output-dir', default=None, type=click.Path(file_okay=False),
+              help='Also save the signed files to this directory.')
+@click.option('--clear-needinfo', is_flag=True,
+              help='Clear your needinfos on bugs whose attachments were all signed.')
+@click.option('--workers', default=bugs.DEFAULT_WORKERS, type=click.IntRange(1),
+              help='The maximum number of attachments to sign at once.')
+@click.option('--no-cache', is_flag=True,
+              help='Do not use or update the attachment and signing caches.')
+@click.option('--no-verify', is_flag=True,
+              help='Do not verify the signature of downloaded files.')
+@click.option('--skip-check', multiple=True, type=click.Choice(list(RULES)),
+              help='A pre-flight check to skip. May be repeated.')
+@click.option('--verbose', '-v', is_flag=True)
+@click.option(
+    '--suffix',
+    '-s',
+    multiple=True,
+    default=None,
+    help='A suffix to append to the filename. May be repeated Ex: "test"',
+)
+@click.argument('bug_numbers', nargs=-1)
+def sign_bugs(bug_numbers, addon_type, bucket_name, env, profile, api_key, query, policy,
+              pattern, include_obsolete, no_attach, output_dir, clear_needinfo, workers,
+              no_cache, no_verify, skip_check, verbose, suffix):
+    """Signs the XPI attachments of many bugs concurrently, without prompting."""
+    bz = get_bugzilla(api_key)
+    bug_numbers = [str(b) for b in bug_numbers]
+    if query:
+        with handle_service_errors(verbose=verbose):
+            found = bz.search_bugs(query)
+        bug_numbers.extend(b for b in found if b not in bug_numbers)
+    if not bug_numbers:
+        output('ERROR: No bugs were given or found.', Fore.RED)
+        exit(1)
+
+    if no_attach and not output_dir:
+        output_dir = '.'
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    cache = None if no_cache else SigningCache.from_config(config)
+    registry = Registry.from_config(config)
+    signer = bugs.BugSigner(
+        get_service(), bz, addon_type, env, api_key=api_key, policy=policy, pattern=pattern,
+        include_obsolete=include_obsolete, attach=not no_attach, output_dir=output_dir,
+        suffixes=suffix,
+        attachment_cache=None if no_cache else AttachmentCache.from_config(config),
+        max_memory=config.get('download.max_memory'),
+        preflight=Preflight.from_config(config, addon_type, env, cache=cache,
+                                        registry=registry, skip=skip_check),
+        verify=not no_verify, workers=workers,
+        service_options={'profile': profile, 'bucket_name': bucket_name,
+                         'use_cache': not no_cache})
+
+    def report(item):
+        if verbose:
+            output('Bug {}: {}: {}'.format(item.bug, item.src, item.status))
+
+    with handle_service_errors(verbose=verbose):
+        items = signer.run(bug_numbers, callback=report)
+
+    output(format_table(
+        ['BUG', 'ATTACHMENT', 'STATUS', 'RESULT'],
+        [[i.bug, i.src, i.status, i.dest or i.message] for i in items]))
+
+    if clear_needinfo and not no_attach:
+        with handle_service_errors(verbose=verbose):
+            needinfos = signer.clear_needinfos(items)
+        for needinfo in needinfos:
+            if needinfo['error']:
+                output('Bug {}: could not clear the needinfo from {}: {}'.format(
+                    needinfo['bug'], needinfo['setter'], needinfo['error']), Fore.RED)
+            else:
+                output('Bug {}: cleared the needinfo from {}.'.format(
+                    needinfo['bug'], needinfo['setter']), Fore.GREEN)
+
+    if not all(i.ok for i in items):
+        exit(1)
 
 
 @cli.command()
 @click.option('--addon-type', '-t', help='The type of addon that you want to sign.')
 @click.option('--bucket-name', default=None, help='The S3 bucket to upload the file to.')
-@click.option('--env', '-e', default=DEFAULT_ENV, help='The environment to sign in.')
+@click.option('--env', '-e', multiple=True, default=[DEFAULT_ENV],
+              help='The environment to sign in. May be repeated or comma separated.')
 @click.option('--profile', '-p', default=None, help='The name of the AWS profile to use.')
 @click.option('--verbose', '-v', is_flag=True)
+@click.option('--no-cache', is_flag=True,
+              help='Do not use or update the download and signing caches.')
 @click.argument('url', nargs=1)
 @click.argument('dest', nargs=1, required=False)
 @click.pass_context
 def sign_from_url(ctx, url, **kwargs):
+    import requests
+
+    from mozilla_addon_signer.download import URLDownloader
+
+    downloader = URLDownloader(timeout=config.get('download.timeout'),
+                               retries=config.get('download.retries'))
+
+    with spooled_buffer('tmp.xpi') as src:
+        try:
+            with span('url.fetch', url=url) as s:
+                # The checksum computed while downloading saves hashing the XPI again.
+                if kwargs.get('no_cache'):
+                    src.sha256 = downloader.download(url, src)['sha256']
+                else:
+                    url_cache = URLCache.from_config(config)
+                    path = url_cache.fetch(downloader, url)
+                    src.link(path, sha256=url_cache.checksum(url))
+                s.set(bytes=src.size, in_memory=src.in_memory)
+        except (requests.exceptions.HTTPError, URLDownloader.DownloadError) as err:
+            output(err, Fore.RED)
+            exit(1)
+
+        ctx.invoke(sign, src=src, **kwargs)
+
+
+@cli.command()
+@click.option('--address', default=None,
+              help='A Unix socket path, or http://127.0.0.1:PORT to listen on local HTTP.')
+@click.option('--concurrency', default=None, type=click.IntRange(1),
+              help='How many jobs to run at once.')
+@click.option('--max-queued', default=None, type=click.IntRange(0),
+              help='How many jobs may wait for a free slot before new ones are refused.')
+def serve(address, concurrency, max_queued):
+    """Run a signing daemon that keeps AWS and Bugzilla clients warm.
+
+    While it runs, `sign` and `check_needinfo` hand their work to the daemon.
+    """
+    from mozilla_addon_signer.daemon import Daemon
+
+    service = SigningService(make_signer, get_bugzilla, cache=SigningCache.from_config(config),
+                             registry=Registry.from_config(config))
     try:
-        r = requests.get(url)
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        output(err, Fore.RED)
+        daemon = Daemon(
+            service,
+            address=address or config.get('daemon.address', default=DAEMON_SOCKET),
+            concurrency=concurrency or config.get('daemon.concurrency'),
+            max_queued=max_queued if max_queued is not None else config.get('daemon.max_queued'),
+        )
+    except (RuntimeError, IOError, OSError) as e:
+        output('ERROR: {}'.format(e), Fore.RED)
         exit(1)
 
-    tmpdir = tempfile.mkdtemp()
-    tmppath = os.path.join(tmpdir, 'tmp.xpi')
-    with open(tmppath, 'wb') as f:
-        f.write(r.content)
+    output('Listening on {}'.format(daemon.address), Fore.GREEN)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        output('Stopped.')
+
 
-    ctx.invoke(sign, src=tmppath, **kwargs)
+def show_records(rows, as_json=False):
+    if as_json:
+        click.echo(json.dumps(rows, indent=2, sort_keys=True))
+        return
+    output(format_table(
+        ['ID', 'SIGNED', 'ADDON', 'VERSION', 'TYPE', 'ENV', 'BUG', 'CHECKSUM', 'OUTPUT'],
+        [[row['id'], time.strftime('%Y-%m-%d %H:%M', time.localtime(row['created'])),
+          row['addon_id'], row['version'] or '', row['addon_type'], row['env'],
+          row['bug'] or '', row['checksum'][:12],
+          row['dest'] or row['output_key'] or ''] for row in rows]))
 
 
 @cli.command()
-@click.argument('src', nargs=1)
+@click.argument('addon_id')
+@click.option('--addon-type', '-t', type=click.Choice(ADDON_TYPES), default=None,
+              help='Only list signings of this addon type.')
+@click.option('--env', '-e', type=click.Choice(ENV_OPTIONS), default=None,
+              help='Only list signings in this environment.')
+@click.option('--limit', default=DEFAULT_LIMIT, type=click.IntRange(1),
+              help='The maximum number of signings to list.')
+@click.option('--json', 'as_json', is_flag=True, help='Output the signings as JSON.')
+def history(addon_id, addon_type, env, limit, as_json):
+    """Lists the recorded signings of an addon, newest first."""
+    rows = Registry.from_config(config).find(addon_id=addon_id, addon_type=addon_type, env=env,
+                                             limit=limit)
+    show_records(rows, as_json)
+
+
+@cli.command()
+@click.option('--id', 'addon_id', default=None, help='The addon id.')
+@click.option('--version', default=None, help='The addon version.')
+@click.option('--checksum', default=None,
+              help='The SHA-256 checksum of the unsigned or the signed XPI.')
+@click.option('--bug', default=None, type=int, help='The bug the signed XPI was attached to.')
+@click.option('--addon-type', '-t', type=click.Choice(ADDON_TYPES), default=None)
+@click.option('--env', '-e', type=click.Choice(ENV_OPTIONS), default=None)
+@click.option('--limit', default=DEFAULT_LIMIT, type=click.IntRange(1),
+              help='The maximum number of signings to list.')
+@click.option('--json', 'as_json', is_flag=True, help='Output the signings as JSON.')
+def find(addon_id, version, checksum, bug, addon_type, env, limit, as_json):
+    """Finds recorded signings by addon id, version, checksum or bug."""
+    if not any([addon_id, version, checksum, bug]):
+        output('ERROR: Pass at least one of --id, --version, --checksum or --bug.', Fore.RED)
+        exit(1)
+
+    registry = Registry.from_config(config)
+    filters = {'addon_id': addon_id, 'version': version, 'bug': bug,
+               'addon_type': addon_type, 'env': env, 'limit': limit}
+    if checksum:
+        # Checksums of inputs and outputs are indexed separately.
+        rows = registry.find(checksum=checksum.lower(), **filters)
+        if not rows:
+            rows = registry.find(signed_checksum=checksum.lower(), **filters)
+    else:
+        rows = registry.find(**filters)
+
+    show_records(rows, as_json)
+    if not rows:
+        exit(1)
+
+
+@cli.group(name='cache')
+def cache_group():
+    """Manage the local caches."""
+
+
+@cache_group.command(name='clear')
+def cache_clear():
+    """Remove every cached entry."""
+    for cache in all_caches(config):
+        cache.clear()
+    output('Cache cleared.', Fore.GREEN)
+
+
+@cache_group.command(name='prune')
+def cache_prune():
+    """Remove expired entries and shrink the cache to its size limit."""
+    evicted = sum(cache.evict() for cache in all_caches(config))
+    output('Evicted {} entries.'.format(evicted), Fore.GREEN)
+
+
+@cli.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--addon-type', '-t', type=click.Choice(ADDON_TYPES), default=None,
+              help='The type of addon to sign. Defaults to the `watch.addon_type` config key.')
+@click.option('--env', '-e', type=click.Choice(ENV_OPTIONS), default=None,
+              help='The environment to sign in. Defaults to the `watch.env` config key.')
+@click.option('--bucket-name', default=None, help='The S3 bucket to upload the files to.')
+@click.option('--profile', '-p', default=None, help='The name of the AWS profile to use.')
+@click.option('--output-dir', '-o', required=True, type=click.Path(file_okay=False),
+              help='The directory to download signed files to.')
+@click.option('--pattern', default='*.xpi', help='Only sign files matching this glob.')
+@click.option('--on-conflict', type=click.Choice(batch.CONFLICT_POLICIES),
+              default=batch.CONFLICT_RENAME,
+              help='What to do when a destination file already exists.')
+@click.option('--sign-signed', is_flag=True, help='Sign files that are already signed.')
+@click.option('--max-in-flight', default=4, type=click.IntRange(1),
+              help='The maximum number of files being signed at once.')
+@click.option('--settle', default=2.0, type=float,
+              help='Seconds a file must stay unchanged before it is signed.')
+@click.option('--poll-interval', default=1.0, type=float,
+              help='Seconds between checks of the directory.')
+@click.option('--polling', is_flag=True, help='Poll the directory even if inotify is available.')
+@click.option('--once', is_flag=True, help='Sign the files already there and exit.')
+@click.option('--no-verify', is_flag=True,
+              help='Do not verify the signature of downloaded files.')
+@click.option(
+    '--suffix',
+    '-s',
+    multiple=True,
+    default=None,
+    help='A suffix to append to the filenames. May be repeated Ex: "test"',
+)
+def watch(directory, addon_type, env, bucket_name, profile, output_dir, pattern, on_conflict,
+          sign_signed, max_in_flight, settle, poll_interval, polling, once, suffix, no_verify):
+    """Signs addon XPI files as they are added to a directory."""
+    from mozilla_addon_signer.watch import Watcher
+
+    addon_type = addon_type or config.get('watch.addon_type')
+    env = env or config.get('watch.env', default=DEFAULT_ENV)
+    if addon_type not in ADDON_TYPES or env not in ENV_OPTIONS:
+        output('ERROR: A valid addon type and environment are required.', Fore.RED)
+        exit(1)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    registry = Registry.from_config(config)
+    pipeline = batch.SigningPipeline(
+        get_signer(profile, bucket_name), addon_type, env, output_dir=output_dir,
+        suffixes=suffix, on_conflict=on_conflict, sign_signed=sign_signed,
+        upload_workers=max_in_flight, invoke_workers=max_in_flight,
+        download_workers=max_in_flight, registry=registry, verify=not no_verify,
+        preflight=Preflight.from_config(config, addon_type, env,
+                                        cache=SigningCache.from_config(config),
+                                        registry=registry))
+
+    def report(item):
+        color = Fore.RED if not item.ok else Fore.GREEN if item.dest else Fore.YELLOW
+        output('{}: {} {}'.format(item.src, item.status, item.dest or item.message), color)
+
+    watcher = Watcher(directory, pipeline, pattern=pattern, settle=settle,
+                      poll_interval=poll_interval, max_in_flight=max_in_flight,
+                      use_inotify=not polling, callback=report)
+    if once:
+        watcher.run_once()
+        return
+
+    output('Watching {} for {} files...'.format(directory, pattern))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        output('Stopped.')
+
+
+def format_signature(result):
+    lines = ['{path} ({id} {version})'.format(**result)]
+    for key, value in sorted(result['signature_file'].items()):
+        lines.append('  {}: {}'.format(key, value))
+    for i, cert in enumerate(result['certificates']):
+        lines.extend([
+            '',
+            '  Certificate {}:'.format(i + 1),
+            '    Subject: {}'.format(cert['subject']),
+            '    Issuer: {}'.format(cert['issuer']),
+            '    Serial Number: {}'.format(cert['serial_number']),
+            '    Not Before: {}'.format(cert['not_before']),
+            '    Not After: {}'.format(cert['not_after']),
+            '    Signature Hash Algorithm: {}'.format(cert['signature_hash_algorithm']),
+            '    SHA256 Fingerprint: {}'.format(cert['sha256_fingerprint']),
+        ])
+    return '\n'.join(lines)
+
+
+@cli.command()
+@click.argument('sources', nargs=-1, required=True)
+@click.option('--json', 'as_json', is_flag=True, help='Output the certificates as JSON.')
+@click.option('--workers', default=signature.DEFAULT_WORKERS, type=click.IntRange(1),
+              help='The number of files to inspect in parallel.')
+@click.option('--no-cache', is_flag=True, help='Do not use or update the certificate cache.')
 @click.option('--verbose', '-v', is_flag=True)
-def show_cert(src, verbose):
-    """Inspect the certificate for a signed addon."""
-    xpi = load_xpi(src, verbose=verbose)
+def show_cert(sources, as_json, workers, no_cache, verbose):
+    """Inspect the certificates of signed addons."""
+    cache = None if no_cache else CertificateCache.from_config(config)
+    results = signature.inspect_paths(sources, cache=cache, workers=workers)
 
-    if not xpi.is_signed:
-        output('ERROR: Source file is not a signed addon.', Fore.RED)
+    if as_json:
+        click.echo(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        for result in results:
+            if 'error' in result:
+                output('ERROR: `{}` {}.'.format(result['path'], result['error']), Fore.RED)
+            else:
+                output(format_signature(result))
+            output('')
+
+    if any('error' in result for result in results):
         exit(1)
 
-    cmd = 'openssl pkcs7  -inform der -in {} -print_certs -text'.format(xpi.certificate_path)
-    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
-    out, err = process.communicate()
 
-    if err:
-        output('An error occurred!', Fore.RED)
-        output(err.decode())
+@cli.command()
+@click.argument('sources', nargs=-1, required=True)
+@click.option('--json', 'as_json', is_flag=True, help='Output the results as JSON.')
+@click.option('--workers', default=signature.DEFAULT_WORKERS, type=click.IntRange(1),
+              help='The number of members to hash in parallel.')
+def verify(sources, as_json, workers):
+    """Check signed addons against the digests in their META-INF files."""
+    results = [signature.verify_path(src, workers=workers) for src in sources]
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2, sort_keys=True))
     else:
-        output(out.decode())
+        for result in results:
+            output(format_verification(result), Fore.GREEN if result['ok'] else Fore.RED)
+
+    if not all(result['ok'] for result in results):
+        exit(1)
+
+
+@cli.group(name='xpi')
+def xpi_group():
+    """Inspect XPI files."""
+
+
+def format_diff(result):
+    lines = []
+    for entry in result['added']:
+        lines.append('A  {} ({} bytes)'.format(entry['name'], entry['size']))
+    for entry in result['removed']:
+        lines.append('D  {} ({} bytes)'.format(entry['name'], entry['size']))
+    for entry in result['changed']:
+        lines.append('M  {} ({} -> {} bytes)'.format(
+            entry['name'], entry['old_size'], entry['new_size']))
+    lines.sort(key=lambda line: line[3:])
+    lines.append('{} added, {} removed, {} changed, {} unchanged.'.format(
+        len(result['added']), len(result['removed']), len(result['changed']),
+        result['unchanged']))
+    return '\n'.join(lines)
+
+
+@xpi_group.command(name='diff')
+@click.argument('old', nargs=1)
+@click.argument('new', nargs=1)
+@click.option('--json', 'as_json', is_flag=True, help='Output the differences as JSON.')
+@click.option('--workers', default=signature.DEFAULT_WORKERS, type=click.IntRange(1),
+              help='The number of changed members to hash in parallel.')
+@click.option('--verbose', '-v', is_flag=True)
+def xpi_diff(old, new, as_json, workers, verbose):
+    """Show which members differ between two XPIs.
+
+    Members are compared by the size and CRC32 in the zip central directory, so
+    only changed members are read. Signature files in META-INF are ignored.
+    """
+    from mozilla_addon_signer.diff import diff_xpis
+
+    old_xpi = load_xpi(old, verbose=verbose)
+    new_xpi = load_xpi(new, verbose=verbose)
+    result = diff_xpis(old_xpi, new_xpi, workers=workers)
+
+    if as_json:
+        click.echo(json.dumps(result, indent=2, sort_keys=True))
+        return
+    if (old_xpi.id, old_xpi.version) != (new_xpi.id, new_xpi.version):
+        output('{} {} -> {} {}'.format(old_xpi.id, old_xpi.version, new_xpi.id,
+                                       new_xpi.version))
+    output(format_diff(result))
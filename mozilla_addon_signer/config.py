@@ -1,13 +1,15 @@
 import configparser
+import os
 
 from mozilla_addon_signer import CONFIG_PATH
 
 
 class Config(object):
     _path = None
+    _loaded = False
 
     def __init__(self, path):
-        self.config = configparser.ConfigParser()
+        self._config = configparser.ConfigParser()
         self.path = path
 
     @property
@@ -18,9 +20,21 @@ class Config(object):
     def path(self, value):
         if value != self._path:
             self._path = value
-            with open(self._path, 'a+') as f:
-                f.seek(0)
-                self.config.read_file(f)
+            self._config = configparser.ConfigParser()
+            self._loaded = False
+
+    @property
+    def config(self):
+        # The file is only read the first time a value is needed.
+        if not self._loaded:
+            self._loaded = True
+            if self._path and os.path.exists(self._path):
+                try:
+                    with open(self._path) as f:
+                        self._config.read_file(f)
+                except (IOError, OSError):
+                    pass
+        return self._config
 
     @staticmethod
     def _parse_key(key):
@@ -39,6 +53,12 @@ class Config(object):
 
         return value
 
+    def get_bool(self, key, default=False):
+        value = self.get(key)
+        if value is None:
+            return default
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
     def set(self, key, value, delete_none=True):
         keys = self._parse_key(key)
 
@@ -66,10 +86,4 @@ class Config(object):
             self.config.write(f)
 
 
-try:
-    config = Config(CONFIG_PATH)
-except Exception as ex:
-    if isinstance(ex.__cause__, IOError):
-        config = Config(None)
-    else:
-        raise
+config = Config(CONFIG_PATH)
@@ -0,0 +1,342 @@
+import binascii
+import json
+import os
+import socket
+import threading
+
+from six.moves import BaseHTTPServer, http_client, socketserver
+
+from mozilla_addon_signer import DAEMON_SOCKET, DAEMON_STATE_PATH
+from mozilla_addon_signer.service import SigningService
+from mozilla_addon_signer.tracing import span
+from mozilla_addon_signer.transfer import SpooledBuffer
+
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_QUEUED = 32
+CONNECT_TIMEOUT = 1
+
+# The service methods that can be run as jobs.
+JOB_TYPES = ['sign', 'sign_envs', 'download', 'attach', 'needinfos', 'clear_needinfo']
+
+
+def source_path(src):
+    """Return a path the daemon can read ``src`` from.
+
+    A :class:`SpooledBuffer` only exists in this process, so it is spilled to disk.
+    """
+    if isinstance(src, SpooledBuffer):
+        return src.spill()
+    return os.path.abspath(src)
+
+
+def parse_address(address):
+    """Return ``('http', (host, port))`` or ``('unix', path)`` for a daemon address."""
+    if address.startswith('http://'):
+        host, _, port = address[len('http://'):].rstrip('/').rpartition(':')
+        return 'http', (host or '127.0.0.1', int(port))
+    return 'unix', os.path.expanduser(address)
+
+
+class JobQueue(object):
+    """Runs at most ``concurrency`` jobs at once and rejects jobs beyond ``max_queued``."""
+
+    class QueueFull(Exception):
+        pass
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, max_queued=DEFAULT_MAX_QUEUED):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.pending = 0
+        self._lock = threading.Lock()
+
+    def run(self, fn, **kwargs):
+        with self._lock:
+            if self.pending >= self.concurrency + self.max_queued:
+                raise self.QueueFull('The signing daemon has too many queued jobs.')
+            self.pending += 1
+        try:
+            return self.executor.submit(fn, **kwargs).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': min(self.pending, self.concurrency),
+                'queued': max(self.pending - self.concurrency, 0),
+                'concurrency': self.concurrency,
+                'max_queued': self.max_queued,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def serialize_error(e):
+    from mozilla_addon_signer.signing import Signer
+
+    error = {'type': e.__class__.__name__, 'message': str(e) or e.__class__.__name__}
+    if isinstance(e, (Signer.LambdaError, SigningService.VerificationError)):
+        error['data'] = e.data
+    return error
+
+
+class DaemonHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        # Unix socket peers have no host and port.
+        return 'local'
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if self.headers.get('Authorization') != 'Bearer {}'.format(self.server.token):
+            self.send_json(401, {'error': {'type': 'Unauthorized', 'message': 'Bad token.'}})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path == '/status':
+            self.send_json(200, dict(self.server.jobs.status(), pid=os.getpid()))
+        else:
+            self.send_json(404, {'error': {'type': 'NotFound', 'message': self.path}})
+
+    def do_POST(self):
+        # Always consume the body, so a rejected request leaves the connection usable.
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if not self.authorized():
+            return
+        job_type = self.path[len('/jobs/'):] if self.path.startswith('/jobs/') else None
+        if job_type not in JOB_TYPES:
+            self.send_json(404, {'error': {'type': 'NotFound', 'message': self.path}})
+            return
+
+        try:
+            params = json.loads(body.decode('utf-8') or '{}')
+        except ValueError as e:
+            self.send_json(400, {'error': {'type': 'BadRequest', 'message': str(e)}})
+            return
+
+        try:
+            result = self.server.jobs.run(getattr(self.server.service, job_type), **params)
+        except JobQueue.QueueFull as e:
+            self.send_json(503, {'error': serialize_error(e)})
+        except Exception as e:
+            self.send_json(500, {'error': serialize_error(e)})
+        else:
+            self.send_json(200, {'result': result})
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Only the owner may connect; the state file holding the token is private too.
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+class Daemon(object):
+    """Serves a :class:`SigningService` over a Unix socket or local HTTP."""
+
+    def __init__(self, service, address=DAEMON_SOCKET, concurrency=None, max_queued=None,
+                 state_path=DAEMON_STATE_PATH):
+        concurrency = int(concurrency or DEFAULT_CONCURRENCY)
+        max_queued = int(DEFAULT_MAX_QUEUED if max_queued is None else max_queued)
+        self.kind, self.bind_address = parse_address(address)
+        self.state_path = state_path
+
+        if self.kind == 'unix':
+            if os.path.exists(self.bind_address):
+                if _listening(self.bind_address):
+                    raise RuntimeError('A daemon is already listening on {}'.format(address))
+                # Left behind by a daemon that did not shut down cleanly.
+                os.remove(self.bind_address)
+            self.server = ThreadingUnixHTTPServer(self.bind_address, DaemonHandler)
+            self.address = self.bind_address
+        else:
+            self.server = ThreadingHTTPServer(self.bind_address, DaemonHandler)
+            self.address = 'http://{}:{}'.format(*self.server.server_address[:2])
+
+        self.server.service = service
+        self.server.jobs = JobQueue(concurrency, max_queued)
+        self.server.token = binascii.hexlify(os.urandom(16)).decode()
+
+    def write_state(self):
+        # Written aside and renamed into place so clients never read a partial file.
+        tmp_path = '{}.{}.tmp'.format(self.state_path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'address': self.address, 'token': self.server.token,
+                       'pid': os.getpid()}, f)
+        os.rename(tmp_path, self.state_path)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.write_state()
+        try:
+            self.server.serve_forever(poll_interval=poll_interval)
+        finally:
+            self.close()
+
+    def close(self):
+        self.server.server_close()
+        self.server.jobs.shutdown()
+        if self.kind == 'unix' and os.path.exists(self.bind_address):
+            os.remove(self.bind_address)
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                try:
+                    ours = json.load(f).get('token') == self.server.token
+                except ValueError:
+                    ours = True
+            if ours:
+                os.remove(self.state_path)
+
+
+def _listening(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (IOError, OSError):
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class UnixHTTPConnection(http_client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        http_client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DaemonClient(object):
+    """Talks to a running daemon, with the same methods as :class:`SigningService`."""
+
+    class DaemonError(Exception):
+        pass
+
+    def __init__(self, address, token):
+        self.kind, self.bind_address = parse_address(address)
+        self.address = address
+        self.token = token
+
+    @classmethod
+    def from_state(cls, state_path=DAEMON_STATE_PATH):
+        """Return a client for the running daemon, or ``None`` if there is none."""
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        client = cls(state['address'], state['token'])
+        return client if client.alive() else None
+
+    def _connection(self, timeout=None):
+        if self.kind == 'unix':
+            return UnixHTTPConnection(self.bind_address, timeout=timeout)
+        return http_client.HTTPConnection(*self.bind_address, timeout=timeout)
+
+    def _request(self, method, path, params=None, timeout=None):
+        conn = self._connection(timeout)
+        try:
+            body = json.dumps(params).encode('utf-8') if params is not None else None
+            conn.request(method, path, body=body, headers={
+                'Authorization': 'Bearer {}'.format(self.token),
+                'Content-Type': 'application/json',
+            })
+            res = conn.getresponse()
+            data = json.loads(res.read().decode('utf-8') or '{}')
+        except (IOError, OSError, http_client.HTTPException) as e:
+            # The daemon stopped, or crashed, after its state file was read.
+            raise self.DaemonError(
+                'Lost the signing daemon at {} ({}). Start it again with '
+                '`mozilla-addon-signer serve`.'.format(self.address, e))
+        finally:
+            conn.close()
+
+        if 'error' in data:
+            raise self._exception(data['error'])
+        return data
+
+    def _exception(self, error):
+        from mozilla_addon_signer.signing import Signer
+
+        if error['type'] == 'LambdaError':
+            return Signer.LambdaError(error.get('data', {}))
+        if error['type'] == 'VerificationError':
+            return SigningService.VerificationError(error.get('data', {}))
+        if error['type'] in ('SigningError', 'NoRegionError'):
+            return Signer.SigningError(error['message'])
+        return self.DaemonError('{}: {}'.format(error['type'], error['message']))
+
+    def alive(self):
+        try:
+            self.status()
+        except (IOError, OSError, ValueError, self.DaemonError):
+            return False
+        return True
+
+    def status(self):
+        return self._request('GET', '/status', timeout=CONNECT_TIMEOUT)
+
+    def run(self, job_type, **params):
+        # The daemon's own phases are not traced here; this span is the whole round trip.
+        with span('daemon.{}'.format(job_type)):
+            return self._request('POST', '/jobs/{}'.format(job_type), params)['result']
+
+    def sign(self, src, addon_type, env, **kwargs):
+        return self.run('sign', src=source_path(src), addon_type=addon_type, env=env,
+                        **kwargs)
+
+    def sign_envs(self, src, addon_type, envs, **kwargs):
+        return self.run('sign_envs', src=source_path(src), addon_type=addon_type,
+                        envs=list(envs), **kwargs)
+
+    def download(self, src, addon_type, env, uploaded, dest, **kwargs):
+        return self.run('download', src=source_path(src), addon_type=addon_type, env=env,
+                        uploaded=uploaded, dest=os.path.abspath(dest), **kwargs)
+
+    def attach(self, bug_number, src, addon_type, env, uploaded, file_name, dest=None,
+               **kwargs):
+        return self.run('attach', bug_number=bug_number, src=source_path(src),
+                        addon_type=addon_type, env=env, uploaded=uploaded, file_name=file_name,
+                        dest=os.path.abspath(dest) if dest else None, **kwargs)
+
+    def needinfos(self, bug_numbers, api_key=None):
+        return self.run('needinfos', bug_numbers=list(bug_numbers), api_key=api_key)
+
+    def clear_needinfo(self, bug_number, flag_id, api_key=None):
+        return self.run('clear_needinfo', bug_number=bug_number, flag_id=flag_id,
+                        api_key=api_key)
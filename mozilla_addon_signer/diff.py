@@ -0,0 +1,68 @@
+import hashlib
+
+from mozilla_addon_signer import CHUNK_SIZE
+from mozilla_addon_signer.signature import DEFAULT_WORKERS, is_signature_member
+from mozilla_addon_signer.tracing import span
+from mozilla_addon_signer.xpi import MemberReader
+
+
+def _comparable_members(xpi):
+    return dict((name, info) for name, info in xpi.members.items()
+                if not name.endswith('/') and not is_signature_member(name))
+
+
+def _fingerprint(info):
+    return info.file_size, info.CRC
+
+
+def _hash_members(jobs, workers):
+    """Return the sha256 of each ``(xpi, name)`` in ``jobs``, hashing in parallel."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def hash_member(job):
+        sha256 = hashlib.sha256()
+        with reader.open(*job) as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    with MemberReader() as reader, ThreadPoolExecutor(
+            max_workers=max(min(workers, len(jobs)), 1)) as executor:
+        return list(executor.map(hash_member, jobs))
+
+
+def diff_xpis(old, new, workers=DEFAULT_WORKERS):
+    """Compare the members of two loaded :class:`XPI` objects.
+
+    Members are matched by name and compared by the size and CRC32 recorded in the
+    central directory, so unchanged members are never read. Only changed members
+    are decompressed, to report their sha256. Directories and the JAR signature
+    files in ``META-INF`` are ignored.
+    """
+    old_members = _comparable_members(old)
+    new_members = _comparable_members(new)
+
+    added = sorted(set(new_members) - set(old_members))
+    removed = sorted(set(old_members) - set(new_members))
+    common = set(old_members) & set(new_members)
+    changed = sorted(name for name in common
+                     if _fingerprint(old_members[name]) != _fingerprint(new_members[name]))
+
+    jobs = [(old, name) for name in changed]
+    jobs.extend((new, name) for name in changed)
+    with span('xpi.diff', changed=len(changed)):
+        digests = _hash_members(jobs, workers)
+
+    return {
+        'added': [{'name': name, 'size': new_members[name].file_size} for name in added],
+        'removed': [{'name': name, 'size': old_members[name].file_size} for name in removed],
+        'changed': [{
+            'name': name,
+            'old_size': old_members[name].file_size,
+            'new_size': new_members[name].file_size,
+            'old_sha256': old_digest,
+            'new_sha256': new_digest,
+        } for name, old_digest, new_digest in zip(
+            changed, digests[:len(changed)], digests[len(changed):])],
+        'unchanged': len(common) - len(changed),
+    }
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import re
+import zipfile
+
+from contextlib import closing
+
+import requests
+
+from mozilla_addon_signer import CHUNK_SIZE
+from mozilla_addon_signer.tracing import span
+from mozilla_addon_signer.transfer import SpooledBuffer
+
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 3
+
+# Local file header, or the end of central directory record of an empty archive.
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')
+CONTENT_RANGE_START = re.compile(r'bytes (\d+)-')
+
+
+def _open(dest, mode):
+    # ``dest`` is a path, or a SpooledBuffer standing in for one.
+    if isinstance(dest, SpooledBuffer):
+        return dest.open(mode)
+    return open(dest, mode)
+
+
+def _size(dest):
+    if isinstance(dest, SpooledBuffer):
+        return dest.size
+    return os.path.getsize(dest) if os.path.exists(dest) else 0
+
+
+class URLDownloader(object):
+    """Streams a URL to disk in chunks, hashing and sanity checking it on the way.
+
+    Interrupted transfers are resumed with an HTTP Range request when the server
+    provided a validator (ETag or Last-Modified) to make the resume safe.
+    """
+
+    class DownloadError(Exception):
+        pass
+
+    class InvalidDownload(DownloadError):
+        """The server's answer can not be used, so retrying it as is will not help."""
+
+    def __init__(self, session=None, timeout=None, retries=None):
+        self.session = session or requests.Session()
+        self.timeout = float(timeout or DEFAULT_TIMEOUT)
+        self.retries = int(DEFAULT_RETRIES if retries is None else retries)
+
+    def download(self, url, path, etag=None, last_modified=None, resume_validator=None,
+                 on_response=None):
+        """Download ``url`` to ``path``, which may also be a :class:`SpooledBuffer`.
+
+        ``etag`` and ``last_modified`` make the request conditional, in which case
+        ``None`` is returned if the server answers 304 Not Modified. If
+        ``resume_validator`` is given, bytes already in ``path`` are kept and only the
+        rest is requested. ``on_response`` is called with every response before its
+        body is read, so callers can persist the validator of a partial download.
+        """
+        with span('url.download', url=url, retries=0) as s:
+            for attempt in range(self.retries + 1):
+                s.set(retries=attempt)
+                try:
+                    result = self._download(url, path, etag, last_modified, resume_validator,
+                                            on_response)
+                    s.set(bytes=result['size'] if result else 0)
+                    return result
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout) as e:
+                    if attempt >= self.retries:
+                        raise self.DownloadError('Download of {} failed: {}'.format(url, e))
+                    resume_validator = getattr(e, 'validator', None) or resume_validator
+
+    def _download(self, url, path, etag, last_modified, resume_validator, on_response):
+        offset = 0
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        if resume_validator:
+            offset = _size(path)
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+            headers['If-Range'] = resume_validator
+
+        res = self.session.get(url, headers=headers, stream=True, timeout=self.timeout)
+        with closing(res):
+            if res.status_code == 304:
+                return None
+            if res.status_code == 416 and offset:
+                # What is kept is already the whole file, or no longer a prefix of it.
+                return self._restart(url, path, on_response)
+            res.raise_for_status()
+
+            if res.status_code == 206:
+                match = CONTENT_RANGE_START.match(res.headers.get('Content-Range', ''))
+                if not match or int(match.group(1)) != offset:
+                    raise self.InvalidDownload('Unexpected Content-Range from {}'.format(url))
+            else:
+                offset = 0
+
+            validator = res.headers.get('ETag') or res.headers.get('Last-Modified')
+            if on_response:
+                on_response(res, validator)
+
+            sha256 = hashlib.sha256()
+            head = b''
+            if offset:
+                with _open(path, 'rb') as f:
+                    head = f.read(len(ZIP_MAGIC[0]))
+                    f.seek(0)
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        sha256.update(chunk)
+
+            size = offset
+            with _open(path, 'ab' if offset else 'wb') as f:
+                try:
+                    for chunk in res.iter_content(CHUNK_SIZE):
+                        if len(head) < len(ZIP_MAGIC[0]):
+                            head += chunk[:len(ZIP_MAGIC[0]) - len(head)]
+                            # Bail out early rather than downloading an HTML error page.
+                            if len(head) == len(ZIP_MAGIC[0]) and head not in ZIP_MAGIC:
+                                raise self.InvalidDownload('{} is not a zip file'.format(url))
+                        sha256.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                except requests.exceptions.RequestException as e:
+                    # Only resume if the server gave us a way to detect changes.
+                    e.validator = validator
+                    raise
+
+        with _open(path, 'rb') as f:
+            is_zip = zipfile.is_zipfile(f)
+        if not is_zip:
+            if offset:
+                # The bytes kept from an earlier attempt may be what is broken.
+                return self._restart(url, path, on_response)
+            raise self.InvalidDownload('{} is not a zip file'.format(url))
+
+        return {
+            'etag': res.headers.get('ETag'),
+            'last_modified': res.headers.get('Last-Modified'),
+            'sha256': sha256.hexdigest(),
+            'size': size,
+        }
+
+    def _restart(self, url, path, on_response):
+        # Throw away a partial download that can not be resumed and fetch all of it.
+        return self._download(url, path, None, None, None, on_response)
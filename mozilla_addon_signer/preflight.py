@@ -0,0 +1,144 @@
+import posixpath
+import re
+
+from collections import OrderedDict
+
+from mozilla_addon_signer.xpi import XPI, XPI_ERROR_MESSAGES
+
+
+DEFAULT_MAX_SIZE = 200 * 1024 * 1024
+DEFAULT_WORKERS = 8
+
+# The add-on id formats accepted by addons.mozilla.org: a GUID or an email-like id.
+GECKO_ID_RE = re.compile(
+    r'^(\{[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\}'
+    r'|[a-zA-Z0-9-._]*@[a-zA-Z0-9-._]+)$')
+
+# Rule functions keyed by name, run in the order they were registered.
+RULES = OrderedDict()
+
+
+def rule(name):
+    """Register a pre-flight rule.
+
+    Rules are called with the :class:`Preflight` running them and an :class:`XPI`,
+    and yield a message for every problem they find.
+    """
+    def decorator(fn):
+        RULES[name] = fn
+        return fn
+    return decorator
+
+
+class Problem(object):
+    __slots__ = ('rule', 'message')
+
+    def __init__(self, rule, message):
+        self.rule = rule
+        self.message = message
+
+    def __repr__(self):
+        return '<Problem {}: {}>'.format(self.rule, self.message)
+
+
+class Preflight(object):
+    """Checks XPIs locally before anything is uploaded or signed."""
+
+    def __init__(self, addon_type, env, cache=None, registry=None, max_size=None, skip=()):
+        self.addon_type = addon_type
+        self.env = env
+        self.cache = cache
+        self.registry = registry
+        self.max_size = int(max_size or DEFAULT_MAX_SIZE)
+        self.skip = set(skip or ())
+
+        unknown = self.skip - set(RULES)
+        if unknown:
+            raise ValueError('Unknown pre-flight rules: {}'.format(', '.join(sorted(unknown))))
+
+    @classmethod
+    def from_config(cls, config, addon_type, env, cache=None, registry=None, skip=()):
+        return cls(addon_type, env, cache=cache, registry=registry,
+                   max_size=config.get('preflight.max_size'), skip=skip)
+
+    def check(self, xpi):
+        """Return the problems found in a loaded :class:`XPI`."""
+        problems = []
+        for name, fn in RULES.items():
+            if name not in self.skip:
+                problems.extend(Problem(name, message) for message in fn(self, xpi))
+        return problems
+
+    def check_path(self, path):
+        """Return the problems found in the XPI at ``path``, including loading errors."""
+        try:
+            xpi = XPI(path)
+        except tuple(XPI_ERROR_MESSAGES) as e:
+            # An XPI without an id can not be loaded at all, but it is the `id` rule failing.
+            name = 'id' if isinstance(e, XPI.MissingID) else 'xpi'
+            return [Problem(name, '`{}` {}.'.format(path, XPI_ERROR_MESSAGES[type(e)]))]
+        return self.check(xpi)
+
+    def check_paths(self, paths, workers=DEFAULT_WORKERS):
+        """Check many XPIs in parallel, returning problems in the order of ``paths``."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self.check_path, paths))
+
+
+@rule('size')
+def check_size(preflight, xpi):
+    size = xpi.size
+    if size > preflight.max_size:
+        yield 'The XPI is {} bytes, more than the limit of {} bytes.'.format(
+            size, preflight.max_size)
+
+
+@rule('id')
+def check_id(preflight, xpi):
+    if not GECKO_ID_RE.match(xpi.id):
+        yield '`{}` is not a valid add-on id.'.format(xpi.id)
+
+
+@rule('version')
+def check_version(preflight, xpi):
+    if not xpi.version:
+        yield 'The add-on has no version.'
+
+
+@rule('duplicate-members')
+def check_duplicate_members(preflight, xpi):
+    seen = set()
+    for info in xpi.entries:
+        if info.filename in seen:
+            yield '`{}` appears more than once in the archive.'.format(info.filename)
+        seen.add(info.filename)
+
+
+@rule('unsafe-paths')
+def check_unsafe_paths(preflight, xpi):
+    for name in xpi.members:
+        normalized = posixpath.normpath(name.replace('\\', '/'))
+        if normalized.startswith(('/', '../')) or normalized == '..':
+            yield '`{}` points outside of the archive.'.format(name)
+
+
+@rule('already-signed')
+def check_already_signed(preflight, xpi):
+    if not preflight.addon_type or not xpi.version:
+        return
+    checksums = set()
+    if preflight.cache:
+        previous = preflight.cache.find_version(xpi.id, xpi.version, preflight.addon_type,
+                                                preflight.env)
+        if previous:
+            checksums.add(previous['checksum'])
+    if preflight.registry:
+        checksums.update(row['checksum'] for row in preflight.registry.find(
+            addon_id=xpi.id, version=xpi.version, addon_type=preflight.addon_type,
+            env=preflight.env))
+    # Signing a file that was signed before is answered by the cache, so only flag new files.
+    if checksums and xpi.sha256sum not in checksums:
+        yield ('Version {} of `{}` was already signed as `{}` in `{}` from a different '
+               'file.').format(xpi.version, xpi.id, preflight.addon_type, preflight.env)
@@ -0,0 +1,67 @@
+from xml.etree import ElementTree
+
+
+RDF_NS = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+EM_NS = 'http://www.mozilla.org/2004/em-rdf#'
+INSTALL_MANIFEST_URN = 'urn:mozilla:install-manifest'
+
+
+class InstallRDF(object):
+    """The handful of install.rdf fields this tool needs for a bootstrapped addon."""
+
+    __slots__ = ('id', 'version', 'name', 'type', 'bootstrap')
+
+    FIELDS = __slots__
+
+    def __init__(self, **fields):
+        for field in self.FIELDS:
+            setattr(self, field, fields.get(field))
+
+    def __repr__(self):
+        return '<InstallRDF {} {}>'.format(self.id, self.version)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _is_install_manifest(element):
+    about = element.get('about', element.get('{%s}about' % RDF_NS))
+    return about in (None, INSTALL_MANIFEST_URN)
+
+
+def parse_install_rdf(fileobj):
+    """Incrementally read the top-level install manifest fields from ``fileobj``.
+
+    Only direct properties of the install manifest description are used, so the
+    ids and versions of target applications are ignored. Parsing stops as soon as
+    every field has been seen, and elements are discarded as they are read, so
+    large localized sections are never held in memory.
+    """
+    fields = {}
+    depth = 0
+    in_manifest = False
+
+    for event, element in ElementTree.iterparse(fileobj, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 2 and _local_name(element.tag) == 'Description':
+                in_manifest = _is_install_manifest(element)
+                if in_manifest:
+                    # Properties may also be written as attributes of the description.
+                    for key, value in element.attrib.items():
+                        if key.startswith('{%s}' % EM_NS):
+                            fields.setdefault(_local_name(key), value)
+            continue
+
+        depth -= 1
+        if in_manifest and depth == 2 and element.tag.startswith('{%s}' % EM_NS):
+            fields.setdefault(_local_name(element.tag), (element.text or '').strip())
+        elif in_manifest and depth == 1:
+            break
+        if depth >= 2:
+            element.clear()
+        if all(field in fields for field in InstallRDF.FIELDS):
+            break
+
+    return InstallRDF(**dict((field, fields.get(field)) for field in InstallRDF.FIELDS))
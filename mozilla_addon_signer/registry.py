@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import threading
+import time
+
+from mozilla_addon_signer import REGISTRY_PATH
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signings (
+    id INTEGER PRIMARY KEY,
+    addon_id TEXT NOT NULL,
+    version TEXT,
+    checksum TEXT NOT NULL,
+    signed_checksum TEXT,
+    addon_type TEXT NOT NULL,
+    env TEXT NOT NULL,
+    input_bucket TEXT,
+    input_key TEXT,
+    output_bucket TEXT,
+    output_key TEXT,
+    bug INTEGER,
+    dest TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS signings_addon ON signings (addon_id, version, env);
+CREATE INDEX IF NOT EXISTS signings_version ON signings (version, addon_id);
+CREATE INDEX IF NOT EXISTS signings_env ON signings (env, addon_type);
+CREATE INDEX IF NOT EXISTS signings_addon_type ON signings (addon_type, env);
+CREATE INDEX IF NOT EXISTS signings_checksum ON signings (checksum);
+CREATE INDEX IF NOT EXISTS signings_signed_checksum ON signings (signed_checksum);
+CREATE INDEX IF NOT EXISTS signings_bug ON signings (bug);
+CREATE INDEX IF NOT EXISTS signings_created ON signings (created);
+"""
+
+# The columns `find` can filter on. Each of them leads at least one index, so any
+# single filter is a search rather than a scan of the whole table.
+FILTERS = ['addon_id', 'version', 'checksum', 'signed_checksum', 'addon_type', 'env', 'bug']
+
+DEFAULT_LIMIT = 50
+
+
+class Registry(object):
+    """Every signing made by this tool, recorded in a local SQLite database.
+
+    Lookups by add-on id, version, checksum of the unsigned or signed file, bug
+    number and environment all go through an index, so they stay fast as the table
+    grows. The database is only created once the first signing is recorded.
+    """
+
+    def __init__(self, path=REGISTRY_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self, create=False):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        if not create and not os.path.exists(self.path):
+            return None
+
+        # Each thread gets its own connection, as sqlite3 connections can not be shared.
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        self._local.conn = conn
+        return conn
+
+    def record(self, xpi, addon_type, env, source=None, uploaded=None, cached=False):
+        """Record a signing of ``xpi``, returning the id of the new row."""
+        source = source or {}
+        uploaded = uploaded or {}
+        now = time.time()
+        conn = self._connect(create=True)
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO signings (addon_id, version, checksum, addon_type, env, '
+                'input_bucket, input_key, output_bucket, output_key, cached, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (xpi.id, xpi.version, xpi.sha256sum, addon_type, env, source.get('bucket'),
+                 source.get('key'), uploaded.get('bucket'), uploaded.get('key'), int(cached),
+                 now, now))
+        return cursor.lastrowid
+
+    def update(self, record_id, dest=None, signed_checksum=None, bug=None):
+        """Fill in where the signed file of a recorded signing ended up."""
+        # Bugs are found by number; an alias given to `sign --attach` is not recorded.
+        if bug is not None and not str(bug).isdigit():
+            bug = None
+        fields = [(name, value) for name, value in (
+            ('dest', dest), ('signed_checksum', signed_checksum),
+            ('bug', int(bug) if bug is not None else None))
+            if value is not None]
+        if not fields:
+            return
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute(
+                'UPDATE signings SET {}, updated = ? WHERE id = ?'.format(
+                    ', '.join('{} = ?'.format(name) for name, _ in fields)),
+                [value for _, value in fields] + [time.time(), record_id])
+
+    def find(self, limit=DEFAULT_LIMIT, **filters):
+        """Return recorded signings matching every filter, newest first."""
+        unknown = set(filters) - set(FILTERS)
+        if unknown:
+            raise ValueError('Unknown filters: {}'.format(', '.join(sorted(unknown))))
+
+        conn = self._connect()
+        if conn is None:
+            return []
+        filters = dict((name, value) for name, value in filters.items() if value is not None)
+        where = ' AND '.join('{} = ?'.format(name) for name in sorted(filters)) or '1'
+        rows = conn.execute(
+            'SELECT * FROM signings WHERE {} ORDER BY created DESC, id DESC LIMIT ?'.format(where),
+            [filters[name] for name in sorted(filters)] + [limit])
+        return [dict(row) for row in rows]
+
+    def get(self, record_id):
+        conn = self._connect()
+        if conn is None:
+            return None
+        row = conn.execute('SELECT * FROM signings WHERE id = ?', (record_id,)).fetchone()
+        return dict(row) if row else None
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('registry.path', default=REGISTRY_PATH))
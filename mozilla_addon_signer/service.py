@@ -0,0 +1,246 @@
+import functools
+import os
+import shutil
+import tempfile
+import threading
+
+from mozilla_addon_signer import signature
+from mozilla_addon_signer.tracing import span
+from mozilla_addon_signer.xpi import XPI
+
+
+class SigningService(object):
+    """The work behind `sign` and `check_needinfo`, without any prompting.
+
+    Signers and Bugzilla clients are created once and reused, so a service kept
+    alive by `serve` answers jobs with warm connections. Commands talk to a
+    :class:`~mozilla_addon_signer.daemon.DaemonClient` with the same methods
+    when a daemon is running, and to an in-process service otherwise.
+    """
+
+    class VerificationError(Exception):
+        def __init__(self, data):
+            super(SigningService.VerificationError, self).__init__(
+                '`{}` does not match its signature.'.format(data.get('path')))
+            self.data = data
+
+    def __init__(self, make_signer, make_bugzilla, cache=None, registry=None):
+        self.make_signer = make_signer
+        self.make_bugzilla = make_bugzilla
+        self.cache = cache
+        self.registry = registry
+        self._signers = {}
+        self._bugzillas = {}
+        self._lock = threading.Lock()
+
+    def signer(self, profile=None, bucket_name=None):
+        with self._lock:
+            key = (profile, bucket_name)
+            if key not in self._signers:
+                self._signers[key] = self.make_signer(profile, bucket_name)
+            return self._signers[key]
+
+    def bugzilla(self, api_key=None):
+        with self._lock:
+            if api_key not in self._bugzillas:
+                self._bugzillas[api_key] = self.make_bugzilla(api_key)
+            return self._bugzillas[api_key]
+
+    def _cache(self, use_cache):
+        return self.cache if use_cache else None
+
+    def sign(self, src, addon_type, env, profile=None, bucket_name=None, use_cache=True,
+             use_async=False, async_timeout=None):
+        """Sign ``src``, returning the Lambda response and whether it came from the cache.
+
+        When signings are being recorded, the id of the new registry row is returned
+        as ``record`` and can be passed on to :meth:`download` and :meth:`attach`.
+        """
+        return self.sign_envs(src, addon_type, [env], profile=profile, bucket_name=bucket_name,
+                              use_cache=use_cache, use_async=use_async,
+                              async_timeout=async_timeout)[env]
+
+    def sign_envs(self, src, addon_type, envs, profile=None, bucket_name=None, use_cache=True,
+                  use_async=False, async_timeout=None):
+        """Sign ``src`` in several environments from a single upload.
+
+        The XPI is uploaded to the input bucket of the first environment that needs
+        it and copied within S3 to the others, then the signing Lambdas are invoked
+        concurrently. Returns the result of :meth:`sign` for each environment.
+        """
+        xpi = XPI(src)
+        cache = self._cache(use_cache)
+
+        results = {}
+        for env in envs:
+            cached = cache.get_result(xpi, addon_type, env) if cache else None
+            if cached and not cache.signed_path(xpi, addon_type, env):
+                # Without a local copy the cached result is only useful if S3 still has it.
+                if not self.signer(profile, bucket_name).exists(cached['data']['uploaded']):
+                    cached = None
+            if cached:
+                results[env] = {
+                    'data': cached['data'], 'cached': True,
+                    'record': self._record(xpi, addon_type, env, None, cached['data'], True)}
+
+        pending = [env for env in envs if env not in results]
+        if not pending:
+            return results
+
+        # Only created once something has to be signed, so fully cached signings never
+        # set up AWS clients.
+        signer = self.signer(profile, bucket_name)
+        source, checksum = signer.upload(xpi, pending[0])
+
+        def sign_env(env):
+            env_source = source if env == pending[0] else signer.copy(source, env, checksum)
+            if use_async:
+                result = signer.invoke_async(addon_type, env, env_source, checksum)
+                data = signer.wait_for_result(result, timeout=async_timeout)
+            else:
+                data = signer.invoke(addon_type, env, env_source, checksum)
+
+            if cache:
+                cache.put_result(xpi, addon_type, env, data)
+            return env, {'data': data, 'cached': False,
+                         'record': self._record(xpi, addon_type, env, env_source, data, False)}
+
+        if len(pending) == 1:
+            results.update([sign_env(pending[0])])
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                results.update(executor.map(sign_env, pending))
+        return results
+
+    def _record(self, xpi, addon_type, env, source, data, cached):
+        if not self.registry:
+            return None
+        return self.registry.record(xpi, addon_type, env, source=source,
+                                    uploaded=data.get('uploaded'), cached=cached)
+
+    def _update_record(self, record, **fields):
+        import sqlite3
+
+        if self.registry and record:
+            try:
+                self.registry.update(record, **fields)
+            except sqlite3.Error:
+                # The file is already saved or attached, bookkeeping must not fail that.
+                pass
+
+    @classmethod
+    def verify(cls, path, name=None):
+        """Raise :class:`VerificationError` unless ``path`` matches its signature.
+
+        ``name`` is the path reported instead, for files checked before they are
+        moved into place.
+        """
+        with span('verify', bytes=os.path.getsize(path)):
+            result = signature.verify_path(path)
+        if not result['ok']:
+            result['path'] = name or path
+            raise cls.VerificationError(result)
+
+    def _copy_cached(self, signed_path, dest, verify):
+        # Cached copies may have been downloaded without verification, so they are
+        # checked like a download, and hashed as they are copied.
+        from mozilla_addon_signer.transfer import AtomicFile, HashingReader
+
+        check = functools.partial(self.verify, name=dest) if verify else None
+        with open(signed_path, 'rb') as f, AtomicFile(dest, check=check) as out:
+            reader = HashingReader(f)
+            shutil.copyfileobj(reader, out)
+        return reader.hexdigest()
+
+    def _download(self, uploaded, dest, profile, bucket_name, verify):
+        # Verified before it is renamed over ``dest``, so a bad download never replaces
+        # or leaves behind a file there.
+        check = functools.partial(self.verify, name=dest) if verify else None
+        return self.signer(profile, bucket_name).download(uploaded, dest, check=check)
+
+    def download(self, src, addon_type, env, uploaded, dest, profile=None, bucket_name=None,
+                 use_cache=True, verify=True, record=None):
+        """Save the signed copy of ``src`` to ``dest``."""
+        xpi = XPI(src)
+        cache = self._cache(use_cache)
+
+        signed_path = cache.signed_path(xpi, addon_type, env) if cache else None
+        if signed_path:
+            checksum = self._copy_cached(signed_path, dest, verify)
+            self._update_record(record, dest=dest, signed_checksum=checksum)
+            return {'dest': dest}
+
+        # Hashed as it is downloaded, so the file is not read again for its checksum.
+        checksum = self._download(uploaded, dest, profile, bucket_name, verify)
+        if cache:
+            cache.put_signed(xpi, addon_type, env, dest, checksum)
+        self._update_record(record, dest=dest, signed_checksum=checksum)
+        return {'dest': dest}
+
+    def attach(self, bug_number, src, addon_type, env, uploaded, file_name, dest=None,
+               api_key=None, profile=None, bucket_name=None, use_cache=True, verify=True,
+               record=None):
+        """Attach the signed copy of ``src`` to a bug, also saving it to ``dest`` if given.
+
+        The signed file is always on disk and verified before it is attached, so a
+        corrupt download never reaches the bug.
+        """
+        from mozilla_addon_signer.transfer import HashingReader
+
+        xpi = XPI(src)
+        cache = self._cache(use_cache)
+        bz = self.bugzilla(api_key)
+
+        signed_path = cache.signed_path(xpi, addon_type, env) if cache else None
+        tmpdir = None
+        try:
+            if signed_path:
+                path = signed_path
+                if verify:
+                    self.verify(path)
+                if dest:
+                    self._copy_cached(signed_path, dest, verify=False)
+            else:
+                if not dest:
+                    tmpdir = tempfile.mkdtemp(prefix='mozilla_addon_signer-')
+                path = dest or os.path.join(tmpdir, os.path.basename(file_name))
+                checksum = self._download(uploaded, path, profile, bucket_name, verify)
+                if cache:
+                    cache.put_signed(xpi, addon_type, env, path, checksum)
+
+            with open(path, 'rb') as f:
+                reader = HashingReader(f)
+                size = os.path.getsize(path)
+                with span('bugzilla.attach', bug=bug_number, bytes=size):
+                    bz.stream_attachment_for_bug(
+                        bug_number, reader, size, file_name=file_name, summary=file_name,
+                        content_type='application/x-xpinstall')
+        finally:
+            if tmpdir:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        self._update_record(record, bug=bug_number, dest=dest,
+                            signed_checksum=reader.hexdigest())
+        return {'dest': dest}
+
+    def needinfos(self, bug_numbers, api_key=None):
+        """Return the open needinfo flags requested of the current user on each bug."""
+        bz = self.bugzilla(api_key)
+        flags_by_bug = bz.get_flags_for_bugs(bug_numbers)
+
+        user_email = bz.who_am_i()['name']
+        needinfos = []
+        for bug_number in bug_numbers:
+            for flag in flags_by_bug[str(bug_number)]:
+                needs_info = flag['name'] == 'needinfo' and flag['status'] == '?'
+                if needs_info and flag.get('requestee') == user_email:
+                    needinfos.append({'bug': bug_number, 'id': flag['id'],
+                                      'setter': flag['setter']})
+                    break
+        return needinfos
+
+    def clear_needinfo(self, bug_number, flag_id, api_key=None):
+        self.bugzilla(api_key).get_bug(bug_number).set_flags([{'id': flag_id, 'status': 'X'}])
+        return {}
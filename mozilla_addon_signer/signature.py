@@ -0,0 +1,226 @@
+import base64
+import binascii
+import hashlib
+import io
+import zipfile
+import zlib
+
+from mozilla_addon_signer import CHUNK_SIZE
+from mozilla_addon_signer.xpi import XPI, XPI_ERROR_MESSAGES, MemberReader
+
+
+DEFAULT_WORKERS = 8
+# What zipfile raises for a member whose compressed data or CRC has been damaged.
+CORRUPT_MEMBER_ERRORS = (zlib.error, zipfile.BadZipfile, EOFError)
+
+
+def parse_manifest_sections(data):
+    """Parse a JAR manifest or signature file into a list of header dictionaries.
+
+    Sections are separated by blank lines, and lines starting with a space continue
+    the previous header value.
+    """
+    sections = []
+    section = {}
+    last_key = None
+    for line in data.decode('utf-8').splitlines():
+        if not line:
+            if section:
+                sections.append(section)
+            section = {}
+            last_key = None
+        elif line.startswith(' ') and last_key:
+            section[last_key] += line[1:]
+        else:
+            key, _, value = line.partition(':')
+            last_key = key.strip()
+            section[last_key] = value.strip()
+    if section:
+        sections.append(section)
+    return sections
+
+
+def _isoformat(cert, name):
+    # Newer versions of cryptography only offer timezone-aware values under *_utc.
+    value = getattr(cert, name + '_utc', None) or getattr(cert, name)
+    return value.isoformat()
+
+
+def summarize_certificate(cert):
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.x509.oid import NameOID
+
+    common_names = cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    return {
+        'common_name': common_names[0].value if common_names else None,
+        'subject': cert.subject.rfc4514_string(),
+        'issuer': cert.issuer.rfc4514_string(),
+        'serial_number': '{:x}'.format(cert.serial_number),
+        'not_before': _isoformat(cert, 'not_valid_before'),
+        'not_after': _isoformat(cert, 'not_valid_after'),
+        'signature_hash_algorithm': (cert.signature_hash_algorithm.name
+                                     if cert.signature_hash_algorithm else None),
+        'sha256_fingerprint': binascii.hexlify(cert.fingerprint(hashes.SHA256())).decode(),
+    }
+
+
+def load_certificates(data):
+    """Return summaries of the certificates in a DER encoded PKCS#7 signature."""
+    from cryptography.hazmat.primitives.serialization import pkcs7
+
+    return [summarize_certificate(cert) for cert in pkcs7.load_der_pkcs7_certificates(data)]
+
+
+def inspect_signature(xpi):
+    """Summarize the signature of a signed XPI, read directly from the archive."""
+    if not xpi.is_signed:
+        raise XPI.NotSigned()
+
+    signature_file = {}
+    if xpi.has_member(XPI.SIGNATURE_FILE_NAME):
+        sections = parse_manifest_sections(xpi.read_member(XPI.SIGNATURE_FILE_NAME))
+        signature_file = sections[0] if sections else {}
+
+    return {
+        'id': xpi.id,
+        'version': xpi.version,
+        'sha256': xpi.sha256sum,
+        'signature_file': signature_file,
+        'certificates': load_certificates(xpi.certificate),
+    }
+
+
+def inspect_path(path, cache=None):
+    """Like :func:`inspect_signature`, but reports failures in the result instead of raising."""
+    try:
+        xpi = XPI(path)
+        summary = cache.get_summary(xpi) if cache else None
+        if summary is None:
+            summary = inspect_signature(xpi)
+            if cache:
+                cache.put_summary(xpi, summary)
+    except tuple(XPI_ERROR_MESSAGES) as e:
+        return {'path': path, 'error': XPI_ERROR_MESSAGES[type(e)]}
+    except ValueError as e:
+        return {'path': path, 'error': 'has an unreadable signature ({})'.format(e)}
+    return dict(summary, path=path)
+
+
+def inspect_paths(paths, cache=None, workers=DEFAULT_WORKERS):
+    """Inspect many XPIs in parallel, returning results in the order of ``paths``."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda path: inspect_path(path, cache), paths))
+
+
+def _hash_name(algorithm):
+    # Manifests name algorithms like "SHA1" or "SHA-256", hashlib wants "sha1" and "sha256".
+    return algorithm.replace('-', '').lower()
+
+
+def _expected_digests(section):
+    """Return a ``{algorithm: base64 digest}`` dictionary for a manifest section."""
+    algorithms = section.get('Digest-Algorithms', '').split()
+    if not algorithms:
+        algorithms = [key[:-len('-Digest')] for key in section if key.endswith('-Digest')]
+    return dict((alg, section[alg + '-Digest']) for alg in algorithms
+                if alg + '-Digest' in section)
+
+
+def _digests(fileobj, algorithms):
+    hashes = dict((alg, hashlib.new(_hash_name(alg))) for alg in algorithms)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        for h in hashes.values():
+            h.update(chunk)
+    return dict((alg, base64.b64encode(h.digest()).decode()) for alg, h in hashes.items())
+
+
+# The COSE signature AMO adds alongside the PKCS#7 one.
+COSE_MEMBER_NAMES = ('META-INF/cose.manifest', 'META-INF/cose.sig')
+
+
+def is_signature_member(name):
+    # The JAR signature files themselves are never listed in the manifest.
+    upper = name.upper()
+    if not upper.startswith('META-INF/'):
+        return False
+    if upper in (n.upper() for n in (XPI.JAR_MANIFEST_NAME,) + COSE_MEMBER_NAMES):
+        return True
+    return upper.endswith(('.SF', '.RSA', '.DSA'))
+
+
+def verify_signature(xpi, workers=DEFAULT_WORKERS):
+    """Check the contents of a signed XPI against its META-INF digests.
+
+    Members are streamed through every algorithm listed for them in ``manifest.mf``,
+    spread over a pool of threads (hashlib and zlib release the GIL on large
+    buffers), and the manifest itself is checked against the digests in
+    ``mozilla.sf``. Returns a dictionary listing missing, extra and mismatched
+    members; ``ok`` is true only if all of those are empty.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not xpi.is_signed:
+        raise XPI.NotSigned()
+
+    missing = [name for name in (XPI.JAR_MANIFEST_NAME, XPI.SIGNATURE_FILE_NAME)
+               if not xpi.has_member(name)]
+    mismatched = []
+    expected = {}
+
+    if XPI.JAR_MANIFEST_NAME not in missing:
+        manifest = xpi.read_member(XPI.JAR_MANIFEST_NAME)
+        for section in parse_manifest_sections(manifest)[1:]:
+            if 'Name' in section:
+                expected[section['Name']] = _expected_digests(section)
+
+        if XPI.SIGNATURE_FILE_NAME not in missing:
+            sections = parse_manifest_sections(xpi.read_member(XPI.SIGNATURE_FILE_NAME))
+            signature_file = sections[0] if sections else {}
+            digests = dict((key[:-len('-Digest-Manifest')], value)
+                           for key, value in signature_file.items()
+                           if key.endswith('-Digest-Manifest'))
+            actual = _digests(io.BytesIO(manifest), digests)
+            if not digests or actual != digests:
+                mismatched.append(XPI.JAR_MANIFEST_NAME)
+
+    present = set(name for name in xpi.namelist() if not name.endswith('/'))
+    missing.extend(sorted(set(expected) - present))
+    extra = sorted(name for name in present - set(expected) if not is_signature_member(name))
+
+    def check(name):
+        if not expected[name]:
+            # A member listed without any digest is not covered by the signature.
+            return name, False
+        try:
+            with reader.open(xpi, name) as f:
+                return name, _digests(f, expected[name]) == expected[name]
+        except CORRUPT_MEMBER_ERRORS:
+            return name, False
+
+    # Hash the largest members first so one big file does not finish last on its own.
+    names = sorted(set(expected) & present, key=lambda name: -xpi.members[name].file_size)
+    with MemberReader() as reader, ThreadPoolExecutor(
+            max_workers=max(min(workers, len(names)), 1)) as executor:
+        mismatched.extend(name for name, ok in executor.map(check, names) if not ok)
+
+    return {
+        'ok': not (missing or extra or mismatched),
+        'missing': missing,
+        'extra': extra,
+        'mismatched': sorted(mismatched),
+    }
+
+
+def verify_path(path, workers=DEFAULT_WORKERS):
+    """Like :func:`verify_signature`, but reports failures in the result instead of raising."""
+    try:
+        result = verify_signature(XPI(path), workers=workers)
+    except tuple(XPI_ERROR_MESSAGES) as e:
+        return {'path': path, 'ok': False, 'error': XPI_ERROR_MESSAGES[type(e)]}
+    except CORRUPT_MEMBER_ERRORS as e:
+        return {'path': path, 'ok': False, 'error': 'is corrupt ({})'.format(e)}
+    except ValueError as e:
+        return {'path': path, 'ok': False, 'error': 'could not be verified ({})'.format(e)}
+    return dict(result, path=path)
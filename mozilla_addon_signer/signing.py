@@ -0,0 +1,271 @@
+import json
+import os
+import time
+
+from mozilla_addon_signer.tracing import span
+from mozilla_addon_signer.transfer import download_object, upload_fileobj
+
+
+INPUT_BUCKET_TEMPLATE = 'net-mozaws-{}-addons-signxpi-input'
+# Where the signing Lambda saves signed XPIs, under the key they were uploaded with.
+OUTPUT_BUCKET_TEMPLATE = 'net-mozaws-{}-addons-signxpi-output'
+FUNCTION_NAME_TEMPLATE = 'addons-sign-xpi-{}-{}'
+# Keyed by env too, so one upload can be signed in several environments at once.
+RESULT_KEY_TEMPLATE = '{}.{}.result.json'
+# Content addressed input keys: the sha256 of the XPI, then its file name.
+CONTENT_KEY_TEMPLATE = '{}/{}'
+CHECKSUM_METADATA_KEY = 'sha256'
+# Without s3:ListBucket, missing objects are reported as forbidden: "403" by HEAD
+# requests, which have no body, and "AccessDenied" by GETs.
+MISSING_OBJECT_CODES = ('403', '404', 'AccessDenied', 'NoSuchKey')
+
+DEFAULT_ASYNC_TIMEOUT = 15 * 60
+INITIAL_POLL_DELAY = 1
+MAX_POLL_DELAY = 30
+
+
+def _is_missing(error):
+    return error.response.get('Error', {}).get('Code') in MISSING_OBJECT_CODES
+
+
+class Signer(object):
+    """Wraps the S3 and Lambda clients used to sign an XPI.
+
+    Only boto3 clients are kept (never resources) so a single signer can be shared
+    between threads.
+    """
+
+    class SigningError(Exception):
+        pass
+
+    class LambdaError(SigningError):
+        def __init__(self, data):
+            super(Signer.LambdaError, self).__init__('Invoking lambda failed.')
+            self.data = data
+
+    def __init__(self, profile=None, bucket_name=None, session=None, part_size=None,
+                 max_concurrency=None, content_addressed=False, output_bucket_name=None):
+        if session is None:
+            # boto3 is slow to import, so only pay for it when a signer is needed.
+            import boto3
+            session = boto3.Session(profile_name=profile)
+        self.session = session
+        self.s3 = self.session.client('s3')
+        # May raise botocore's NoRegionError, which callers report to the user.
+        self.aws_lambda = self.session.client('lambda')
+        self.bucket_name = bucket_name
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.content_addressed = content_addressed
+        self.output_bucket = output_bucket_name
+
+    def input_bucket_name(self, env):
+        return self.bucket_name or INPUT_BUCKET_TEMPLATE.format(env)
+
+    def output_bucket_name(self, env):
+        return self.output_bucket or OUTPUT_BUCKET_TEMPLATE.format(env)
+
+    def upload(self, xpi, env, key=None):
+        """Upload an XPI to the input bucket, returning the Lambda ``source`` and checksum.
+
+        With ``content_addressed`` the object is keyed by the checksum of the XPI,
+        which is also stored as object metadata, and the upload is skipped when an
+        identical object is already there.
+        """
+        bucket = self.input_bucket_name(env)
+        key = key or os.path.basename(xpi.path)
+        if self.content_addressed:
+            return self._upload_content_addressed(xpi, bucket, key)
+        with span('s3.upload', bucket=bucket, key=key, bytes=xpi.size):
+            with xpi.open() as f:
+                # Hash while uploading so the file is only read once, unless it already
+                # was, e.g. for a cache lookup.
+                checksum = upload_fileobj(self.s3, f, bucket, key, part_size=self.part_size,
+                                          max_concurrency=self.max_concurrency,
+                                          checksum=xpi.known_sha256sum)
+        return {'bucket': bucket, 'key': key}, checksum
+
+    def _upload_content_addressed(self, xpi, bucket, key):
+        checksum = xpi.sha256sum
+        key = CONTENT_KEY_TEMPLATE.format(checksum, key)
+        with span('s3.upload', bucket=bucket, key=key, bytes=xpi.size) as s:
+            if self.stored_checksum(bucket, key) == checksum:
+                s.set(bytes=0, skipped=True)
+                return {'bucket': bucket, 'key': key}, checksum
+            with xpi.open() as f:
+                uploaded = upload_fileobj(self.s3, f, bucket, key, part_size=self.part_size,
+                                          max_concurrency=self.max_concurrency,
+                                          metadata={CHECKSUM_METADATA_KEY: checksum})
+        if uploaded != checksum:
+            raise self.SigningError('`{}` changed while it was being uploaded.'.format(xpi.path))
+        return {'bucket': bucket, 'key': key}, checksum
+
+    def _head(self, bucket, key):
+        """Return the ``head_object`` response for an object, or ``None`` if it is missing."""
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.s3.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+
+    def stored_checksum(self, bucket, key):
+        """Return the checksum recorded in the metadata of an input object, if it exists."""
+        response = self._head(bucket, key)
+        if response is None:
+            return None
+        return response.get('Metadata', {}).get(CHECKSUM_METADATA_KEY)
+
+    def copy(self, source, env, checksum=None):
+        """Copy an uploaded XPI to the input bucket of ``env`` within S3, returning its source."""
+        bucket = self.input_bucket_name(env)
+        if bucket == source['bucket']:
+            return source
+        if self.content_addressed and checksum and (
+                self.stored_checksum(bucket, source['key']) == checksum):
+            return {'bucket': bucket, 'key': source['key']}
+        with span('s3.copy', bucket=bucket, key=source['key']):
+            self.s3.copy_object(Bucket=bucket, Key=source['key'],
+                                CopySource={'Bucket': source['bucket'], 'Key': source['key']})
+        return {'bucket': bucket, 'key': source['key']}
+
+    def invoke(self, addon_type, env, source, checksum):
+        """Invoke the signing Lambda and return its parsed response data."""
+        function_name = FUNCTION_NAME_TEMPLATE.format(addon_type, env)
+        with span('lambda.invoke', function=function_name):
+            response = self.aws_lambda.invoke(
+                FunctionName=function_name,
+                Payload=json.dumps({
+                    'source': source,
+                    'checksum': checksum,
+                })
+            )
+            payload = response['Payload'].read()
+
+        failed = response['StatusCode'] >= 300 or 'FunctionError' in response
+        return self._check_result(payload, failed)
+
+    def _check_result(self, payload, failed=None):
+        try:
+            data = json.loads(payload)
+        except Exception as e:
+            raise self.SigningError("Couldn't parse response: {} {}".format(e, payload))
+
+        if failed is None:
+            # Polled results carry no FunctionError header, only the error document.
+            failed = 'errorType' in data or 'errorMessage' in data
+
+        if failed:
+            raise self.LambdaError(data)
+
+        if 'uploaded' not in data:
+            raise self.SigningError('Something went wrong!')
+
+        return data
+
+    def invoke_async(self, addon_type, env, source, checksum):
+        """Queue a signing without waiting for it, returning where its result will appear.
+
+        The Lambda is asked to write the response it would have returned from a
+        synchronous invocation to the ``result`` location in the payload. Lambdas that
+        do not do this are waited for by watching the output bucket for a new signed
+        copy of the source key instead.
+        """
+        result = {
+            'bucket': source['bucket'],
+            'key': RESULT_KEY_TEMPLATE.format(source['key'], env),
+            'output': {'bucket': self.output_bucket_name(env), 'key': source['key']},
+        }
+        # A result left over from an earlier signing of the same key must not be mistaken
+        # for this one.
+        self.s3.delete_object(Bucket=result['bucket'], Key=result['key'])
+        result['output']['etag'] = self._etag(result['output'])
+
+        function_name = FUNCTION_NAME_TEMPLATE.format(addon_type, env)
+        with span('lambda.invoke_async', function=function_name):
+            response = self.aws_lambda.invoke(
+                FunctionName=function_name,
+                InvocationType='Event',
+                Payload=json.dumps({
+                    'source': source,
+                    'checksum': checksum,
+                    'result': result,
+                })
+            )
+        if response['StatusCode'] != 202:
+            raise self.SigningError(
+                'Queueing the signing failed with status {}'.format(response['StatusCode']))
+        return result
+
+    def _etag(self, location):
+        response = self._head(location['bucket'], location['key'])
+        if response is None:
+            return None
+        return response.get('ETag')
+
+    def _poll(self, result):
+        """Return the result of an async signing if it is there yet, otherwise ``None``."""
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.s3.get_object(Bucket=result['bucket'], Key=result['key'])
+        except ClientError as e:
+            if not _is_missing(e):
+                raise
+        else:
+            payload = response['Body'].read()
+            self.s3.delete_object(Bucket=result['bucket'], Key=result['key'])
+            return self._check_result(payload)
+
+        output = result.get('output')
+        if output:
+            etag = self._etag(output)
+            if etag is not None and etag != output.get('etag'):
+                return {'uploaded': {'bucket': output['bucket'], 'key': output['key']}}
+        return None
+
+    def wait_for_result(self, result, timeout=None, delay=INITIAL_POLL_DELAY):
+        """Poll for the result of :meth:`invoke_async` with exponential backoff.
+
+        A result object is checked for like the response of :meth:`invoke`. Failing
+        that, a signed file in the output bucket that was not there before the
+        invocation counts as success; a Lambda that fails without writing a result
+        is only noticed once ``timeout`` has passed.
+        """
+        from botocore.exceptions import ClientError
+
+        deadline = time.time() + (DEFAULT_ASYNC_TIMEOUT if timeout is None else timeout)
+        with span('lambda.wait_for_result', retries=0) as s:
+            while True:
+                try:
+                    data = self._poll(result)
+                except ClientError as e:
+                    raise self.SigningError(
+                        'Polling for the signing result failed: {}'.format(e))
+                if data is not None:
+                    return data
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise self.SigningError('Timed out waiting for the signing result.')
+                s.add('retries', 1)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, MAX_POLL_DELAY)
+
+    def download(self, uploaded, dest, check=None):
+        """Download the signed XPI to ``dest``, returning its sha256 checksum.
+
+        ``check`` is called with the path of the complete download before it replaces
+        ``dest``; if it raises, ``dest`` is left as it was.
+        """
+        with span('s3.download', bucket=uploaded.get('bucket'), key=uploaded.get('key')) as s:
+            size, checksum = download_object(
+                self.s3, uploaded.get('bucket'), uploaded.get('key'), dest,
+                part_size=self.part_size, max_concurrency=self.max_concurrency, check=check)
+            s.set(bytes=size)
+        return checksum
+
+    def exists(self, uploaded):
+        return self._head(uploaded.get('bucket'), uploaded.get('key')) is not None
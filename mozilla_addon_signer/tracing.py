@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_CHROME = 'chrome'
+TRACE_FORMATS = [FORMAT_JSONL, FORMAT_CHROME]
+
+
+class Span(object):
+    __slots__ = ('name', 'attrs', 'start', 'duration', 'thread', 'parent', 'error')
+
+    def __init__(self, name, attrs, parent=None):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.thread = threading.current_thread().ident
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, value):
+        self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def to_dict(self):
+        data = {
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'thread': self.thread,
+            'parent': self.parent.name if self.parent else None,
+            'attrs': self.attrs,
+        }
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class _NullSpan(object):
+    def set(self, **attrs):
+        pass
+
+    def add(self, key, value):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """Collects timed spans around the phases of a command.
+
+    Spans are only recorded once the tracer is enabled, so instrumented code costs
+    next to nothing for commands run without ``--timings`` or ``--trace-file``.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if not self.enabled:
+            yield NULL_SPAN
+            return
+
+        stack = self._local.__dict__.setdefault('stack', [])
+        span = Span(name, attrs, parent=stack[-1] if stack else None)
+        stack.append(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = e.__class__.__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            stack.pop()
+            with self._lock:
+                self.spans.append(span)
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+
+    def summary(self):
+        """Aggregate spans by name, in the order each name was first started."""
+        totals = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            total = totals.setdefault(span.name, {
+                'name': span.name, 'count': 0, 'total': 0.0, 'max': 0.0,
+                'bytes': 0, 'retries': 0,
+            })
+            total['count'] += 1
+            total['total'] += span.duration
+            total['max'] = max(total['max'], span.duration)
+            total['bytes'] += span.attrs.get('bytes', 0) or 0
+            total['retries'] += span.attrs.get('retries', 0) or 0
+        return list(totals.values())
+
+    def write(self, path, format=FORMAT_JSONL):
+        spans = sorted(self.spans, key=lambda s: s.start)
+        with open(path, 'w') as f:
+            if format == FORMAT_CHROME:
+                # The Trace Event Format understood by chrome://tracing and Perfetto.
+                pid = os.getpid()
+                json.dump({'traceEvents': [{
+                    'name': span.name,
+                    'ph': 'X',
+                    'ts': int(span.start * 1e6),
+                    'dur': int(span.duration * 1e6),
+                    'pid': pid,
+                    'tid': span.thread,
+                    'args': dict(span.attrs, **({'error': span.error} if span.error else {})),
+                } for span in spans]}, f)
+            else:
+                for span in spans:
+                    f.write(json.dumps(span.to_dict(), sort_keys=True) + '\n')
+
+
+tracer = Tracer()
+
+
+def span(name, **attrs):
+    return tracer.span(name, **attrs)
@@ -0,0 +1,353 @@
+import collections
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from mozilla_addon_signer import CHUNK_SIZE
+
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_MEMORY = 32 * 1024 * 1024
+
+
+class HashingReader(object):
+    """A read-only file wrapper that hashes everything read through it.
+
+    It deliberately exposes no ``seek``/``tell`` so boto3 treats it as a non-seekable
+    stream and reads it exactly once, front to back.
+    """
+
+    def __init__(self, fileobj, algorithm='sha256'):
+        self._fileobj = fileobj
+        self._hash = hashlib.new(algorithm)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._hash.update(data)
+        self.bytes_read += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+def transfer_config(part_size=None, max_concurrency=None):
+    from boto3.s3.transfer import TransferConfig
+
+    part_size = int(part_size or DEFAULT_PART_SIZE)
+    max_concurrency = int(max_concurrency or DEFAULT_MAX_CONCURRENCY)
+    config = TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=max_concurrency,
+    )
+    # Bound the number of buffered parts so memory stays flat for large files.
+    config.max_in_memory_upload_chunks = max_concurrency
+    return config
+
+
+def upload_fileobj(client, fileobj, bucket, key, part_size=None, max_concurrency=None,
+                   metadata=None, checksum=None):
+    """Upload ``fileobj`` to ``bucket`` and return the sha256 hex digest of its contents.
+
+    The contents are hashed as they are uploaded, unless their ``checksum`` is
+    already known.
+    """
+    reader = HashingReader(fileobj) if checksum is None else fileobj
+    kwargs = {'ExtraArgs': {'Metadata': metadata}} if metadata else {}
+    client.upload_fileobj(reader, bucket, key,
+                          Config=transfer_config(part_size, max_concurrency), **kwargs)
+    return reader.hexdigest() if checksum is None else checksum
+
+
+class RangedReader(object):
+    """Reads an S3 object front to back while fetching byte ranges of it concurrently.
+
+    Up to ``max_concurrency`` ranges of ``part_size`` bytes are fetched ahead of the
+    reader, so memory use stays bounded however large the object is. Every range is
+    requested with the object's ETag, so a concurrent overwrite fails the read
+    instead of mixing two versions.
+    """
+
+    class IncompleteRead(Exception):
+        pass
+
+    def __init__(self, client, bucket, key, part_size=None, max_concurrency=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        head = client.head_object(Bucket=bucket, Key=key)
+        self.size = head['ContentLength']
+        self.etag = head.get('ETag')
+
+        part_size = int(part_size or DEFAULT_PART_SIZE)
+        self.max_concurrency = int(max_concurrency or DEFAULT_MAX_CONCURRENCY)
+        self._ranges = iter([(start, min(start + part_size, self.size) - 1)
+                             for start in range(0, self.size, part_size)])
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        self._pending = collections.deque()
+        self._buffer = b''
+        self._offset = 0
+        for _ in range(self.max_concurrency):
+            self._submit()
+
+    def _fetch(self, start, end):
+        kwargs = {'IfMatch': self.etag} if self.etag else {}
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key,
+                                          Range='bytes={}-{}'.format(start, end), **kwargs)
+        data = response['Body'].read()
+        if len(data) != end - start + 1:
+            raise self.IncompleteRead('Expected {} bytes of `{}` from offset {}, got {}.'.format(
+                end - start + 1, self.key, start, len(data)))
+        return data
+
+    def _submit(self):
+        byte_range = next(self._ranges, None)
+        if byte_range:
+            self._pending.append(self._executor.submit(self._fetch, *byte_range))
+
+    def read(self, size=-1):
+        chunks = []
+        remaining = size
+        while size < 0 or remaining > 0:
+            if self._offset >= len(self._buffer):
+                if not self._pending:
+                    break
+                self._buffer = self._pending.popleft().result()
+                self._offset = 0
+                self._submit()
+            end = len(self._buffer) if size < 0 else self._offset + remaining
+            chunk = self._buffer[self._offset:end]
+            self._offset += len(chunk)
+            remaining -= len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _read_umask():
+    # The umask can only be read by setting it, so do it once, before any threads start.
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+UMASK = _read_umask()
+
+
+def _target_mode(path):
+    # mkstemp creates files as 0600; keep the mode of a file being replaced, or
+    # give a new one what a plain open() would have.
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError:
+        return 0o666 & ~UMASK
+
+
+class AtomicFile(object):
+    """A file written next to ``path`` and renamed over it only once it is complete.
+
+    ``check`` is called with the path of the complete temporary file before the
+    rename. If it raises, the file is discarded and ``path`` is left untouched.
+    """
+
+    def __init__(self, path, check=None):
+        self.path = path
+        self.check = check
+        directory, name = os.path.split(os.path.abspath(path))
+        fd, self.tmp_path = tempfile.mkstemp(prefix='.{}.'.format(name), suffix='.part',
+                                             dir=directory)
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def commit(self):
+        self._file.close()
+        try:
+            if self.check:
+                self.check(self.tmp_path)
+            os.chmod(self.tmp_path, _target_mode(self.path))
+            os.replace(self.tmp_path, self.path)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+class SpooledBuffer(object):
+    """An XPI held in memory until it outgrows ``max_memory``, then in a temporary file.
+
+    Much like :class:`tempfile.SpooledTemporaryFile`, except that any number of
+    independent readers can be opened with :meth:`open`, and a spilled file keeps
+    ``name`` so it can be handed to code that needs a path. Closing the buffer
+    removes anything it wrote to disk. ``sha256`` holds the checksum of the contents
+    when whoever filled the buffer already computed it, and is reset by any write.
+    """
+
+    class ReadOnly(Exception):
+        pass
+
+    def __init__(self, name, max_memory=None):
+        self.name = os.path.basename(name)
+        self.max_memory = int(DEFAULT_MAX_MEMORY if max_memory is None else max_memory)
+        self.size = 0
+        self.path = None
+        self.sha256 = None
+        self._memory = io.BytesIO()
+        self._data = None
+        self._file = None
+        self._dir = None
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    def _make_path(self):
+        self._dir = tempfile.mkdtemp(prefix='mozilla_addon_signer-')
+        self.path = os.path.join(self._dir, self.name)
+
+    def write(self, data):
+        if self.in_memory and self.size + len(data) > self.max_memory:
+            self.spill()
+        if self.in_memory:
+            self._memory.write(data)
+            self._data = None
+        elif self._file is not None:
+            self._file.write(data)
+        else:
+            raise self.ReadOnly('`{}` is a linked file.'.format(self.name))
+        self.size += len(data)
+        self.sha256 = None
+        return len(data)
+
+    def truncate(self):
+        """Throw away everything written so far."""
+        if self.in_memory:
+            self._memory = io.BytesIO()
+            self._data = None
+        elif self._file is not None:
+            self._file.seek(0)
+            self._file.truncate()
+        else:
+            raise self.ReadOnly('`{}` is a linked file.'.format(self.name))
+        self.size = 0
+        self.sha256 = None
+
+    def spill(self):
+        """Move the contents to a temporary file named ``name``, returning its path."""
+        if self.in_memory:
+            self._make_path()
+            self._file = open(self.path, 'wb')
+            self._file.write(self._memory.getvalue())
+            self._memory = self._data = None
+        if self._file is not None:
+            self._file.flush()
+        return self.path
+
+    def link(self, path, sha256=None):
+        """Stand in for the file at ``path`` without reading it, e.g. a cached download."""
+        from mozilla_addon_signer.utils import link_or_copy
+
+        if not self.in_memory or self.size:
+            raise ValueError('Only an empty buffer can be linked to a file.')
+        self._make_path()
+        link_or_copy(path, self.path)
+        self._memory = None
+        self.size = os.path.getsize(self.path)
+        self.sha256 = sha256
+
+    def open(self, mode='rb'):
+        """Return a new reader over the contents, or a writer for ``wb`` and ``ab``."""
+        if mode in ('wb', 'ab'):
+            if mode == 'wb':
+                self.truncate()
+            return _BufferWriter(self)
+        if not self.in_memory:
+            return open(self.spill(), 'rb')
+        if self._data is None:
+            self._data = self._memory.getvalue()
+        # Readers share the one bytes object rather than each copying the buffer.
+        return io.BytesIO(self._data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+        self._memory = self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _BufferWriter(object):
+    # Closing it leaves the buffer open, so it can be used like a file opened for writing.
+    def __init__(self, buffer):
+        self.write = buffer.write
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def download_object(client, bucket, key, dest, part_size=None, max_concurrency=None,
+                    check=None):
+    """Download an object to ``dest`` with concurrent ranged GETs.
+
+    Returns the size and sha256 hex digest of the object, hashed as it is written.
+    ``dest`` is only replaced once the whole object has been fetched and passed
+    ``check``, as for :class:`AtomicFile`.
+    """
+    with RangedReader(client, bucket, key, part_size, max_concurrency) as source:
+        reader = HashingReader(source)
+        with AtomicFile(dest, check=check) as f:
+            for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+                f.write(chunk)
+    return reader.bytes_read, reader.hexdigest()
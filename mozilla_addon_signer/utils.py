@@ -1,8 +1,14 @@
+import hashlib
+import os
+import shutil
+
 import click
 
 from colorama import Style
 from six import print_
 
+from mozilla_addon_signer import CHUNK_SIZE
+
 
 def output(str, *styles):
     print_(Style.RESET_ALL, end='')
@@ -27,3 +33,34 @@ def prompt_choices(text, choices, default=None, name_parser=None):
     output('')
 
     return choices[index]
+
+
+def format_table(headers, rows):
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [len(h) for h in headers]
+    for row in rows:
+        widths = [max(w, len(cell)) for w, cell in zip(widths, row)]
+
+    def format_row(row):
+        return '  '.join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip()
+
+    lines = [format_row(headers), format_row(['-' * w for w in widths])]
+    lines.extend(format_row(row) for row in rows)
+    return '\n'.join(lines)
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def link_or_copy(src, dest):
+    # A hard link, unlike a symlink, keeps the data if ``src`` is later removed, e.g.
+    # by cache eviction. Copy across file systems or where links are not supported.
+    try:
+        os.link(src, dest)
+    except (AttributeError, NotImplementedError, OSError):
+        shutil.copyfile(src, dest)
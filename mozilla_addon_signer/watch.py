@@ -0,0 +1,220 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import json
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from mozilla_addon_signer.batch import STATUS_FAILED, BatchItem
+from mozilla_addon_signer.xpi import XPI, XPI_ERROR_MESSAGES
+
+
+DEFAULT_PATTERN = '*.xpi'
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_SETTLE = 2.0
+DEFAULT_MAX_IN_FLIGHT = 4
+STATE_FILE_NAME = '.mozilla_addon_signer_watch.json'
+
+STATUS_DUPLICATE = 'duplicate'
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """A minimal ctypes binding for inotify, reporting files closed or moved into a directory."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, path.encode(sys.getfilesystemencoding()),
+                                  IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def read(self, timeout):
+        """Wait up to ``timeout`` seconds and return the names of files that changed."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name:
+                names.append(name.decode(sys.getfilesystemencoding()))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """Signs XPIs as they appear in a directory.
+
+    A file is only picked up once its size and modification time have stayed the
+    same for ``settle`` seconds, so partially copied files are left alone. Files
+    are deduplicated by checksum, including across restarts through a state file
+    in the output directory. At most ``max_in_flight`` files are signed at once.
+    """
+
+    def __init__(self, directory, pipeline, pattern=DEFAULT_PATTERN, settle=DEFAULT_SETTLE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 use_inotify=True, state_path=None, callback=None):
+        self.directory = directory
+        self.pipeline = pipeline
+        self.pattern = pattern
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and sys.platform.startswith('linux')
+        self.state_path = state_path or os.path.join(pipeline.output_dir, STATE_FILE_NAME)
+        self.callback = callback
+
+        self.handled = self._load_state()
+        self._in_flight = set()
+        self._pending = set()
+        # The (size, mtime) of each file when it was last looked at, and when it was handled.
+        self._observed = {}
+        self._done = {}
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.handled, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.state_path)
+
+    def _matches(self, name):
+        return fnmatch.fnmatch(name, self.pattern) and not name.startswith('.')
+
+    def scan(self):
+        for entry in os.listdir(self.directory):
+            if self._matches(entry):
+                self._pending.add(os.path.join(self.directory, entry))
+
+    def _ready(self, path):
+        """Return the file's (size, mtime) once it has settled, or ``None``."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._pending.discard(path)
+            self._observed.pop(path, None)
+            return None
+        signature = (st.st_size, st.st_mtime)
+        if self._done.get(path) == signature:
+            self._pending.discard(path)
+            return None
+        previous = self._observed.get(path)
+        self._observed[path] = signature
+        if previous == signature and time.time() - st.st_mtime >= self.settle:
+            return signature
+        return None
+
+    def check_pending(self):
+        """Start signing every pending file that has settled, waiting for free slots."""
+        for path in sorted(self._pending):
+            signature = self._ready(path)
+            if signature is None:
+                continue
+            self._slots.acquire()
+            self._pending.discard(path)
+            self._done[path] = signature
+            thread = threading.Thread(target=self._handle, args=(path,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        self._threads = [t for t in self._threads if t.is_alive()]
+
+    def _handle(self, path):
+        item = BatchItem(path)
+        try:
+            try:
+                checksum = XPI(path).sha256sum
+            except tuple(XPI_ERROR_MESSAGES) as e:
+                item.fail('`{}` {}.'.format(path, XPI_ERROR_MESSAGES[type(e)]))
+                return
+
+            with self._lock:
+                previous = self.handled.get(checksum)
+                if previous or checksum in self._in_flight:
+                    item.status = STATUS_DUPLICATE
+                    item.message = 'same as {}'.format(previous['src'] if previous else
+                                                       'a file being signed')
+                    return
+                self._in_flight.add(checksum)
+
+            try:
+                self.pipeline.sign(item)
+            finally:
+                with self._lock:
+                    self._in_flight.discard(checksum)
+                    if item.status != STATUS_FAILED:
+                        self.handled[checksum] = {'src': path, 'dest': item.dest,
+                                                  'status': item.status}
+                        self._save_state()
+        finally:
+            self._slots.release()
+            if self.callback:
+                self.callback(item)
+
+    def wait(self):
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def run_once(self):
+        """Sign the files already in the directory, waiting for them to settle."""
+        self.scan()
+        while self._pending:
+            self.check_pending()
+            if self._pending:
+                time.sleep(self.poll_interval)
+        self.wait()
+
+    def run(self, stop=None):
+        """Watch the directory until ``stop`` (a ``threading.Event``) is set."""
+        stop = stop or threading.Event()
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = Inotify(self.directory)
+            except (OSError, AttributeError):
+                # Not available here (e.g. no inotify in this libc), fall back to polling.
+                inotify = None
+
+        try:
+            self.scan()
+            while not stop.is_set():
+                self.check_pending()
+                if inotify is not None:
+                    for name in inotify.read(self.poll_interval):
+                        if self._matches(name):
+                            self._pending.add(os.path.join(self.directory, name))
+                else:
+                    stop.wait(self.poll_interval)
+                    self.scan()
+        finally:
+            if inotify is not None:
+                inotify.close()
+            self.wait()
@@ -1,16 +1,28 @@
 import hashlib
 import json
 import os
-import tempfile
+import threading
 import zipfile
 
-import untangle
+from xml.etree.ElementTree import ParseError
+
+from mozilla_addon_signer import CHUNK_SIZE
+from mozilla_addon_signer.rdf import parse_install_rdf
+from mozilla_addon_signer.tracing import span
+from mozilla_addon_signer.transfer import SpooledBuffer
 
 
 class XPI(object):
     WEB_EXTENSION = 'WEB_EXTENSION'
     BOOTSTRAPPED_ADDON = 'BOOTSTRAPPED_ADDON'
 
+    CERTIFICATE_NAME = 'META-INF/mozilla.rsa'
+    SIGNATURE_FILE_NAME = 'META-INF/mozilla.sf'
+    JAR_MANIFEST_NAME = 'META-INF/manifest.mf'
+    INSTALL_RDF_NAME = 'install.rdf'
+    MANIFEST_NAME = 'manifest.json'
+
+    _certificate = None
     _hashed = None
     addon_data = {}
     type = WEB_EXTENSION
@@ -27,64 +39,120 @@ class XPI(object):
     class MissingID(Exception):
         pass
 
-    def __init__(self, path):
-        if not os.path.isfile(path):
-            raise XPI.DoesNotExist()
-
-        self.path = path
+    class NotSigned(Exception):
+        pass
 
-        tmpdir = tempfile.mkdtemp()
+    def __init__(self, src):
+        # ``src`` is a path, or a SpooledBuffer holding a fetched XPI.
+        if isinstance(src, SpooledBuffer):
+            self.buffer = src
+            self.path = src.name
+            # Hashed while it was fetched, so the contents need not be read again.
+            self._hashed = src.sha256
+        elif os.path.isfile(src):
+            self.buffer = None
+            self.path = src
+        else:
+            raise XPI.DoesNotExist()
 
         try:
-            with zipfile.ZipFile(path, 'r') as zf:
-                zf.extractall(tmpdir)
+            with self.open() as f, zipfile.ZipFile(f, 'r') as zf:
+                # Only the central directory is read here, member data is left in place.
+                self.entries = zf.infolist()
+                self.members = {info.filename: info for info in self.entries}
+
+                self.is_signed = self.CERTIFICATE_NAME in self.members
+
+                if self.INSTALL_RDF_NAME in self.members:
+                    # Bootstrapped addon
+                    self.type = XPI.BOOTSTRAPPED_ADDON
+                    try:
+                        with zf.open(self.INSTALL_RDF_NAME) as f:
+                            self.addon_data = parse_install_rdf(f)
+                    except ParseError as e:
+                        raise self.InvalidXPI('install.rdf could not be parsed: {}'.format(e))
+                    if not self.addon_data.id:
+                        raise self.MissingID()
+                elif self.MANIFEST_NAME in self.members:
+                    # Web extension
+                    manifest = json.loads(zf.read(self.MANIFEST_NAME).decode('utf-8'))
+                    self.addon_data = manifest
+                    try:
+                        manifest['applications']['gecko']['id']
+                    except KeyError:
+                        raise self.MissingID()
+                else:
+                    raise self.InvalidXPI('No manifest.json or install.rdf found')
         except zipfile.BadZipfile:
             raise XPI.BadZipfile()
 
-        self.certificate_path = os.path.join(tmpdir, 'META-INF', 'mozilla.rsa')
-        self.is_signed = os.path.exists(self.certificate_path)
-
-        rdf_path = os.path.join(tmpdir, 'install.rdf')
-        manifest_path = os.path.join(tmpdir, 'manifest.json')
-
-        if os.path.exists(rdf_path):
-            # Bootstrapped addon
-            self.type = XPI.BOOTSTRAPPED_ADDON
-            install_rdf = untangle.parse(rdf_path)
-            self.addon_data = install_rdf.RDF.Description
-        elif os.path.exists(manifest_path):
-            # Web extension
-            with open(manifest_path) as f:
-                manifest = json.loads(f.read())
-            self.addon_data = manifest
-            try:
-                manifest['applications']['gecko']['id']
-            except KeyError:
-                raise self.MissingID()
-        else:
-            raise self.InvalidXPI('No manifest.json or install.rdf found')
-
     @property
     def sha256sum(self):
         if not self._hashed:
-            with self.open() as f:
-                self._hashed = hashlib.sha256(f.read()).hexdigest()
+            sha256 = hashlib.sha256()
+            with span('xpi.sha256', bytes=self.size):
+                with self.open() as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        sha256.update(chunk)
+            self._hashed = sha256.hexdigest()
         return self._hashed
 
+    @property
+    def known_sha256sum(self):
+        """The checksum if it has already been computed, without reading the file for it."""
+        return self._hashed
+
+    @property
+    def size(self):
+        return self.buffer.size if self.buffer else os.path.getsize(self.path)
+
     @property
     def id(self):
         if self.type == XPI.BOOTSTRAPPED_ADDON:
-            return self.addon_data.em_id.cdata
+            return self.addon_data.id
         else:
             return self.addon_data['applications']['gecko']['id']
 
     @property
     def version(self):
         if self.type == XPI.BOOTSTRAPPED_ADDON:
-            return self.addon_data.em_version.cdata
+            return self.addon_data.version
         else:
             return self.addon_data.get('version')
 
+    @property
+    def certificate(self):
+        if self._certificate is None and self.is_signed:
+            self._certificate = self.read_member(self.CERTIFICATE_NAME)
+        return self._certificate
+
+    def namelist(self):
+        return list(self.members)
+
+    def has_member(self, name):
+        return name in self.members
+
+    def read_member(self, name):
+        with self.open_member(name) as f:
+            return f.read()
+
+    def open_member(self, name):
+        # The returned file object owns its zip and file handles, so closing it releases all.
+        if name not in self.members:
+            raise KeyError(name)
+        f = self.open()
+        try:
+            zf = zipfile.ZipFile(f, 'r')
+            try:
+                member = zf.open(self.members[name])
+            except Exception:
+                zf.close()
+                raise
+        except Exception:
+            f.close()
+            raise
+        return _MemberFile(f, zf, member)
+
     def suggested_filename(self, mark_signed=False, extra_suffixes=None):
         parts = [self.id]
         if self.version:
@@ -97,4 +165,72 @@ class XPI(object):
         return '-'.join(parts) + '.xpi'
 
     def open(self, mode='rb'):
+        if self.buffer:
+            return self.buffer.open(mode)
         return open(self.path, mode)
+
+
+XPI_ERROR_MESSAGES = {
+    XPI.DoesNotExist: 'does not exist',
+    XPI.BadZipfile: 'could not be unzipped',
+    XPI.InvalidXPI: 'is not a valid web extension',
+    XPI.MissingID: 'has no add-on id',
+    XPI.NotSigned: 'is not a signed addon',
+}
+
+
+class MemberReader(object):
+    """Opens the members of one or more XPIs from many threads at once.
+
+    Each thread keeps one zip handle per XPI rather than re-reading the central
+    directory for every member. All of them are closed by :meth:`close`, once the
+    threads are done.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._handles = []
+
+    def open(self, xpi, name):
+        zips = self._local.__dict__.setdefault('zips', {})
+        if id(xpi) not in zips:
+            f = xpi.open()
+            zips[id(xpi)] = zipfile.ZipFile(f)
+            self._handles.extend([zips[id(xpi)], f])
+        return zips[id(xpi)].open(xpi.members[name])
+
+    def close(self):
+        for handle in self._handles:
+            handle.close()
+        self._handles = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _MemberFile(object):
+    def __init__(self, f, zf, member):
+        self._f = f
+        self._zf = zf
+        self._member = member
+
+    def read(self, size=-1):
+        return self._member.read(size)
+
+    def close(self):
+        try:
+            self._member.close()
+        finally:
+            try:
+                self._zf.close()
+            finally:
+                self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
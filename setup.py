@@ -7,13 +7,15 @@ setup(
     py_modules=[
         'mozilla_addon_signer',
     ],
+    # cryptography, which reads XPI signatures, only supports Python 3.9 and later.
+    python_requires='>=3.9',
     install_requires=[
         'boto3',
         'Click',
         'colorama',
+        'cryptography',
         'requests',
         'six',
-        'untangle',
     ],
     entry_points={
         'console_scripts': [
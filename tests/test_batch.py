@@ -0,0 +1,166 @@
+import hashlib
+import io
+import os
+import shutil
+import threading
+
+from mozilla_addon_signer import batch
+from mozilla_addon_signer.signing import Signer
+from mozilla_addon_signer.transfer import AtomicFile
+
+from .test_xpi import (
+    INVALID_XPI_PATH, SIGNED_WEBX_PATH, UNSIGNED_BOOTSTRAPPED_PATH, UNSIGNED_WEBX_PATH)
+
+
+class FakeSigner(object):
+    def __init__(self, slow_key=None, release=None):
+        self.slow_key = slow_key
+        self.release = release
+        self.uploaded = []
+
+    def upload(self, xpi, env, key=None):
+        key = key or os.path.basename(xpi.path)
+        self.uploaded.append(key)
+        return {'bucket': 'input', 'key': key}, xpi.sha256sum
+
+    def copy(self, source, env, checksum=None):
+        return dict(source, bucket='input-{}'.format(env))
+
+    def invoke(self, addon_type, env, source, checksum):
+        if source['key'] == self.slow_key:
+            assert self.release.wait(5)
+        if source['key'] == os.path.basename(INVALID_XPI_PATH):
+            raise Signer.LambdaError({'errorMessage': 'boom'})
+        return {'uploaded': {'bucket': 'output', 'key': source['key']}}
+
+    def invoke_async(self, addon_type, env, source, checksum):
+        return source
+
+    def wait_for_result(self, result, timeout=None):
+        return self.invoke(None, None, result, None)
+
+    def download(self, uploaded, dest, check=None):
+        # Any properly signed XPI will do as the signed copy.
+        with open(SIGNED_WEBX_PATH, 'rb') as f:
+            return self.write(dest, f.read(), check)
+
+    def write(self, dest, data, check):
+        with AtomicFile(dest, check=check) as f:
+            f.write(data)
+        return hashlib.sha256(data).hexdigest()
+
+
+class CorruptingSigner(FakeSigner):
+    def download(self, uploaded, dest, check=None):
+        return self.write(dest, uploaded['key'].encode('utf-8'), check)
+
+
+class TestExpandSources(object):
+    def test_globs_and_manifest(self, tmpdir):
+        tmpdir.join('a.xpi').write('')
+        tmpdir.join('b.xpi').write('')
+        manifest = io.StringIO(u'# comment\n{}\n\nmissing.xpi\n'.format(tmpdir.join('a.xpi')))
+        sources = batch.expand_sources([str(tmpdir.join('*.xpi'))], manifest)
+        assert sources == [str(tmpdir.join('a.xpi')), str(tmpdir.join('b.xpi')), 'missing.xpi']
+
+
+class TestSigningPipeline(object):
+    def test_signs_all_items(self, tmpdir):
+        pipeline = batch.SigningPipeline(FakeSigner(), 'system', 'prod', output_dir=str(tmpdir))
+        items = pipeline.run([UNSIGNED_WEBX_PATH, UNSIGNED_BOOTSTRAPPED_PATH, 'missing.xpi'])
+
+        assert [i.status for i in items] == [
+            batch.STATUS_SIGNED, batch.STATUS_SIGNED, batch.STATUS_FAILED]
+        assert items[0].dest == str(tmpdir.join(
+            'nothing-web-extension@mozilla.com-1.0-signed.xpi'))
+        assert os.path.exists(items[1].dest)
+        assert 'does not exist' in items[2].message
+
+    def test_skips_signed_files(self, tmpdir):
+        pipeline = batch.SigningPipeline(FakeSigner(), 'system', 'prod', output_dir=str(tmpdir))
+        item, = pipeline.run([SIGNED_WEBX_PATH])
+        assert item.status == batch.STATUS_SKIPPED
+
+    def test_slow_invoke_does_not_block_others(self, tmpdir):
+        release = threading.Event()
+        signer = FakeSigner(slow_key=os.path.basename(UNSIGNED_WEBX_PATH), release=release)
+        pipeline = batch.SigningPipeline(signer, 'system', 'prod', output_dir=str(tmpdir))
+
+        def callback(item):
+            if item.src == UNSIGNED_BOOTSTRAPPED_PATH:
+                release.set()
+
+        items = pipeline.run([UNSIGNED_WEBX_PATH, UNSIGNED_BOOTSTRAPPED_PATH],
+                             callback=callback)
+        assert all(i.status == batch.STATUS_SIGNED for i in items)
+
+    def test_conflict_policies(self, tmpdir):
+        existing = tmpdir.join('nothing-web-extension@mozilla.com-1.0-signed.xpi')
+        existing.write('old')
+
+        signer = FakeSigner()
+
+        def run(policy):
+            pipeline = batch.SigningPipeline(signer, 'system', 'prod',
+                                             output_dir=str(tmpdir), on_conflict=policy)
+            item, = pipeline.run([UNSIGNED_WEBX_PATH])
+            return item
+
+        assert run(batch.CONFLICT_FAIL).status == batch.STATUS_FAILED
+        assert run(batch.CONFLICT_SKIP).status == batch.STATUS_SKIPPED
+        assert existing.read() == 'old'
+        # Conflicts are found before anything is uploaded.
+        assert signer.uploaded == []
+
+        item = run(batch.CONFLICT_RENAME)
+        assert item.dest == str(tmpdir.join('nothing-web-extension@mozilla.com-1.0-signed-1.xpi'))
+
+        # A bad download never replaces the existing file.
+        pipeline = batch.SigningPipeline(CorruptingSigner(), 'system', 'prod',
+                                         output_dir=str(tmpdir),
+                                         on_conflict=batch.CONFLICT_OVERWRITE)
+        item, = pipeline.run([UNSIGNED_WEBX_PATH])
+        assert item.status == batch.STATUS_FAILED
+        assert existing.read() == 'old'
+
+        item = run(batch.CONFLICT_OVERWRITE)
+        assert item.dest == str(existing)
+        assert existing.read_binary() != b'old'
+
+    def test_same_destination_is_reserved_once(self, tmpdir):
+        src = str(tmpdir.mkdir('copy').join('same.xpi'))
+        shutil.copy(UNSIGNED_WEBX_PATH, src)
+        signer = FakeSigner()
+        pipeline = batch.SigningPipeline(signer, 'system', 'prod', output_dir=str(tmpdir))
+        items = pipeline.run([UNSIGNED_WEBX_PATH, src])
+
+        assert sorted(i.status for i in items) == [batch.STATUS_FAILED, batch.STATUS_SIGNED]
+        assert len(signer.uploaded) == 1
+        assert all(i.reserved is None for i in items)
+
+    def test_lambda_error(self, tmpdir):
+        src = str(tmpdir.join('invalid.xpi'))
+        shutil.copy(UNSIGNED_WEBX_PATH, src)
+        pipeline = batch.SigningPipeline(FakeSigner(), 'system', 'prod', output_dir=str(tmpdir))
+        item, = pipeline.run([src])
+        assert item.status == batch.STATUS_FAILED
+        assert item.message == 'boom'
+
+    def test_verifies_downloads(self, tmpdir):
+        pipeline = batch.SigningPipeline(CorruptingSigner(), 'system', 'prod',
+                                         output_dir=str(tmpdir))
+        item, = pipeline.run([UNSIGNED_WEBX_PATH])
+        assert item.status == batch.STATUS_FAILED
+        assert 'does not match its signature' in item.message
+        assert tmpdir.listdir() == []
+
+        pipeline = batch.SigningPipeline(CorruptingSigner(), 'system', 'prod',
+                                         output_dir=str(tmpdir), verify=False)
+        item, = pipeline.run([UNSIGNED_WEBX_PATH])
+        assert item.status == batch.STATUS_SIGNED
+
+    def test_async(self, tmpdir):
+        pipeline = batch.SigningPipeline(FakeSigner(), 'system', 'prod', output_dir=str(tmpdir),
+                                         use_async=True, max_waiting=1)
+        items = pipeline.run([UNSIGNED_WEBX_PATH, UNSIGNED_BOOTSTRAPPED_PATH])
+        assert all(i.status == batch.STATUS_SIGNED for i in items)
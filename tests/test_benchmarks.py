@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import zipfile
+
+from mozilla_addon_signer import cli
+from mozilla_addon_signer.config import config
+from mozilla_addon_signer.daemon import DaemonClient
+
+from benchmarks import run, stubs
+from benchmarks.xpigen import make_xpi
+
+
+def test_e2e_never_uses_a_daemon(tmpdir, monkeypatch):
+    # As if `serve` were running for the user while the benchmarks run.
+    state_path = tmpdir.join('daemon.json')
+    state_path.write(json.dumps({'address': 'http://127.0.0.1:1', 'token': 'x'}))
+    monkeypatch.setattr(cli, 'DAEMON_STATE_PATH', str(state_path))
+    monkeypatch.setattr(config, 'path', config.path)
+
+    calls = []
+    monkeypatch.setattr(DaemonClient, 'from_state',
+                        classmethod(lambda cls, *args, **kwargs: calls.append(args)))
+    monkeypatch.setattr(run, 'MB', 64 * 1024)
+
+    workdir = stubs.make_workdir()
+    try:
+        results = run.run_e2e(workdir, 1, quick=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    assert calls == []
+    assert cli.DAEMON_STATE_PATH == str(state_path)
+    assert [r['name'] for r in results][0] == 'e2e.sign'
+
+
+def test_incompressible_xpis_are_full_size(tmpdir):
+    size = 256 * 1024
+    path = make_xpi(str(tmpdir.join('a.xpi')), size=size, members=8, compressible=False)
+    assert size <= os.path.getsize(path) < size * 1.05
+
+    # The same seed generates the same contents.
+    again = make_xpi(str(tmpdir.join('b.xpi')), size=size, members=8, compressible=False)
+    with zipfile.ZipFile(path) as a, zipfile.ZipFile(again) as b:
+        assert [(i.filename, i.CRC) for i in a.infolist()] == [
+            (i.filename, i.CRC) for i in b.infolist()]
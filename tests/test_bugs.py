@@ -0,0 +1,115 @@
+import threading
+
+from mozilla_addon_signer.batch import STATUS_FAILED, STATUS_SIGNED, STATUS_SKIPPED
+from mozilla_addon_signer.bugs import SELECT_NEWEST, BugSigner, select_attachments
+from mozilla_addon_signer.xpi import XPI
+
+from .test_xpi import SIGNED_WEBX_PATH, UNSIGNED_WEBX_PATH
+
+
+def attachment(id, file_name='addon.xpi', content_type='application/x-xpinstall',
+               is_obsolete=0, creation_time='2018-01-01T00:00:00Z'):
+    return {'id': id, 'file_name': file_name, 'content_type': content_type,
+            'is_obsolete': is_obsolete, 'creation_time': creation_time}
+
+
+class FakeBugzilla(object):
+    def __init__(self, attachments, files):
+        self.attachments = attachments
+        self.files = files
+
+    def get_attachments_for_bugs(self, bug_numbers):
+        return {str(b): self.attachments.get(str(b), []) for b in bug_numbers}
+
+    def download_attachment(self, attachment_id, fileobj):
+        with open(self.files[attachment_id], 'rb') as f:
+            data = f.read()
+        fileobj.write(data)
+        return len(data)
+
+
+class FakeService(object):
+    def __init__(self, parties=1):
+        self.attached = []
+        self.cleared = []
+        # Every attachment has to be signing at the same time to get past the barrier.
+        self.barrier = threading.Barrier(parties, timeout=5)
+
+    def sign(self, src, addon_type, env, **kwargs):
+        self.barrier.wait()
+        return {'data': {'uploaded': {'bucket': 'output', 'key': str(src)}}, 'cached': False,
+                'record': None}
+
+    def attach(self, bug_number, src, addon_type, env, uploaded, file_name, dest=None,
+               **kwargs):
+        self.attached.append((bug_number, XPI(src).id, file_name))
+        return {'dest': dest}
+
+    def needinfos(self, bug_numbers, api_key=None):
+        return [{'bug': bug, 'id': int(bug) * 10, 'setter': 'a@example.com'}
+                for bug in bug_numbers]
+
+    def clear_needinfo(self, bug_number, flag_id, api_key=None):
+        self.cleared.append(bug_number)
+        return {}
+
+
+def test_select_attachments():
+    attachments = [
+        attachment(1, 'old.xpi', creation_time='2018-01-01T00:00:00Z'),
+        attachment(2, 'new.xpi', creation_time='2018-02-01T00:00:00Z'),
+        attachment(3, 'obsolete.xpi', is_obsolete=1, creation_time='2018-03-01T00:00:00Z'),
+        attachment(4, 'notes.txt', content_type='text/plain'),
+    ]
+    assert [a['id'] for a in select_attachments(attachments)] == [1, 2]
+    assert [a['id'] for a in select_attachments(attachments, include_obsolete=True)] == [1, 2, 3]
+    assert [a['id'] for a in select_attachments(attachments, SELECT_NEWEST)] == [2]
+    assert [a['id'] for a in select_attachments(attachments, pattern='old*')] == [1]
+    assert select_attachments(attachments, SELECT_NEWEST, pattern='*.zip') == []
+
+
+def test_signs_bugs_concurrently():
+    bz = FakeBugzilla({
+        '1': [attachment(11, 'one.xpi')],
+        '2': [attachment(21, 'two.xpi'), attachment(22, 'signed.xpi')],
+        '3': [],
+    }, {11: UNSIGNED_WEBX_PATH, 21: UNSIGNED_WEBX_PATH, 22: SIGNED_WEBX_PATH})
+    service = FakeService(parties=2)
+    signer = BugSigner(service, bz, 'system', 'stage', workers=4)
+
+    items = signer.run(['1', '2', 2, '3', '1'])
+    assert [(i.bug, i.src, i.status) for i in items] == [
+        ('1', 'one.xpi', STATUS_SIGNED),
+        ('2', 'two.xpi', STATUS_SIGNED),
+        ('2', 'signed.xpi', STATUS_SKIPPED),
+        ('3', '', STATUS_SKIPPED),
+    ]
+    addon_id = 'nothing-web-extension@mozilla.com'
+    file_name = 'nothing-web-extension@mozilla.com-1.0-signed.xpi'
+    assert sorted(service.attached) == [('1', addon_id, file_name), ('2', addon_id, file_name)]
+
+    # Only bug 1 had every selected attachment signed.
+    needinfos = signer.clear_needinfos(items)
+    assert [(n['bug'], n['error']) for n in needinfos] == [('1', None)]
+    assert service.cleared == ['1']
+
+
+def test_failures_are_reported_per_item():
+    bz = FakeBugzilla({'1': [attachment(11, 'missing.xpi')]}, {})
+    items = BugSigner(FakeService(), bz, 'system', 'stage').run(['1'])
+    assert items[0].status == STATUS_FAILED
+    assert '11' in items[0].message
+
+
+def test_destinations_are_reserved(tmpdir):
+    existing = tmpdir.join('nothing-web-extension@mozilla.com-1.0-signed.xpi')
+    existing.write('old')
+    bz = FakeBugzilla({'1': [attachment(11, 'one.xpi')]}, {11: UNSIGNED_WEBX_PATH})
+    service = FakeService()
+    item, = BugSigner(service, bz, 'system', 'stage', output_dir=str(tmpdir)).run(['1'])
+
+    # The conflict is found before anything is signed, and nothing stays reserved.
+    assert item.status == STATUS_FAILED
+    assert item.message == '`{}` already exists'.format(existing.basename)
+    assert item.reserved is None
+    assert service.attached == []
@@ -0,0 +1,225 @@
+import base64
+import io
+import json
+import os
+
+import pytest
+import requests
+
+from mozilla_addon_signer.bugzilla import (
+    MAX_RETRY_AFTER, AttachmentDecoder, Base64JSONBody, BugzillaAPI)
+from mozilla_addon_signer.tracing import tracer
+
+
+def decode_in_chunks(body, chunk_size):
+    out = io.BytesIO()
+    decoder = AttachmentDecoder(out)
+    for i in range(0, len(body), chunk_size):
+        decoder.feed(body[i:i + chunk_size])
+    size = decoder.close()
+    assert size == len(out.getvalue())
+    return out.getvalue()
+
+
+class ShortReader(object):
+    # Returns fewer bytes than requested, like a network stream might.
+    def __init__(self, data):
+        self._f = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._f.read(max(1, size // 2 - 1) if size > 0 else size)
+
+
+class TestBase64JSONBody(object):
+    def test_body_is_valid_json(self):
+        for size in (0, 1, 2, 3, 100000, 100001):
+            data = os.urandom(size)
+            body = Base64JSONBody(ShortReader(data), size, {'file_name': 'a.xpi', 'ids': [1]})
+
+            chunks = []
+            for chunk in iter(lambda: body.read(8192), b''):
+                chunks.append(chunk)
+            raw = b''.join(chunks)
+
+            assert len(raw) == len(body)
+            decoded = json.loads(raw.decode('utf-8'))
+            assert decoded['file_name'] == 'a.xpi'
+            assert decoded['ids'] == [1]
+            assert base64.b64decode(decoded['data']) == data
+
+    def test_read_all(self):
+        body = Base64JSONBody(io.BytesIO(b'abcd'), 4, {'ids': [1]})
+        assert json.loads(body.read().decode('utf-8'))['data'] == 'YWJjZA=='
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._data = data or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def json(self):
+        return self._data
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        response.request = requests.Request(method, url, data=kwargs.get('data'),
+                                            json=kwargs.get('json')).prepare()
+        return response
+
+
+def make_api(responses, **kwargs):
+    api = BugzillaAPI(backoff=0, **kwargs)
+    api.session = FakeSession(responses)
+    return api
+
+
+class TestBugzillaAPI(object):
+    def test_retries_server_errors(self):
+        unavailable = FakeResponse(503)
+        api = make_api([
+            unavailable,
+            requests.exceptions.ConnectionError(),
+            FakeResponse(200, {'ok': True}),
+        ])
+        assert api.get('/bug') == {'ok': True}
+        assert len(api.session.requests) == 3
+        assert api.session.requests[0][2]['timeout'] == api.timeout
+        # Its connection goes back to the pool before the retry.
+        assert unavailable.closed
+
+    def test_gives_up_after_retries(self):
+        api = make_api([FakeResponse(429)] * 2, retries=1)
+        with pytest.raises(requests.exceptions.HTTPError):
+            api.get('/bug')
+
+    def test_streamed_bodies_are_not_retried(self):
+        api = make_api([FakeResponse(503)])
+        with pytest.raises(requests.exceptions.HTTPError):
+            api.post('/bug/1/attachment', data=io.BytesIO(b'data'))
+
+    def test_posts_are_only_retried_if_not_sent(self):
+        from requests.packages.urllib3.exceptions import MaxRetryError, NewConnectionError
+
+        not_sent = requests.exceptions.ConnectionError(
+            MaxRetryError(None, '/bug', NewConnectionError(None, 'refused')))
+        api = make_api([not_sent, requests.exceptions.ConnectTimeout(),
+                        FakeResponse(200, {'id': 1})])
+        assert api.post('/bug/1/attachment', json={}) == {'id': 1}
+        assert len(api.session.requests) == 3
+
+        for failure in (FakeResponse(503), requests.exceptions.ReadTimeout(),
+                        requests.exceptions.ConnectionError()):
+            api = make_api([failure, FakeResponse(200, {'id': 1})])
+            with pytest.raises(requests.exceptions.RequestException):
+                api.post('/bug/1/attachment', json={})
+            assert len(api.session.requests) == 1
+
+        # Setting flags is a PUT, which is safe to send again.
+        api = make_api([FakeResponse(503), requests.exceptions.ReadTimeout(),
+                        FakeResponse(200, {'bugs': []})])
+        assert api.put('/bug/1', json={}) == {'bugs': []}
+
+    def test_retry_after_is_capped(self):
+        api = make_api([])
+        assert api._backoff_delay(0, FakeResponse(503, headers={'Retry-After': '5'})) == 5
+        huge = FakeResponse(503, headers={'Retry-After': '86400'})
+        assert api._backoff_delay(0, huge) == MAX_RETRY_AFTER
+
+    def test_traces_the_bytes_sent(self):
+        form = {'file_name': 'addon.xpi', 'data': 'x' * 1000}
+        api = make_api([FakeResponse(200, {'ids': [1]}, {'Content-Length': '10'})])
+        tracer.reset()
+        tracer.enabled = True
+        try:
+            api.post('/bug/1/attachment', data=form)
+        finally:
+            tracer.enabled = False
+        [s] = tracer.spans
+        tracer.reset()
+        # The encoded form, not the number of fields in it.
+        assert s.attrs['bytes'] > 1000 + 10
+
+    def test_api_errors(self):
+        api = make_api([FakeResponse(200, {'error': True, 'message': 'nope'})])
+        with pytest.raises(BugzillaAPI.APIException):
+            api.get('/bug')
+
+    def test_get_flags_for_bugs_is_batched(self, monkeypatch):
+        monkeypatch.setattr('mozilla_addon_signer.bugzilla.MAX_BUGS_PER_REQUEST', 2)
+        api = make_api([
+            FakeResponse(200, {'bugs': [{'id': 1, 'flags': ['a']}, {'id': 2, 'flags': []}]}),
+            FakeResponse(200, {'bugs': [{'id': 3, 'flags': ['c']}]}),
+        ])
+        flags = api.get_flags_for_bugs([1, 2, '3'])
+        assert flags == {'1': ['a'], '2': [], '3': ['c']}
+        assert [r[2]['params']['id'] for r in api.session.requests] == ['1,2', '3']
+        assert api.session.requests[0][2]['params']['include_fields'] == 'id,flags'
+
+    def test_get_attachments_for_bugs_is_batched(self, monkeypatch):
+        monkeypatch.setattr('mozilla_addon_signer.bugzilla.MAX_BUGS_PER_REQUEST', 2)
+        api = make_api([
+            FakeResponse(200, {'bugs': {'1': [{'id': 10}], '2': []}}),
+            FakeResponse(200, {'bugs': {'3': [{'id': 30}]}}),
+        ])
+        attachments = api.get_attachments_for_bugs([1, 2, 3])
+        assert attachments == {'1': [{'id': 10}], '2': [], '3': [{'id': 30}]}
+        assert [(r[1], r[2]['params']['ids']) for r in api.session.requests] == [
+            (api.api_base + '/bug/1/attachment', ['2']),
+            (api.api_base + '/bug/3/attachment', []),
+        ]
+        assert api.get_attachments_for_bugs([]) == {}
+
+    def test_search_bugs(self):
+        api = make_api([FakeResponse(200, {'bugs': [{'id': 1}, {'id': 2}]})])
+        query = ('https://bugzilla.mozilla.org/buglist.cgi'
+                 '?product=Firefox&status=NEW&status=ASSIGNED')
+        assert api.search_bugs(query) == ['1', '2']
+        assert api.session.requests[0][2]['params'] == [
+            ('product', 'Firefox'), ('status', 'NEW'), ('status', 'ASSIGNED'),
+            ('include_fields', 'id')]
+
+    def test_who_am_i_is_memoized_per_key(self):
+        BugzillaAPI._who_am_i.clear()
+        api = make_api([FakeResponse(200, {'name': 'a@example.com'})], api_key='key-a')
+        assert api.who_am_i()['name'] == 'a@example.com'
+
+        api = make_api([FakeResponse(200, {'name': 'b@example.com'})], api_key='key-b')
+        assert api.who_am_i()['name'] == 'b@example.com'
+
+        api = make_api([], api_key='key-a')
+        assert api.who_am_i()['name'] == 'a@example.com'
+
+
+class TestAttachmentDecoder(object):
+    def test_decodes_split_chunks(self):
+        data = os.urandom(5000)
+        encoded = base64.b64encode(data).decode('ascii').replace('/', '\\/')
+        body = (u'{"attachments": {"1": {"data" : "%s"}}, "bugs": {}}' % encoded).encode('utf-8')
+        for chunk_size in (1, 2, 3, 7, 64, 100000):
+            assert decode_in_chunks(body, chunk_size) == data
+
+    def test_missing_data(self):
+        with pytest.raises(AttachmentDecoder.NoData):
+            decode_in_chunks(b'{"error": true, "message": "Not found"}', 8)
+
+    def test_truncated_data(self):
+        with pytest.raises(AttachmentDecoder.NoData):
+            decode_in_chunks(b'{"attachments": {"1": {"data": "YWJj', 8)
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+from mozilla_addon_signer.cache import AttachmentCache, FileCache, SigningCache
+from mozilla_addon_signer.xpi import XPI
+
+from .test_xpi import SIGNED_WEBX_PATH, UNSIGNED_WEBX_PATH
+
+
+class TestFileCache(object):
+    def test_put_and_get(self, tmpdir):
+        cache = FileCache(str(tmpdir))
+        assert cache.get('missing') is None
+
+        blob = tmpdir.join('blob')
+        blob.write('data')
+        cache.put('key', {'value': 1}, blob_path=str(blob))
+
+        assert cache.get('key')['value'] == 1
+        with open(cache.blob_path('key')) as f:
+            assert f.read() == 'data'
+
+    def test_expired_entries(self, tmpdir):
+        cache = FileCache(str(tmpdir), max_age=60)
+        cache.put('key', {})
+        entry_path = os.path.join(str(tmpdir), 'key.json')
+        past = time.time() - 120
+        os.utime(entry_path, (past, past))
+
+        assert cache.evict() == 0
+        assert cache.keys() == []
+
+    def test_evicts_least_recently_used(self, tmpdir):
+        cache = FileCache(str(tmpdir), max_size=1500)
+        for key in ('a', 'b', 'c'):
+            blob = tmpdir.join('blob-' + key)
+            blob.write('x' * 600)
+            cache.put(key, {}, blob_path=str(blob))
+            past = time.time() - 100 + len(cache.keys())
+            os.utime(os.path.join(str(tmpdir), key + '.json'), (past, past))
+            os.utime(cache.blob_path(key), (past, past))
+
+        assert sorted(cache.keys()) == ['b', 'c']
+
+    def test_puts_only_scan_when_over_the_limit(self, tmpdir, monkeypatch):
+        cache = FileCache(str(tmpdir), max_size=10000)
+        scans = []
+        evict = cache.evict
+        monkeypatch.setattr(cache, 'evict', lambda: scans.append(1) or evict())
+
+        for i in range(5):
+            cache.put('key-{}'.format(i), {'data': 'x' * 100})
+        assert len(scans) == 1
+
+        cache.put('big', {'data': 'x' * 10000})
+        assert len(scans) == 2
+        assert 'big' not in cache.keys()
+
+    def test_concurrent_puts_of_one_key(self, tmpdir):
+        cache = FileCache(str(tmpdir))
+        blob = tmpdir.join('blob')
+        blob.write('x' * 100000)
+        errors = []
+
+        def put():
+            try:
+                for _ in range(20):
+                    cache.put('key', {'value': 1}, blob_path=str(blob))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=put) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert cache.get('key')['value'] == 1
+        assert os.path.getsize(cache.blob_path('key')) == 100000
+        assert sorted(os.listdir(str(tmpdir))) == ['blob', 'key.bin', 'key.json']
+
+    def test_entries_evicted_while_read_are_misses(self, tmpdir, monkeypatch):
+        cache = FileCache(str(tmpdir))
+        cache.put('key', {'value': 1})
+
+        def evicted(path, times):
+            raise OSError(2, 'No such file or directory', path)
+        monkeypatch.setattr(os, 'utime', evicted)
+        assert cache.get('key') is None
+
+    def test_clear(self, tmpdir):
+        cache = FileCache(str(tmpdir))
+        cache.put('key', {})
+        cache.clear()
+        assert cache.get('key') is None
+
+
+class TestSigningCache(object):
+    def test_results_are_keyed_by_type_and_env(self, tmpdir):
+        cache = SigningCache(str(tmpdir))
+        xpi = XPI(UNSIGNED_WEBX_PATH)
+        data = {'uploaded': {'bucket': 'output', 'key': 'signed.xpi'}}
+        cache.put_result(xpi, 'system', 'prod', data)
+
+        assert cache.get_result(xpi, 'system', 'prod')['data'] == data
+        assert cache.get_result(xpi, 'system', 'stage') is None
+        assert cache.get_result(xpi, 'mozillaextension', 'prod') is None
+
+    def test_signed_copy(self, tmpdir):
+        cache = SigningCache(str(tmpdir.mkdir('cache')))
+        xpi = XPI(UNSIGNED_WEBX_PATH)
+        signed = XPI(SIGNED_WEBX_PATH)
+        cache.put_result(xpi, 'system', 'prod', {'uploaded': {}})
+        cache.put_signed(xpi, 'system', 'prod', SIGNED_WEBX_PATH, signed.sha256sum)
+
+        assert cache.signed_path(xpi, 'system', 'prod')
+        previous = cache.find_signed(signed)
+        assert previous['source'] == xpi.sha256sum
+        assert previous['env'] == 'prod'
+
+
+class FakeBugzillaAPI(object):
+    def __init__(self, data):
+        self.data = data
+        self.downloads = 0
+
+    def download_attachment(self, attachment_id, fileobj):
+        self.downloads += 1
+        fileobj.write(self.data)
+        return len(self.data)
+
+
+class TestAttachmentCache(object):
+    def test_fetch_downloads_once(self, tmpdir):
+        cache = AttachmentCache(str(tmpdir))
+        api = FakeBugzillaAPI(b'xpi data')
+        attachment = {'id': 42, 'file_name': 'a.xpi', 'last_change_time': '2018-05-26T04:55:24Z'}
+
+        for _ in range(2):
+            with open(cache.fetch(api, attachment), 'rb') as f:
+                assert f.read() == b'xpi data'
+        assert api.downloads == 1
+
+        attachment['last_change_time'] = '2018-05-27T00:00:00Z'
+        cache.fetch(api, attachment)
+        assert api.downloads == 2
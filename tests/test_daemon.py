@@ -0,0 +1,144 @@
+import os
+import threading
+
+import pytest
+
+from click.testing import CliRunner
+
+from mozilla_addon_signer import cli
+from mozilla_addon_signer.daemon import Daemon, DaemonClient
+from mozilla_addon_signer.signing import Signer
+from mozilla_addon_signer.tracing import tracer
+
+
+class FakeService(object):
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+        self.cleared = []
+
+    def sign(self, src, addon_type, env, **kwargs):
+        if addon_type == 'broken':
+            raise Signer.LambdaError({'errorMessage': 'Bad checksum'})
+        self.release.wait()
+        return {'data': {'uploaded': {'key': os.path.basename(src)}}, 'cached': False,
+                'src': src}
+
+    def needinfos(self, bug_numbers, api_key=None):
+        return [{'bug': bug_numbers[0], 'id': 7, 'setter': 'someone@example.com'}]
+
+    def clear_needinfo(self, bug_number, flag_id, api_key=None):
+        self.cleared.append((bug_number, flag_id))
+        return {}
+
+
+@pytest.fixture(params=['unix', 'http'])
+def daemon(request, tmpdir):
+    address = str(tmpdir.join('d.sock')) if request.param == 'unix' else 'http://127.0.0.1:0'
+    d = Daemon(FakeService(), address=address, concurrency=1, max_queued=0,
+               state_path=str(tmpdir.join('state.json')))
+    thread = threading.Thread(target=d.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    while not os.path.exists(d.state_path):
+        pass
+    yield d
+    d.server.shutdown()
+    thread.join()
+
+
+def test_sign(daemon):
+    client = DaemonClient.from_state(daemon.state_path)
+    result = client.sign('addon.xpi', 'system', 'prod')
+    assert result['src'] == os.path.abspath('addon.xpi')
+
+    with pytest.raises(Signer.LambdaError) as excinfo:
+        client.sign('addon.xpi', 'broken', 'prod')
+    assert excinfo.value.data == {'errorMessage': 'Bad checksum'}
+
+
+def test_jobs_are_traced_as_one_span(daemon):
+    client = DaemonClient.from_state(daemon.state_path)
+    tracer.reset()
+    tracer.enabled = True
+    try:
+        client.sign('addon.xpi', 'system', 'prod')
+    finally:
+        tracer.enabled = False
+    assert [s.name for s in tracer.spans] == ['daemon.sign']
+    tracer.reset()
+
+
+def test_rejects_bad_token(daemon):
+    client = DaemonClient(daemon.address, 'wrong')
+    assert not client.alive()
+    with pytest.raises(DaemonClient.DaemonError):
+        client.sign('addon.xpi', 'system', 'prod')
+
+
+def test_lost_daemon(tmpdir):
+    # As if the daemon had stopped after its state file was read.
+    client = DaemonClient(str(tmpdir.join('gone.sock')), 'token')
+    with pytest.raises(DaemonClient.DaemonError) as excinfo:
+        client.sign('addon.xpi', 'system', 'prod')
+    assert 'serve' in str(excinfo.value)
+
+
+def test_queue_full(daemon):
+    client = DaemonClient.from_state(daemon.state_path)
+    daemon.server.service.release.clear()
+    thread = threading.Thread(target=client.sign, args=('a.xpi', 'system', 'prod'))
+    thread.start()
+    while not client.status()['running']:
+        pass
+
+    with pytest.raises(DaemonClient.DaemonError) as excinfo:
+        client.sign('b.xpi', 'system', 'prod')
+    assert 'QueueFull' in str(excinfo.value)
+
+    daemon.server.service.release.set()
+    thread.join()
+
+
+def test_state_removed_on_shutdown(tmpdir):
+    d = Daemon(FakeService(), address=str(tmpdir.join('d.sock')),
+               state_path=str(tmpdir.join('state.json')))
+    d.write_state()
+    d.close()
+    assert not os.path.exists(d.state_path)
+    assert DaemonClient.from_state(d.state_path) is None
+
+
+class FakeBugzilla(object):
+    def __init__(self):
+        self.cleared = []
+
+    def get_flags_for_bugs(self, bug_numbers):
+        return {'1234': [{'id': 3, 'name': 'needinfo', 'status': '?', 'setter': 'a@b.c',
+                          'requestee': 'me@example.com'}]}
+
+    def who_am_i(self):
+        return {'name': 'me@example.com'}
+
+    def get_bug(self, bug_number):
+        cleared = self.cleared
+
+        class Bug(object):
+            def set_flags(self, flags):
+                cleared.extend((bug_number, flag['id']) for flag in flags)
+        return Bug()
+
+
+def test_cli_routes_through_daemon(daemon, monkeypatch):
+    bz = FakeBugzilla()
+    monkeypatch.setattr(cli, 'DAEMON_STATE_PATH', daemon.state_path)
+    monkeypatch.setattr(cli, 'get_bugzilla', lambda api_key=None: bz)
+
+    result = CliRunner().invoke(cli.cli, ['check-needinfo', '1234'], input='y\n')
+    assert result.exit_code == 0
+    assert daemon.server.service.cleared == [('1234', 7)]
+    assert bz.cleared == []
+
+    result = CliRunner().invoke(cli.cli, ['--no-daemon', 'check-needinfo', '1234'], input='y\n')
+    assert result.exit_code == 0
+    assert bz.cleared == [('1234', 3)]
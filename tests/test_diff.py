@@ -0,0 +1,101 @@
+import hashlib
+import json
+import zipfile
+
+import click
+
+from click.testing import CliRunner
+
+from mozilla_addon_signer import cli
+from mozilla_addon_signer.diff import diff_xpis
+from mozilla_addon_signer.xpi import XPI
+
+
+MANIFEST = json.dumps({'applications': {'gecko': {'id': 'test@mozilla.com'}}, 'version': '1.0'})
+UNCHANGED = b'unchanged ' * 100
+
+
+def make_xpi(path, members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as zf:
+        zf.writestr('manifest.json', MANIFEST)
+        zf.writestr('lib/', '')
+        zf.writestr('same.js', UNCHANGED)
+        for name, data in members.items():
+            zf.writestr(name, data)
+
+    # Corrupt the data of the unchanged member, which only has to be skipped to pass.
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data.replace(UNCHANGED, b'X' * len(UNCHANGED)))
+    return path
+
+
+def test_diff_xpis(tmpdir):
+    old = XPI(make_xpi(str(tmpdir.join('old.xpi')), {
+        'lib/a.js': 'a', 'lib/b.js': 'b', 'removed.js': 'gone',
+        'META-INF/mozilla.rsa': 'old signature',
+    }))
+    new = XPI(make_xpi(str(tmpdir.join('new.xpi')), {
+        'lib/a.js': 'a', 'lib/b.js': 'bb', 'added.js': 'new',
+        'META-INF/cose.manifest': 'new manifest', 'META-INF/cose.sig': 'new signature',
+    }))
+
+    result = diff_xpis(old, new, workers=2)
+    assert result['added'] == [{'name': 'added.js', 'size': 3}]
+    assert result['removed'] == [{'name': 'removed.js', 'size': 4}]
+    assert result['changed'] == [{
+        'name': 'lib/b.js', 'old_size': 1, 'new_size': 2,
+        'old_sha256': hashlib.sha256(b'b').hexdigest(),
+        'new_sha256': hashlib.sha256(b'bb').hexdigest(),
+    }]
+    assert result['unchanged'] == 3
+
+
+def test_members_on_one_side_are_not_read(tmpdir):
+    old = XPI(make_xpi(str(tmpdir.join('old.xpi')), {'META-INF/mozilla.sf': 'signature'}))
+    new = XPI(make_xpi(str(tmpdir.join('new.xpi')), {'only-new/': '', 'only-new/a.js': 'a'}))
+
+    # Nothing has to be hashed, so the corrupt member data is never read.
+    result = diff_xpis(old, new)
+    assert result['added'] == [{'name': 'only-new/a.js', 'size': 1}]
+    assert result['removed'] == []
+    assert result['changed'] == []
+    assert diff_xpis(new, old)['removed'] == [{'name': 'only-new/a.js', 'size': 1}]
+
+
+def test_members_are_compared_by_crc(tmpdir):
+    old = XPI(make_xpi(str(tmpdir.join('old.xpi')), {}))
+    new = XPI(make_xpi(str(tmpdir.join('new.xpi')), {}))
+    with new.open() as f:
+        data = f.read()
+
+    # Content that changes but keeps its size and CRC32 is not detected.
+    with open(new.path, 'wb') as f:
+        f.write(data.replace(b'X' * len(UNCHANGED), b'Y' * len(UNCHANGED)))
+    result = diff_xpis(old, XPI(new.path))
+    assert result['changed'] == []
+    assert result['unchanged'] == 2
+
+
+def test_xpi_diff_command(tmpdir):
+    old = make_xpi(str(tmpdir.join('old.xpi')), {'a.js': 'a'})
+    new = make_xpi(str(tmpdir.join('new.xpi')), {'a.js': 'aa', 'b.js': 'b'})
+
+    result = CliRunner().invoke(cli.cli, ['xpi', 'diff', old, new])
+    assert result.exit_code == 0
+    assert click.unstyle(result.output).splitlines() == [
+        'M  a.js (1 -> 2 bytes)',
+        'A  b.js (1 bytes)',
+        '1 added, 0 removed, 1 changed, 2 unchanged.',
+    ]
+
+
+def test_xpi_diff_command_rejects_non_zip(tmpdir):
+    old = make_xpi(str(tmpdir.join('old.xpi')), {})
+    new = tmpdir.join('new.xpi')
+    new.write('not a zip')
+
+    result = CliRunner().invoke(cli.cli, ['xpi', 'diff', old, str(new)])
+    assert result.exit_code == 1
+    assert '`{}` could not be unzipped.'.format(new) in click.unstyle(result.output)
@@ -0,0 +1,196 @@
+import hashlib
+import io
+import os
+import threading
+import zipfile
+
+import pytest
+import requests
+
+from six.moves import BaseHTTPServer, socketserver
+
+from mozilla_addon_signer import CHUNK_SIZE
+from mozilla_addon_signer.cache import URLCache
+from mozilla_addon_signer.download import URLDownloader
+from mozilla_addon_signer.transfer import SpooledBuffer
+
+
+def make_xpi_data():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as zf:
+        zf.writestr('manifest.json', '{}')
+        zf.writestr('large.bin', os.urandom(3 * CHUNK_SIZE))
+    return buf.getvalue()
+
+
+XPI_DATA = make_xpi_data()
+ETAG = '"v1"'
+# Partial reads are only written out in whole chunks.
+FAIL_AFTER = CHUNK_SIZE + 100
+
+
+class FileHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        body = server.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') == ETAG:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(body)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+
+        if server.fail_after is not None:
+            # Simulate a dropped connection part way through the body.
+            self.wfile.write(body[start:start + server.fail_after])
+            server.fail_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    server.files = {'/addon.xpi': XPI_DATA, '/page.html': b'<html></html>'}
+    server.requests = []
+    server.fail_after = None
+    server.url = 'http://127.0.0.1:{}'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestURLDownloader(object):
+    def test_download(self, http_server, tmpdir):
+        path = str(tmpdir.join('a.xpi'))
+        result = URLDownloader().download(http_server.url + '/addon.xpi', path)
+
+        assert result['sha256'] == hashlib.sha256(XPI_DATA).hexdigest()
+        assert result['size'] == len(XPI_DATA)
+        assert result['etag'] == ETAG
+        with open(path, 'rb') as f:
+            assert f.read() == XPI_DATA
+
+    def test_resumes_interrupted_download(self, http_server, tmpdir):
+        http_server.fail_after = FAIL_AFTER
+        path = str(tmpdir.join('a.xpi'))
+        result = URLDownloader().download(http_server.url + '/addon.xpi', path)
+
+        assert result['sha256'] == hashlib.sha256(XPI_DATA).hexdigest()
+        assert http_server.requests[-1]['Range'] == 'bytes={}-'.format(CHUNK_SIZE)
+
+    def test_restarts_resumes_that_are_not_zip_files(self, http_server, tmpdir):
+        path = tmpdir.join('a.xpi')
+        path.write_binary(b'PK\x03\x04kept')
+        with pytest.raises(URLDownloader.InvalidDownload):
+            URLDownloader().download(http_server.url + '/page.html', str(path),
+                                     resume_validator=ETAG)
+        assert 'Range' in http_server.requests[0]
+        assert 'Range' not in http_server.requests[-1]
+
+    def test_download_to_buffer(self, http_server):
+        http_server.fail_after = FAIL_AFTER
+        with SpooledBuffer('addon.xpi') as buffer:
+            result = URLDownloader().download(http_server.url + '/addon.xpi', buffer)
+            assert buffer.in_memory
+            assert buffer.open().read() == XPI_DATA
+        assert result['sha256'] == hashlib.sha256(XPI_DATA).hexdigest()
+
+    def test_rejects_non_zip(self, http_server, tmpdir):
+        with pytest.raises(URLDownloader.DownloadError):
+            URLDownloader().download(http_server.url + '/page.html', str(tmpdir.join('a.xpi')))
+
+    def test_http_errors(self, http_server, tmpdir):
+        with pytest.raises(requests.exceptions.HTTPError):
+            URLDownloader().download(http_server.url + '/missing.xpi', str(tmpdir.join('a')))
+
+
+class TestURLCache(object):
+    def test_revalidates_with_etag(self, http_server, tmpdir):
+        cache = URLCache(str(tmpdir))
+        url = http_server.url + '/addon.xpi'
+
+        first = cache.fetch(URLDownloader(), url)
+        second = cache.fetch(URLDownloader(), url)
+
+        assert first == second
+        with open(second, 'rb') as f:
+            assert f.read() == XPI_DATA
+        assert http_server.requests[-1]['If-None-Match'] == ETAG
+        assert cache.checksum(url) == hashlib.sha256(XPI_DATA).hexdigest()
+
+    def test_resumes_across_runs(self, http_server, tmpdir):
+        cache = URLCache(str(tmpdir))
+        url = http_server.url + '/addon.xpi'
+        http_server.fail_after = FAIL_AFTER
+
+        with pytest.raises(URLDownloader.DownloadError):
+            cache.fetch(URLDownloader(retries=0), url)
+
+        path = cache.fetch(URLDownloader(retries=0), url)
+        with open(path, 'rb') as f:
+            assert f.read() == XPI_DATA
+        assert http_server.requests[-1]['Range'] == 'bytes={}-'.format(CHUNK_SIZE)
+
+    @pytest.mark.parametrize('partial', [
+        # Killed after the last byte arrived but before the download was recorded.
+        XPI_DATA,
+        # Kept from a larger version of the file.
+        XPI_DATA + b'x' * CHUNK_SIZE,
+    ], ids=['complete', 'too-long'])
+    def test_refetches_partials_that_can_not_be_resumed(self, http_server, tmpdir, partial):
+        cache = URLCache(str(tmpdir))
+        url = http_server.url + '/addon.xpi'
+        with open(cache.temp_path(cache.key(url)), 'wb') as f:
+            f.write(partial)
+        cache.put(cache.key(url), {'url': url, 'complete': False, 'validator': ETAG})
+
+        with open(cache.fetch(URLDownloader(retries=0), url), 'rb') as f:
+            assert f.read() == XPI_DATA
+        assert 'Range' not in http_server.requests[-1]
+        assert cache.checksum(url) == hashlib.sha256(XPI_DATA).hexdigest()
+
+    def test_forgets_invalid_downloads(self, http_server, tmpdir):
+        cache = URLCache(str(tmpdir))
+        url = http_server.url + '/page.html'
+        with pytest.raises(URLDownloader.InvalidDownload):
+            cache.fetch(URLDownloader(), url)
+        assert cache.get(cache.key(url)) is None
+        assert not os.path.exists(cache.temp_path(cache.key(url)))
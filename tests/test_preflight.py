@@ -0,0 +1,120 @@
+import json
+import warnings
+import zipfile
+
+from click.testing import CliRunner
+
+from mozilla_addon_signer import cli
+from mozilla_addon_signer.batch import STATUS_FAILED, SigningPipeline
+from mozilla_addon_signer.cache import SigningCache
+from mozilla_addon_signer.preflight import Preflight
+from mozilla_addon_signer.registry import Registry
+from mozilla_addon_signer.xpi import XPI
+
+from .test_batch import FakeSigner
+from .test_xpi import NO_ID_XPI_PATH, UNSIGNED_BOOTSTRAPPED_PATH, UNSIGNED_WEBX_PATH
+
+
+def make_xpi(path, addon_id='test@mozilla.com', version='1.0', members=()):
+    manifest = {'applications': {'gecko': {'id': addon_id}}, 'manifest_version': 2}
+    if version:
+        manifest['version'] = version
+    with warnings.catch_warnings():
+        # zipfile warns about the duplicate names some tests need.
+        warnings.simplefilter('ignore')
+        with zipfile.ZipFile(path, 'w') as zf:
+            zf.writestr('manifest.json', json.dumps(manifest))
+            for name in members:
+                zf.writestr(name, 'data')
+    return path
+
+
+def rules(problems):
+    return [problem.rule for problem in problems]
+
+
+class TestPreflight(object):
+    def test_valid_xpis_pass(self):
+        checks = Preflight('system', 'prod')
+        assert checks.check_paths([UNSIGNED_WEBX_PATH, UNSIGNED_BOOTSTRAPPED_PATH]) == [[], []]
+
+    def test_load_errors(self):
+        problem, = Preflight('system', 'prod').check_path(NO_ID_XPI_PATH)
+        assert problem.rule == 'id'
+        assert 'has no add-on id' in problem.message
+
+    def test_rules(self, tmpdir):
+        path = make_xpi(str(tmpdir.join('bad.xpi')), addon_id='not an id', version=None,
+                        members=['a.js', 'a.js', '../../etc/passwd'])
+        problems = Preflight('system', 'prod', max_size=10).check_path(path)
+        assert rules(problems) == [
+            'size', 'id', 'version', 'duplicate-members', 'unsafe-paths']
+
+        checks = Preflight('system', 'prod', skip=['size', 'id', 'version', 'unsafe-paths'])
+        assert rules(checks.check_path(path)) == ['duplicate-members']
+
+    def test_already_signed_version(self, tmpdir):
+        cache = SigningCache(str(tmpdir.join('cache')))
+        cache.put_result(XPI(UNSIGNED_WEBX_PATH), 'system', 'prod', {'uploaded': {}})
+
+        # A rebuilt file with the same id and version is rejected, the original is not.
+        rebuilt = str(tmpdir.join('rebuilt.xpi'))
+        make_xpi(rebuilt, addon_id='nothing-web-extension@mozilla.com', version='1.0')
+        checks = Preflight('system', 'prod', cache=cache)
+        assert rules(checks.check_path(rebuilt)) == ['already-signed']
+        assert checks.check_path(UNSIGNED_WEBX_PATH) == []
+        assert Preflight('system', 'stage', cache=cache).check_path(rebuilt) == []
+
+    def test_already_signed_version_in_registry(self, tmpdir):
+        registry = Registry(str(tmpdir.join('registry.sqlite')))
+        registry.record(XPI(UNSIGNED_WEBX_PATH), 'system', 'prod')
+
+        rebuilt = make_xpi(str(tmpdir.join('rebuilt.xpi')),
+                           addon_id='nothing-web-extension@mozilla.com', version='1.0')
+        checks = Preflight('system', 'prod', registry=registry)
+        problem, = checks.check_path(rebuilt)
+        assert problem.rule == 'already-signed'
+        assert problem.message == (
+            'Version 1.0 of `nothing-web-extension@mozilla.com` was already signed as `system` '
+            'in `prod` from a different file.')
+        assert checks.check_path(UNSIGNED_WEBX_PATH) == []
+
+        # Once both files have been signed, either of them may be signed again.
+        registry.record(XPI(rebuilt), 'system', 'prod')
+        assert checks.check_path(rebuilt) == []
+        assert checks.check_path(UNSIGNED_WEBX_PATH) == []
+
+
+def test_pipeline_fails_before_uploading(tmpdir):
+    class CountingSigner(FakeSigner):
+        uploads = 0
+
+        def upload(self, xpi, env, key=None):
+            CountingSigner.uploads += 1
+            return super(CountingSigner, self).upload(xpi, env, key)
+
+    bad = make_xpi(str(tmpdir.join('bad.xpi')), version=None)
+    pipeline = SigningPipeline(CountingSigner(), 'system', 'prod', output_dir=str(tmpdir),
+                               preflight=Preflight('system', 'prod'))
+    item, = pipeline.run([bad])
+    assert item.status == STATUS_FAILED
+    assert item.message == 'The add-on has no version.'
+    assert CountingSigner.uploads == 0
+
+
+def test_sign_dry_run(tmpdir):
+    runner = CliRunner()
+    result = runner.invoke(cli.cli, ['sign', '--dry-run', '-t', 'system', UNSIGNED_WEBX_PATH])
+    assert result.exit_code == 0
+    assert 'Pre-flight checks passed.' in result.output
+
+    bad = make_xpi(str(tmpdir.join('bad.xpi')), version=None)
+    result = runner.invoke(cli.cli, ['sign', '--dry-run', '-t', 'system', bad])
+    assert result.exit_code == 1
+    assert '[version] The add-on has no version.' in result.output
+
+    # An XPI without an id is reported, not raised.
+    result = runner.invoke(cli.cli, ['sign', '--dry-run', '-t', 'system', NO_ID_XPI_PATH])
+    assert result.exit_code == 1
+    assert isinstance(result.exception, SystemExit)
+    assert '`{}` has no add-on id.'.format(NO_ID_XPI_PATH) in result.output
@@ -0,0 +1,48 @@
+import io
+
+import pytest
+
+from xml.etree.ElementTree import ParseError
+
+from mozilla_addon_signer.rdf import InstallRDF, parse_install_rdf
+
+
+HEADER = (b'<?xml version="1.0"?>'
+          b'<RDF xmlns="http://www.w3.org/1999/02/22-rdf-syntax-ns#"'
+          b' xmlns:em="http://www.mozilla.org/2004/em-rdf#">')
+
+
+def parse(body):
+    return parse_install_rdf(io.BytesIO(HEADER + body))
+
+
+def test_ignores_nested_descriptions():
+    rdf = parse(b'<Description about="urn:mozilla:install-manifest">'
+                b'<em:targetApplication><Description><em:id>{app}</em:id>'
+                b'<em:version>99</em:version></Description></em:targetApplication>'
+                b'<em:id>addon@mozilla.com</em:id><em:version>1.0</em:version>'
+                b'</Description></RDF>')
+    assert rdf.id == 'addon@mozilla.com'
+    assert rdf.version == '1.0'
+    assert rdf.name is None
+
+
+def test_attribute_properties():
+    rdf = parse(b'<Description about="urn:mozilla:install-manifest" em:id="a@b" em:version="2"'
+                b' em:name="A" em:type="2" em:bootstrap="true"/></RDF>')
+    assert (rdf.id, rdf.version, rdf.name) == ('a@b', '2', 'A')
+
+
+def test_stops_once_fields_are_read():
+    # Anything after the fields we need is never parsed.
+    rdf = parse(b'<Description em:id="a@b" em:version="2" em:name="A" em:type="2"'
+                b' em:bootstrap="true">' + b'<em:localized/>' * 10000 + b'<broken')
+    assert rdf.id == 'a@b'
+
+    with pytest.raises(ParseError):
+        parse(b'<Description em:id="a@b">' + b'<em:localized/>' * 10000 + b'<broken')
+
+
+def test_slots():
+    with pytest.raises(AttributeError):
+        InstallRDF().localized = []
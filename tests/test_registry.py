@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+
+from click.testing import CliRunner
+
+from mozilla_addon_signer import cli
+from mozilla_addon_signer.registry import FILTERS, Registry
+from mozilla_addon_signer.service import SigningService
+from mozilla_addon_signer.xpi import XPI
+
+from .test_batch import FakeSigner
+from .test_xpi import UNSIGNED_BOOTSTRAPPED_PATH, UNSIGNED_WEBX_PATH
+
+
+class TestRegistry(object):
+    def test_record_and_find(self, tmpdir):
+        registry = Registry(str(tmpdir.join('registry.sqlite')))
+        xpi = XPI(UNSIGNED_WEBX_PATH)
+        first = registry.record(xpi, 'system', 'stage', source={'bucket': 'in', 'key': 'a.xpi'},
+                                uploaded={'bucket': 'out', 'key': 'a.xpi'})
+        second = registry.record(XPI(UNSIGNED_BOOTSTRAPPED_PATH), 'system', 'prod')
+        registry.update(first, dest='/tmp/a.xpi', signed_checksum='abc', bug='1234')
+
+        row, = registry.find(bug=1234)
+        assert row['id'] == first
+        assert row['addon_id'] == 'nothing-web-extension@mozilla.com'
+        assert row['input_key'] == 'a.xpi'
+        assert row['output_bucket'] == 'out'
+        assert row['dest'] == '/tmp/a.xpi'
+
+        assert [r['id'] for r in registry.find(checksum=xpi.sha256sum)] == [first]
+        assert [r['id'] for r in registry.find(signed_checksum='abc')] == [first]
+        assert [r['id'] for r in registry.find(addon_id=xpi.id, version='1.0', env='stage')] == [
+            first]
+        assert [r['id'] for r in registry.find()] == [second, first]
+        assert registry.find(addon_id=xpi.id, env='prod') == []
+
+    def test_bug_aliases_are_not_recorded(self, tmpdir):
+        registry = Registry(str(tmpdir.join('registry.sqlite')))
+        record = registry.record(XPI(UNSIGNED_WEBX_PATH), 'system', 'prod')
+        registry.update(record, dest='/tmp/a.xpi', bug='some-alias')
+        row = registry.get(record)
+        assert row['bug'] is None
+        assert row['dest'] == '/tmp/a.xpi'
+
+    def test_lookups_use_indexes(self, tmpdir):
+        registry = Registry(str(tmpdir.join('registry.sqlite')))
+        registry.record(XPI(UNSIGNED_WEBX_PATH), 'system', 'prod')
+        conn = registry._connect()
+        for name in FILTERS:
+            plan = conn.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM signings WHERE {} = ? '
+                'ORDER BY created DESC, id DESC LIMIT ?'.format(name), ['x', 50]).fetchall()
+            assert 'SEARCH signings USING INDEX' in ' '.join(row[-1] for row in plan), name
+
+    def test_missing_database_is_not_created(self, tmpdir):
+        path = str(tmpdir.join('registry.sqlite'))
+        assert Registry(path).find(addon_id='x') == []
+        assert not os.path.exists(path)
+
+    def test_concurrent_records(self, tmpdir):
+        registry = Registry(str(tmpdir.join('registry.sqlite')))
+        xpi = XPI(UNSIGNED_WEBX_PATH)
+        threads = [threading.Thread(target=registry.record, args=(xpi, 'system', 'prod'))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(registry.find(addon_id=xpi.id)) == 8
+
+
+def test_service_records_signings(tmpdir):
+    registry = Registry(str(tmpdir.join('registry.sqlite')))
+    service = SigningService(lambda profile, bucket_name: FakeSigner(), None, registry=registry)
+    result = service.sign(UNSIGNED_WEBX_PATH, 'system', 'prod')
+    dest = str(tmpdir.join('signed.xpi'))
+    service.download(UNSIGNED_WEBX_PATH, 'system', 'prod', result['data']['uploaded'], dest,
+                     verify=False, record=result['record'])
+
+    row = registry.get(result['record'])
+    assert row['input_key'] == os.path.basename(UNSIGNED_WEBX_PATH)
+    assert row['output_bucket'] == 'output'
+    assert row['dest'] == dest
+    assert row['signed_checksum'] is not None
+
+
+def test_find_command(tmpdir, monkeypatch):
+    registry = Registry(str(tmpdir.join('registry.sqlite')))
+    monkeypatch.setattr(cli.Registry, 'from_config', lambda config: registry)
+    xpi = XPI(UNSIGNED_WEBX_PATH)
+    record = registry.record(xpi, 'system', 'prod')
+    registry.update(record, signed_checksum='f' * 64, bug=42)
+
+    runner = CliRunner()
+    result = runner.invoke(cli.cli, ['find', '--checksum', 'F' * 64, '--json'])
+    assert result.exit_code == 0
+    assert [row['id'] for row in json.loads(result.output)] == [record]
+
+    result = runner.invoke(cli.cli, ['history', xpi.id])
+    assert result.exit_code == 0
+    assert xpi.id in result.output and '42' in result.output
+
+    assert runner.invoke(cli.cli, ['find', '--bug', '7']).exit_code == 1
@@ -0,0 +1,141 @@
+import os
+import threading
+
+import pytest
+
+from mozilla_addon_signer import cli
+from mozilla_addon_signer.cache import SigningCache
+from mozilla_addon_signer.service import SigningService
+from mozilla_addon_signer.xpi import XPI
+
+from .test_batch import FakeSigner
+from .test_xpi import SIGNED_WEBX_PATH, UNSIGNED_WEBX_PATH
+
+
+class RecordingSigner(FakeSigner):
+    def __init__(self):
+        super(RecordingSigner, self).__init__()
+        self.uploads = []
+        self.copies = []
+        self.invoked = []
+        self.barrier = threading.Barrier(2, timeout=5)
+
+    def upload(self, xpi, env, key=None):
+        self.uploads.append(env)
+        source, checksum = super(RecordingSigner, self).upload(xpi, env, key)
+        return dict(source, bucket='input-{}'.format(env)), checksum
+
+    def copy(self, source, env, checksum=None):
+        self.copies.append((source['bucket'], env))
+        return super(RecordingSigner, self).copy(source, env, checksum)
+
+    def invoke(self, addon_type, env, source, checksum):
+        # Both environments must be signing at the same time to get past the barrier.
+        self.barrier.wait()
+        self.invoked.append((env, source['bucket']))
+        return {'uploaded': {'bucket': 'output', 'key': '{}/{}'.format(env, source['key'])}}
+
+
+def test_sign_envs_uploads_once():
+    signer = RecordingSigner()
+    service = SigningService(lambda profile, bucket_name: signer, None)
+    results = service.sign_envs(UNSIGNED_WEBX_PATH, 'system', ['stage', 'prod'])
+
+    assert signer.uploads == ['stage']
+    assert signer.copies == [('input-stage', 'prod')]
+    assert sorted(signer.invoked) == [('prod', 'input-prod'), ('stage', 'input-stage')]
+    assert results['prod']['data']['uploaded']['key'].startswith('prod/')
+    assert results['stage']['data']['uploaded']['key'].startswith('stage/')
+
+
+def test_cached_signings_need_no_signer(tmpdir):
+    xpi = XPI(UNSIGNED_WEBX_PATH)
+    cache = SigningCache(str(tmpdir))
+    cache.put_result(xpi, 'system', 'prod', {'uploaded': {'bucket': 'output', 'key': 'a.xpi'}})
+    cache.put_signed(xpi, 'system', 'prod', SIGNED_WEBX_PATH, XPI(SIGNED_WEBX_PATH).sha256sum)
+
+    def make_signer(profile, bucket_name):
+        raise AssertionError('No signer should be needed.')
+
+    service = SigningService(make_signer, None, cache=cache)
+    result = service.sign(UNSIGNED_WEBX_PATH, 'system', 'prod')
+    assert result['cached']
+    assert result['data']['uploaded']['key'] == 'a.xpi'
+
+
+def test_env_destinations():
+    xpi = XPI(UNSIGNED_WEBX_PATH)
+    assert cli.parse_envs(('stage,prod', 'prod')) == ['stage', 'prod']
+    assert cli.env_destinations(xpi, None, ['prod']) == {
+        'prod': 'nothing-web-extension@mozilla.com-1.0-signed.xpi'}
+    assert cli.env_destinations(xpi, None, ['stage', 'prod'], ['test']) == {
+        'stage': 'nothing-web-extension@mozilla.com-1.0-signed-test-stage.xpi',
+        'prod': 'nothing-web-extension@mozilla.com-1.0-signed-test-prod.xpi',
+    }
+    assert cli.env_destinations(xpi, 'out/addon.xpi', ['stage', 'prod']) == {
+        'stage': 'out/addon-stage.xpi', 'prod': 'out/addon-prod.xpi'}
+
+
+class CopyingSigner(FakeSigner):
+    # The "signed" file is whichever XPI the uploaded key points at.
+    def download(self, uploaded, dest, check=None):
+        with open(uploaded['key'], 'rb') as f:
+            return self.write(dest, f.read(), check)
+
+
+class FakeBugzilla(object):
+    def __init__(self):
+        self.attachments = []
+
+    def stream_attachment_for_bug(self, bug_number, fileobj, size, **kwargs):
+        self.attachments.append((bug_number, len(fileobj.read()), size))
+
+
+def test_attach_verifies_before_attaching():
+    bz = FakeBugzilla()
+    service = SigningService(lambda profile, bucket_name: CopyingSigner(), lambda api_key: bz)
+
+    with pytest.raises(SigningService.VerificationError):
+        service.attach(1234, UNSIGNED_WEBX_PATH, 'system', 'prod', {'key': UNSIGNED_WEBX_PATH},
+                       'signed.xpi')
+    assert bz.attachments == []
+
+    service.attach(1234, UNSIGNED_WEBX_PATH, 'system', 'prod', {'key': SIGNED_WEBX_PATH},
+                   'signed.xpi')
+    size = os.path.getsize(SIGNED_WEBX_PATH)
+    assert bz.attachments == [(1234, size, size)]
+
+
+def test_bad_downloads_never_replace_dest(tmpdir):
+    bz = FakeBugzilla()
+    service = SigningService(lambda profile, bucket_name: CopyingSigner(), lambda api_key: bz)
+    dest = tmpdir.join('signed.xpi')
+    dest.write('old')
+
+    with pytest.raises(SigningService.VerificationError) as excinfo:
+        service.download(UNSIGNED_WEBX_PATH, 'system', 'prod', {'key': UNSIGNED_WEBX_PATH},
+                         str(dest))
+    assert str(dest) in str(excinfo.value)
+    with pytest.raises(SigningService.VerificationError):
+        service.attach(1234, UNSIGNED_WEBX_PATH, 'system', 'prod', {'key': UNSIGNED_WEBX_PATH},
+                       'signed.xpi', dest=str(dest))
+    assert dest.read() == 'old'
+    assert tmpdir.listdir() == [dest]
+    assert bz.attachments == []
+
+
+def test_cached_copies_are_verified(tmpdir):
+    xpi = XPI(UNSIGNED_WEBX_PATH)
+    cache = SigningCache(str(tmpdir.mkdir('cache')))
+    cache.put_result(xpi, 'system', 'prod', {'uploaded': {'bucket': 'output', 'key': 'a.xpi'}})
+    # As if it had been downloaded with verification turned off.
+    cache.put_signed(xpi, 'system', 'prod', UNSIGNED_WEBX_PATH, xpi.sha256sum)
+    service = SigningService(None, None, cache=cache)
+    dest = tmpdir.join('signed.xpi')
+    dest.write('old')
+
+    with pytest.raises(SigningService.VerificationError):
+        service.download(UNSIGNED_WEBX_PATH, 'system', 'prod', None, str(dest))
+    assert dest.read() == 'old'
+    service.download(UNSIGNED_WEBX_PATH, 'system', 'prod', None, str(dest), verify=False)
+    assert XPI(str(dest)).sha256sum == xpi.sha256sum
@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+import struct
+import zipfile
+
+from click.testing import CliRunner
+
+from mozilla_addon_signer import cli
+from mozilla_addon_signer.cache import CertificateCache
+from mozilla_addon_signer.signature import (
+    inspect_path, inspect_paths, inspect_signature, parse_manifest_sections, verify_path,
+    verify_signature)
+from mozilla_addon_signer.xpi import XPI
+
+from . import TESTS_DIR
+
+
+SIGNED_PATH = os.path.join(TESTS_DIR, 'xpi', 'empty@mozilla.com-1.0.0-signed.xpi')
+UNSIGNED_PATH = os.path.join(TESTS_DIR, 'xpi', 'empty@mozilla.com-1.0.0.xpi')
+WEBEXT_PATH = os.path.join(TESTS_DIR, 'xpi', 'nothing-web-extension@mozilla.com-1.0-signed.xpi')
+
+
+def tamper(src, dest, replace=None, drop=None, add=None):
+    with zipfile.ZipFile(src) as zin, zipfile.ZipFile(dest, 'w') as zout:
+        for info in zin.infolist():
+            if info.filename == drop:
+                continue
+            data = zin.read(info.filename)
+            if info.filename in (replace or {}):
+                data = replace[info.filename]
+            zout.writestr(info, data)
+        for name, data in (add or {}).items():
+            zout.writestr(name, data)
+    return dest
+
+
+def corrupt(src, dest, name):
+    # Flip a byte in the middle of a member's compressed data.
+    shutil.copyfile(src, dest)
+    info = zipfile.ZipFile(src).getinfo(name)
+    with open(dest, 'r+b') as f:
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack('<HH', f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length + info.compress_size // 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes(bytearray([ord(byte) ^ 0xff])))
+    return dest
+
+
+def test_parse_manifest_sections():
+    data = b'Manifest-Version: 1.0\n\nName: a-very\n -long-name.js\nSHA1-Digest: abc=\n'
+    assert parse_manifest_sections(data) == [
+        {'Manifest-Version': '1.0'},
+        {'Name': 'a-very-long-name.js', 'SHA1-Digest': 'abc='},
+    ]
+
+
+def test_inspect_signature():
+    summary = inspect_signature(XPI(SIGNED_PATH))
+    assert summary['id'] == 'empty@mozilla.com'
+    assert summary['signature_file']['Signature-Version'] == '1.0'
+    assert len(summary['certificates']) == 2
+    assert summary['certificates'][0]['common_name'] == 'empty@mozilla.com'
+
+
+def test_inspect_path_reports_errors():
+    assert inspect_path(UNSIGNED_PATH)['error'] == 'is not a signed addon'
+    assert inspect_path('missing.xpi')['error'] == 'does not exist'
+
+
+def test_inspect_paths_uses_cache(tmpdir):
+    cache = CertificateCache(str(tmpdir))
+    first, = inspect_paths([SIGNED_PATH], cache=cache)
+    assert cache.get_summary(XPI(SIGNED_PATH))['sha256'] == first['sha256']
+    second, = inspect_paths([SIGNED_PATH], cache=cache)
+    assert first == second
+
+
+def test_show_cert_json():
+    result = CliRunner().invoke(cli.cli, ['show-cert', '--json', '--no-cache', SIGNED_PATH,
+                                          UNSIGNED_PATH])
+    assert result.exit_code == 1
+    signed, unsigned = json.loads(result.output)
+    assert signed['path'] == SIGNED_PATH
+    assert signed['certificates'][0]['common_name'] == 'empty@mozilla.com'
+    assert unsigned['error'] == 'is not a signed addon'
+
+
+def test_verify_signature():
+    assert verify_signature(XPI(WEBEXT_PATH)) == {
+        'ok': True, 'missing': [], 'extra': [], 'mismatched': []}
+
+
+def test_verify_signature_reports_tampering(tmpdir):
+    manifest = XPI(WEBEXT_PATH).read_member('manifest.json') + b'\n'
+    path = tamper(WEBEXT_PATH, str(tmpdir.join('a.xpi')), replace={'manifest.json': manifest},
+                  drop='nothing.js', add={'extra.js': b''})
+    result = verify_signature(XPI(path), workers=2)
+    assert not result['ok']
+    assert result['missing'] == ['nothing.js']
+    assert result['extra'] == ['extra.js']
+    assert result['mismatched'] == ['manifest.json']
+
+
+def test_verify_signature_skips_cose_signatures(tmpdir):
+    path = tamper(WEBEXT_PATH, str(tmpdir.join('a.xpi')), add={
+        'META-INF/cose.manifest': b'Manifest-Version: 1.0\n', 'META-INF/cose.sig': b'sig'})
+    assert verify_signature(XPI(path))['ok']
+
+
+def test_verify_signature_requires_digests(tmpdir):
+    # Drop every digest line from the section of nothing.js.
+    manifest = XPI(WEBEXT_PATH).read_member('META-INF/manifest.mf').decode('utf-8')
+    sections = manifest.split('\n\n')
+    stripped = '\n\n'.join(
+        '\n'.join(line for line in section.split('\n') if 'Digest' not in line)
+        if 'Name: nothing.js' in section else section for section in sections)
+    path = tamper(WEBEXT_PATH, str(tmpdir.join('a.xpi')),
+                  replace={'META-INF/manifest.mf': stripped.encode('utf-8')})
+    assert 'nothing.js' in verify_signature(XPI(path))['mismatched']
+
+
+def test_verify_signature_checks_manifest_digest(tmpdir):
+    path = tamper(WEBEXT_PATH, str(tmpdir.join('a.xpi')), replace={
+        'META-INF/manifest.mf': XPI(WEBEXT_PATH).read_member('META-INF/manifest.mf') + b'\n'})
+    assert verify_signature(XPI(path))['mismatched'] == ['META-INF/manifest.mf']
+
+
+def test_verify_signature_reports_corrupt_members(tmpdir):
+    path = corrupt(SIGNED_PATH, str(tmpdir.join('a.xpi')), 'icon.png')
+    assert verify_signature(XPI(path))['mismatched'] == ['icon.png']
+    path = corrupt(SIGNED_PATH, str(tmpdir.join('b.xpi')), 'chrome.manifest')
+    assert verify_signature(XPI(path))['mismatched'] == ['chrome.manifest']
+
+
+def test_verify_path_reports_corrupt_archives(tmpdir):
+    path = corrupt(SIGNED_PATH, str(tmpdir.join('a.xpi')), 'META-INF/manifest.mf')
+    result = verify_path(path)
+    assert not result['ok']
+    assert result['error'].startswith('is corrupt')
+
+
+def test_verify_command(tmpdir):
+    path = tamper(WEBEXT_PATH, str(tmpdir.join('a.xpi')), replace={'nothing.js': b'evil()'})
+    runner = CliRunner()
+    assert runner.invoke(cli.cli, ['verify', WEBEXT_PATH, SIGNED_PATH]).exit_code == 0
+    result = runner.invoke(cli.cli, ['verify', '--json', WEBEXT_PATH, path, UNSIGNED_PATH])
+    assert result.exit_code == 1
+    assert [r['ok'] for r in json.loads(result.output)] == [True, False, False]
+    assert verify_path(UNSIGNED_PATH)['error'] == 'is not a signed addon'
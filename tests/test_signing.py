@@ -0,0 +1,267 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+from mozilla_addon_signer.signing import Signer
+from mozilla_addon_signer.xpi import XPI
+
+from .test_xpi import UNSIGNED_BOOTSTRAPPED_PATH, UNSIGNED_WEBX_PATH
+
+
+def not_found():
+    return ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+        self.gets = 0
+        self.uploads = 0
+        self.copies = 0
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None, ExtraArgs=None):
+        self.uploads += 1
+        self.objects[(bucket, key)] = fileobj.read()
+        self.metadata[(bucket, key)] = (ExtraArgs or {}).get('Metadata', {})
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {
+            'ETag': '"{}"'.format(hashlib.md5(self.objects[(Bucket, Key)]).hexdigest()),
+            'Metadata': self.metadata.get((Bucket, Key), {}),
+        }
+
+    def get_object(self, Bucket, Key):
+        self.gets += 1
+        if (Bucket, Key) not in self.objects:
+            raise not_found()
+        data = self.objects[(Bucket, Key)]
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.copies += 1
+        source = (CopySource['Bucket'], CopySource['Key'])
+        self.objects[(Bucket, Key)] = self.objects[source]
+        self.metadata[(Bucket, Key)] = self.metadata.get(source, {})
+
+
+class FakeLambda(object):
+    def __init__(self, s3, response, polls_before_result=2, status_code=200,
+                 writes_result=True):
+        self.s3 = s3
+        self.response = response
+        self.polls_before_result = polls_before_result
+        self.status_code = status_code
+        # Lambdas that predate async signing only save the signed XPI.
+        self.writes_result = writes_result
+        self.calls = []
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse'):
+        payload = json.loads(Payload)
+        self.calls.append((FunctionName, InvocationType, payload))
+        body = json.dumps(self.response).encode('utf-8')
+
+        if InvocationType == 'Event':
+            result = payload['result']
+            s3 = self.s3
+            get_object = s3.get_object
+
+            def delayed_get_object(Bucket, Key):
+                if s3.gets >= self.polls_before_result:
+                    if self.writes_result:
+                        s3.objects[(result['bucket'], result['key'])] = body
+                    else:
+                        output = result['output']
+                        s3.objects[(output['bucket'], output['key'])] = b'signed'
+                return get_object(Bucket, Key)
+
+            s3.get_object = delayed_get_object
+            return {'StatusCode': 202, 'Payload': io.BytesIO(b'')}
+
+        response = {'StatusCode': self.status_code, 'Payload': io.BytesIO(body)}
+        if 'errorMessage' in self.response:
+            response['FunctionError'] = 'Unhandled'
+        return response
+
+
+class FakeSession(object):
+    def __init__(self, s3, aws_lambda):
+        self.clients = {'s3': s3, 'lambda': aws_lambda}
+
+    def client(self, name):
+        return self.clients[name]
+
+
+SOURCE = {'bucket': 'input', 'key': 'addon.xpi'}
+UPLOADED = {'uploaded': {'bucket': 'output', 'key': 'addon-signed.xpi'}}
+ERROR = {'errorType': 'ValueError', 'errorMessage': 'Bad checksum'}
+
+
+def make_signer(response, **kwargs):
+    s3 = FakeS3()
+    aws_lambda = FakeLambda(s3, response, **kwargs)
+    return Signer(session=FakeSession(s3, aws_lambda)), s3, aws_lambda
+
+
+class TestSigner(object):
+    def test_invoke(self):
+        signer, _, aws_lambda = make_signer(UPLOADED)
+        assert signer.invoke('system', 'prod', SOURCE, 'abc') == UPLOADED
+        name, invocation_type, payload = aws_lambda.calls[0]
+        assert name == 'addons-sign-xpi-system-prod'
+        assert payload == {'source': SOURCE, 'checksum': 'abc'}
+
+    def test_invoke_error(self):
+        signer, _, _ = make_signer(ERROR)
+        with pytest.raises(Signer.LambdaError) as excinfo:
+            signer.invoke('system', 'prod', SOURCE, 'abc')
+        assert excinfo.value.data == ERROR
+
+    def test_invoke_async_polls_for_result(self, monkeypatch):
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        signer, s3, aws_lambda = make_signer(UPLOADED)
+
+        result = signer.invoke_async('system', 'stage', SOURCE, 'abc')
+        assert result == {
+            'bucket': 'input',
+            'key': 'addon.xpi.stage.result.json',
+            'output': {
+                'bucket': 'net-mozaws-stage-addons-signxpi-output',
+                'key': 'addon.xpi',
+                'etag': None,
+            },
+        }
+        assert aws_lambda.calls[0][1] == 'Event'
+        assert aws_lambda.calls[0][2]['result'] == result
+
+        assert signer.wait_for_result(result) == UPLOADED
+        assert s3.gets == 3
+        assert s3.objects == {}
+
+    def test_wait_for_result_falls_back_to_the_output_bucket(self, monkeypatch):
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        signer, s3, _ = make_signer(UPLOADED, writes_result=False)
+        signer.output_bucket = 'output'
+        # A copy signed earlier must not be mistaken for the result of this signing.
+        s3.objects[('output', 'addon.xpi')] = b'signed before'
+
+        result = signer.invoke_async('system', 'stage', SOURCE, 'abc')
+        assert result['output']['etag'] is not None
+        assert signer.wait_for_result(result) == {
+            'uploaded': {'bucket': 'output', 'key': 'addon.xpi'},
+        }
+        assert s3.gets == 3
+        assert s3.objects[('output', 'addon.xpi')] == b'signed'
+
+    def test_wait_for_result_without_list_bucket(self, monkeypatch):
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        signer, s3, _ = make_signer(UPLOADED)
+        result = signer.invoke_async('system', 'stage', SOURCE, 'abc')
+
+        # Without s3:ListBucket, a result that is not there yet is forbidden.
+        get_object = s3.get_object
+
+        def forbidden(Bucket, Key):
+            try:
+                return get_object(Bucket, Key)
+            except ClientError:
+                raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetObject')
+        s3.get_object = forbidden
+        assert signer.wait_for_result(result) == UPLOADED
+
+    def test_wait_for_result_s3_errors(self, monkeypatch):
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        signer, s3, _ = make_signer(UPLOADED)
+        result = signer.invoke_async('system', 'stage', SOURCE, 'abc')
+
+        def broken(Bucket, Key):
+            raise ClientError({'Error': {'Code': 'InternalError'}}, 'GetObject')
+        s3.get_object = broken
+        with pytest.raises(Signer.SigningError):
+            signer.wait_for_result(result)
+
+    def test_invoke_async_error(self, monkeypatch):
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        signer, _, _ = make_signer(ERROR, polls_before_result=0)
+        result = signer.invoke_async('system', 'stage', SOURCE, 'abc')
+        with pytest.raises(Signer.LambdaError):
+            signer.wait_for_result(result)
+
+    def test_wait_for_result_timeout(self, monkeypatch):
+        monkeypatch.setattr('time.sleep', lambda seconds: None)
+        signer, _, _ = make_signer(UPLOADED, polls_before_result=1000)
+        result = signer.invoke_async('system', 'stage', SOURCE, 'abc')
+        with pytest.raises(Signer.SigningError):
+            signer.wait_for_result(result, timeout=0)
+
+    def test_missing_objects(self):
+        signer, s3, _ = make_signer(UPLOADED)
+        s3.objects[('output', 'addon-signed.xpi')] = b'signed'
+        assert signer.exists(UPLOADED['uploaded'])
+        assert not signer.exists({'bucket': 'output', 'key': 'missing.xpi'})
+
+        # Without s3:ListBucket, a missing object is forbidden rather than not found.
+        def forbidden(Bucket, Key):
+            raise ClientError({'Error': {'Code': '403'}}, 'HeadObject')
+        s3.head_object = forbidden
+        assert not signer.exists(UPLOADED['uploaded'])
+        assert signer.stored_checksum('output', 'addon-signed.xpi') is None
+        assert signer._etag(UPLOADED['uploaded']) is None
+
+    def test_copy(self):
+        signer, s3, _ = make_signer(UPLOADED)
+        source = {'bucket': 'net-mozaws-stage-addons-signxpi-input', 'key': 'addon.xpi'}
+        s3.objects[(source['bucket'], source['key'])] = b'xpi'
+
+        assert signer.copy(source, 'stage') is source
+        copied = signer.copy(source, 'prod')
+        assert copied == {'bucket': 'net-mozaws-prod-addons-signxpi-input', 'key': 'addon.xpi'}
+        assert s3.objects[(copied['bucket'], copied['key'])] == b'xpi'
+
+    def test_upload_reuses_a_known_checksum(self, monkeypatch):
+        signer, s3, _ = make_signer(UPLOADED)
+        xpi = XPI(UNSIGNED_WEBX_PATH)
+        checksum = xpi.sha256sum
+
+        def not_again(fileobj):
+            raise AssertionError('The XPI should not be hashed again.')
+        monkeypatch.setattr('mozilla_addon_signer.transfer.HashingReader', not_again)
+        source, uploaded = signer.upload(xpi, 'prod')
+        assert uploaded == checksum
+        with open(UNSIGNED_WEBX_PATH, 'rb') as f:
+            assert s3.objects[(source['bucket'], source['key'])] == f.read()
+
+    def test_content_addressed_upload(self, tmpdir):
+        signer, s3, _ = make_signer(UPLOADED)
+        signer.content_addressed = True
+        xpi = XPI(UNSIGNED_WEBX_PATH)
+
+        source, checksum = signer.upload(xpi, 'prod')
+        assert checksum == xpi.sha256sum
+        assert source['key'] == '{}/{}'.format(checksum, os.path.basename(UNSIGNED_WEBX_PATH))
+        assert s3.metadata[(source['bucket'], source['key'])] == {'sha256': checksum}
+
+        # Identical bytes are not uploaded again, not even to copy them to another env.
+        assert signer.upload(XPI(UNSIGNED_WEBX_PATH), 'prod') == (source, checksum)
+        assert s3.uploads == 1
+        copied = signer.copy(source, 'stage', checksum)
+        assert signer.copy(source, 'stage', checksum) == copied
+        assert s3.copies == 1
+
+        # Different files with the same name no longer overwrite each other.
+        other = str(tmpdir.join(os.path.basename(UNSIGNED_WEBX_PATH)))
+        shutil.copy(UNSIGNED_BOOTSTRAPPED_PATH, other)
+        other_source, _ = signer.upload(XPI(other), 'prod')
+        assert other_source['key'] != source['key']
+        assert s3.uploads == 2
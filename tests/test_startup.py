@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from . import TESTS_DIR
+
+
+# Generous enough for a slow CI machine, but far below what importing boto3 costs.
+STARTUP_BUDGET = float(os.environ.get('STARTUP_BUDGET', 1.5))
+HEAVY_MODULES = ['boto3', 'botocore', 'requests']
+
+RUN_CLI = '''
+import atexit, json, sys
+atexit.register(lambda: sys.stderr.write(json.dumps(
+    sorted(m for m in {heavy!r} if m in sys.modules))))
+from mozilla_addon_signer.cli import cli
+cli()
+'''.format(heavy=HEAVY_MODULES)
+
+
+def run_cli(home, *args):
+    env = dict(os.environ, HOME=str(home))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(TESTS_DIR)] + [p for p in [env.get('PYTHONPATH')] if p])
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-c', RUN_CLI] + list(args), env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    elapsed = time.time() - start
+    assert process.returncode == 0, err
+    return elapsed, json.loads(err.decode().strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('args', [
+    ['--help'],
+    ['configure', 'aws.profile_name'],
+])
+def test_startup(tmpdir, args):
+    elapsed, imported = run_cli(tmpdir, *args)
+    assert imported == []
+    assert elapsed < STARTUP_BUDGET
+
+
+def test_reading_config_does_not_create_it(tmpdir):
+    run_cli(tmpdir, 'configure', 'aws.profile_name')
+    assert not tmpdir.join('.mozilla_addon_signer').exists()
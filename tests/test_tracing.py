@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from click.testing import CliRunner
+
+from mozilla_addon_signer import cli
+from mozilla_addon_signer.tracing import FORMAT_CHROME, NULL_SPAN, Tracer, tracer
+
+
+def test_disabled_tracer_records_nothing():
+    t = Tracer()
+    with t.span('phase') as s:
+        assert s is NULL_SPAN
+    assert t.spans == []
+
+
+def test_spans_and_summary():
+    t = Tracer()
+    t.enabled = True
+    with t.span('outer'):
+        for i in range(2):
+            with t.span('inner', bytes=10) as s:
+                s.add('retries', i)
+    with pytest.raises(ValueError):
+        with t.span('failing'):
+            raise ValueError()
+
+    inner = [s for s in t.spans if s.name == 'inner']
+    assert [s.parent.name for s in inner] == ['outer', 'outer']
+    assert [s.error for s in t.spans if s.name == 'failing'] == ['ValueError']
+
+    summary = dict((total['name'], total) for total in t.summary())
+    assert summary['inner']['count'] == 2
+    assert summary['inner']['bytes'] == 20
+    assert summary['inner']['retries'] == 1
+
+
+def test_write_chrome_trace(tmpdir):
+    t = Tracer()
+    t.enabled = True
+    with t.span('phase', bytes=5):
+        pass
+    path = str(tmpdir.join('trace.json'))
+    t.write(path, FORMAT_CHROME)
+
+    event, = json.load(open(path))['traceEvents']
+    assert event['name'] == 'phase'
+    assert event['ph'] == 'X'
+    assert event['args'] == {'bytes': 5}
+
+
+def test_cli_trace_file(tmpdir):
+    tracer.reset()
+    path = str(tmpdir.join('trace.jsonl'))
+    result = CliRunner().invoke(cli.cli, ['--timings', '--trace-file', path, 'configure',
+                                          'aws.profile_name'])
+    assert result.exit_code == 0
+    assert not tracer.enabled
+
+    spans = [json.loads(line) for line in open(path)]
+    assert [s['name'] for s in spans] == ['command.configure']
+    assert 'command.configure' in result.output
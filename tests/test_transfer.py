@@ -0,0 +1,201 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+
+from mozilla_addon_signer.transfer import (
+    UMASK, AtomicFile, HashingReader, RangedReader, SpooledBuffer, download_object,
+    transfer_config, upload_fileobj)
+
+
+class FakeS3Client(object):
+    def __init__(self):
+        self.objects = {}
+        self.ranges = []
+        self.truncate = False
+        self.lock = threading.Lock()
+
+    def upload_fileobj(self, fileobj, bucket, key, Config=None):
+        self.seekable = hasattr(fileobj, 'seek')
+        parts = []
+        for chunk in iter(lambda: fileobj.read(Config.multipart_chunksize), b''):
+            parts.append(chunk)
+        self.objects[(bucket, key)] = b''.join(parts)
+        self.config = Config
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.objects[(Bucket, Key)]), 'ETag': '"v1"'}
+
+    def get_object(self, Bucket, Key, Range, IfMatch=None):
+        assert IfMatch == '"v1"'
+        start, end = [int(n) for n in Range[len('bytes='):].split('-')]
+        with self.lock:
+            self.ranges.append((start, end))
+        data = self.objects[(Bucket, Key)][start:end + 1]
+        if self.truncate:
+            data = data[:-1]
+        return {'Body': io.BytesIO(data)}
+
+
+class TestHashingReader(object):
+    def test_hashes_what_is_read(self):
+        data = os.urandom(200000)
+        reader = HashingReader(io.BytesIO(data))
+        while reader.read(4096):
+            pass
+        assert reader.bytes_read == len(data)
+        assert reader.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+class TestUploadFileobj(object):
+    def test_upload_returns_checksum(self):
+        data = os.urandom(300000)
+        client = FakeS3Client()
+        checksum = upload_fileobj(client, io.BytesIO(data), 'input', 'test.xpi',
+                                  part_size=65536, max_concurrency=2)
+        assert client.objects[('input', 'test.xpi')] == data
+        assert checksum == hashlib.sha256(data).hexdigest()
+        # Hashing inline only works if boto3 reads the file once, front to back.
+        assert not client.seekable
+        assert client.config.multipart_chunksize == 65536
+        assert client.config.max_concurrency == 2
+
+    def test_known_checksums_are_not_recomputed(self):
+        client = FakeS3Client()
+        checksum = upload_fileobj(client, io.BytesIO(b'data'), 'input', 'test.xpi',
+                                  checksum='known')
+        assert client.objects[('input', 'test.xpi')] == b'data'
+        assert checksum == 'known'
+
+    def test_transfer_config_defaults_from_strings(self):
+        config = transfer_config('1048576', '8')
+        assert config.multipart_chunksize == 1048576
+        assert config.max_in_memory_upload_chunks == 8
+
+
+class TestRangedDownload(object):
+    def test_reads_ranges_in_order(self):
+        data = os.urandom(100000)
+        client = FakeS3Client()
+        client.objects[('output', 'signed.xpi')] = data
+
+        with RangedReader(client, 'output', 'signed.xpi', part_size=30000,
+                          max_concurrency=3) as reader:
+            assert reader.size == len(data)
+            chunks = list(iter(lambda: reader.read(7000), b''))
+        assert b''.join(chunks) == data
+        assert sorted(client.ranges) == [
+            (0, 29999), (30000, 59999), (60000, 89999), (90000, 99999)]
+
+    def test_download_object(self, tmpdir):
+        data = os.urandom(100000)
+        client = FakeS3Client()
+        client.objects[('output', 'signed.xpi')] = data
+        dest = str(tmpdir.join('signed.xpi'))
+
+        size, checksum = download_object(client, 'output', 'signed.xpi', dest, part_size=16384)
+        assert size == len(data)
+        assert checksum == hashlib.sha256(data).hexdigest()
+        with open(dest, 'rb') as f:
+            assert f.read() == data
+
+    def test_atomic_file_modes(self, tmpdir):
+        path = str(tmpdir.join('signed.xpi'))
+        with AtomicFile(path) as f:
+            f.write(b'new')
+        assert os.stat(path).st_mode & 0o777 == 0o666 & ~UMASK
+
+        os.chmod(path, 0o640)
+        with AtomicFile(path) as f:
+            f.write(b'replaced')
+        assert os.stat(path).st_mode & 0o777 == 0o640
+        assert tmpdir.listdir() == [tmpdir.join('signed.xpi')]
+
+    def test_failed_download_leaves_dest_alone(self, tmpdir):
+        client = FakeS3Client()
+        client.objects[('output', 'signed.xpi')] = os.urandom(50000)
+        client.truncate = True
+        dest = tmpdir.join('signed.xpi')
+        dest.write('old')
+
+        with pytest.raises(RangedReader.IncompleteRead):
+            download_object(client, 'output', 'signed.xpi', str(dest), part_size=16384)
+        assert dest.read() == 'old'
+        assert tmpdir.listdir() == [dest]
+
+    def test_check_runs_before_the_rename(self, tmpdir):
+        client = FakeS3Client()
+        client.objects[('output', 'signed.xpi')] = b'signed'
+        dest = tmpdir.join('signed.xpi')
+        dest.write('old')
+        checked = []
+
+        def check(path):
+            checked.append(open(path, 'rb').read())
+            raise ValueError('bad')
+
+        with pytest.raises(ValueError):
+            download_object(client, 'output', 'signed.xpi', str(dest), check=check)
+        assert checked == [b'signed']
+        assert dest.read() == 'old'
+        assert tmpdir.listdir() == [dest]
+
+        download_object(client, 'output', 'signed.xpi', str(dest), check=checked.append)
+        assert dest.read_binary() == b'signed'
+
+
+class TestSpooledBuffer(object):
+    def test_small_contents_stay_in_memory(self):
+        with SpooledBuffer('addon.xpi', max_memory=100) as buffer:
+            buffer.write(b'a' * 60)
+            buffer.write(b'b' * 40)
+            assert buffer.in_memory
+            assert buffer.size == 100
+            # Readers are independent of each other.
+            first, second = buffer.open(), buffer.open()
+            assert first.read(10) == b'a' * 10
+            assert second.read() == b'a' * 60 + b'b' * 40
+
+    def test_spills_past_max_memory(self):
+        with SpooledBuffer('dir/addon.xpi', max_memory=100) as buffer:
+            buffer.write(b'a' * 60)
+            buffer.write(b'b' * 60)
+            assert not buffer.in_memory
+            assert os.path.basename(buffer.path) == 'addon.xpi'
+            with buffer.open() as f:
+                assert f.read() == b'a' * 60 + b'b' * 60
+            path = buffer.path
+        assert not os.path.exists(path)
+        assert not os.path.exists(os.path.dirname(path))
+
+    def test_write_modes(self):
+        with SpooledBuffer('addon.xpi') as buffer:
+            with buffer.open('wb') as f:
+                f.write(b'old')
+            with buffer.open('wb') as f:
+                f.write(b'new')
+            with buffer.open('ab') as f:
+                f.write(b'er')
+            assert buffer.open().read() == b'newer'
+
+    def test_link(self, tmpdir):
+        src = tmpdir.join('cached')
+        src.write_binary(b'cached contents')
+        with SpooledBuffer('addon.xpi') as buffer:
+            buffer.link(str(src))
+            assert buffer.size == len(b'cached contents')
+            assert buffer.open().read() == b'cached contents'
+            with pytest.raises(SpooledBuffer.ReadOnly):
+                buffer.write(b'more')
+        assert src.read_binary() == b'cached contents'
+
+    def test_link_survives_removal(self, tmpdir):
+        # Like a cached blob evicted while the buffer still stands in for it.
+        src = tmpdir.join('cached')
+        src.write_binary(b'cached contents')
+        with SpooledBuffer('addon.xpi') as buffer:
+            buffer.link(str(src))
+            src.remove()
+            assert buffer.open().read() == b'cached contents'
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import threading
+
+import pytest
+
+from mozilla_addon_signer import batch, watch
+
+from .test_batch import FakeSigner
+from .test_xpi import UNSIGNED_BOOTSTRAPPED_PATH, UNSIGNED_WEBX_PATH
+
+
+def make_watcher(tmpdir, **kwargs):
+    src_dir = tmpdir.mkdir('in')
+    out_dir = tmpdir.mkdir('out')
+    pipeline = batch.SigningPipeline(FakeSigner(), 'system', 'prod', output_dir=str(out_dir),
+                                     on_conflict=batch.CONFLICT_RENAME)
+    items = []
+    kwargs.setdefault('settle', 0)
+    kwargs.setdefault('poll_interval', 0.01)
+    watcher = watch.Watcher(str(src_dir), pipeline, callback=items.append, **kwargs)
+    return watcher, src_dir, out_dir, items
+
+
+class TestWatcher(object):
+    def test_signs_existing_files(self, tmpdir):
+        watcher, src_dir, out_dir, items = make_watcher(tmpdir)
+        shutil.copy(UNSIGNED_WEBX_PATH, str(src_dir.join('a.xpi')))
+        shutil.copy(UNSIGNED_BOOTSTRAPPED_PATH, str(src_dir.join('b.xpi')))
+        src_dir.join('notes.txt').write('ignored')
+
+        watcher.run_once()
+
+        assert sorted(i.status for i in items) == [batch.STATUS_SIGNED] * 2
+        assert all(os.path.exists(i.dest) for i in items)
+
+    def test_duplicates_are_signed_once(self, tmpdir):
+        watcher, src_dir, out_dir, items = make_watcher(tmpdir, max_in_flight=1)
+        shutil.copy(UNSIGNED_WEBX_PATH, str(src_dir.join('a.xpi')))
+        shutil.copy(UNSIGNED_WEBX_PATH, str(src_dir.join('copy.xpi')))
+
+        watcher.run_once()
+
+        assert sorted(i.status for i in items) == [watch.STATUS_DUPLICATE, batch.STATUS_SIGNED]
+
+    def test_state_survives_restarts(self, tmpdir):
+        watcher, src_dir, out_dir, items = make_watcher(tmpdir)
+        shutil.copy(UNSIGNED_WEBX_PATH, str(src_dir.join('a.xpi')))
+        watcher.run_once()
+
+        state = json.loads(out_dir.join(watch.STATE_FILE_NAME).read())
+        assert [entry['src'] for entry in state.values()] == [str(src_dir.join('a.xpi'))]
+
+        restarted = watch.Watcher(str(src_dir), watcher.pipeline, settle=0, poll_interval=0.01,
+                                  callback=items.append)
+        restarted.run_once()
+        assert items[-1].status == watch.STATUS_DUPLICATE
+
+    def test_unsettled_files_wait(self, tmpdir):
+        watcher, src_dir, out_dir, items = make_watcher(tmpdir, settle=60)
+        shutil.copy(UNSIGNED_WEBX_PATH, str(src_dir.join('a.xpi')))
+        watcher.scan()
+        watcher.check_pending()
+        watcher.check_pending()
+        watcher.wait()
+        assert items == []
+
+    @pytest.mark.parametrize('use_inotify', [True, False])
+    def test_picks_up_new_files(self, tmpdir, use_inotify):
+        watcher, src_dir, out_dir, items = make_watcher(tmpdir, use_inotify=use_inotify)
+        stop = threading.Event()
+        watcher.callback = lambda item: (items.append(item), stop.set())
+        thread = threading.Thread(target=watcher.run, args=(stop,))
+        thread.start()
+        try:
+            shutil.copy(UNSIGNED_WEBX_PATH, str(src_dir.join('a.xpi')))
+            assert stop.wait(5)
+        finally:
+            stop.set()
+            thread.join()
+        assert items[0].status == batch.STATUS_SIGNED
@@ -1,7 +1,10 @@
 import os
+import zipfile
+
 import pytest
 
-from mozilla_addon_signer.xpi import XPI
+from mozilla_addon_signer.transfer import SpooledBuffer
+from mozilla_addon_signer.xpi import XPI, MemberReader
 
 from . import TESTS_DIR
 
@@ -35,6 +38,14 @@ class TestXPI(object):
         with pytest.raises(XPI.MissingID):
             XPI(NO_ID_XPI_PATH)
 
+    def test_invalid_install_rdf(self, tmpdir):
+        path = str(tmpdir.join('broken.xpi'))
+        with zipfile.ZipFile(path, 'w') as zf:
+            zf.writestr('install.rdf', '<RDF><Description>')
+
+        with pytest.raises(XPI.InvalidXPI):
+            XPI(path)
+
     def test_sha256sum(self):
         xpi = XPI(UNSIGNED_BOOTSTRAPPED_PATH)
         assert xpi.sha256sum == 'd5379e26f2b118c97136846dbbe50bd1c68aad434cf9ce0258b96f424030406e'
@@ -62,3 +73,56 @@ class TestXPI(object):
 
         xpi = XPI(SIGNED_BOOTSTRAPPED_PATH)
         assert xpi.suggested_filename() == 'empty@mozilla.com-1.0.0-signed.xpi'
+
+    def test_certificate(self):
+        xpi = XPI(SIGNED_WEBX_PATH)
+        assert xpi.certificate.startswith(b'\x30')
+
+        xpi = XPI(UNSIGNED_WEBX_PATH)
+        assert xpi.certificate is None
+
+    def test_open_member(self):
+        xpi = XPI(UNSIGNED_WEBX_PATH)
+        assert xpi.has_member('nothing.js')
+        assert sorted(xpi.namelist()) == ['manifest.json', 'nothing.js']
+        with xpi.open_member('nothing.js') as f:
+            assert f.read() == xpi.read_member('nothing.js')
+
+        with pytest.raises(KeyError):
+            xpi.open_member('missing.js')
+
+    def test_member_reader(self):
+        unsigned = XPI(UNSIGNED_WEBX_PATH)
+        signed = XPI(SIGNED_WEBX_PATH)
+        with MemberReader() as reader:
+            for xpi in (unsigned, signed, unsigned):
+                with reader.open(xpi, 'nothing.js') as f:
+                    assert f.read() == xpi.read_member('nothing.js')
+            # One handle and zip per XPI, however many members are read.
+            assert len(reader._handles) == 4
+        assert reader._handles == []
+
+    @pytest.mark.parametrize('max_memory', [1024 * 1024, 16])
+    def test_load_from_buffer(self, max_memory):
+        with open(SIGNED_WEBX_PATH, 'rb') as f:
+            data = f.read()
+        with SpooledBuffer('addon.xpi', max_memory=max_memory) as buffer:
+            buffer.write(data)
+            xpi = XPI(buffer)
+            assert xpi.path == 'addon.xpi'
+            assert xpi.size == len(data)
+            assert xpi.id == 'nothing-web-extension@mozilla.com'
+            assert xpi.sha256sum == XPI(SIGNED_WEBX_PATH).sha256sum
+            assert xpi.read_member('nothing.js') == XPI(SIGNED_WEBX_PATH).read_member('nothing.js')
+
+    def test_buffer_checksum_is_reused(self):
+        with open(SIGNED_WEBX_PATH, 'rb') as f:
+            data = f.read()
+        with SpooledBuffer('addon.xpi') as buffer:
+            buffer.write(data)
+            buffer.sha256 = 'streamed'
+            assert XPI(buffer).sha256sum == 'streamed'
+            # Writing more invalidates a checksum computed earlier.
+            buffer.truncate()
+            buffer.write(data)
+            assert XPI(buffer).sha256sum == XPI(SIGNED_WEBX_PATH).sha256sum